@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.0/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -64,6 +65,7 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'main.context_processors.navbar',
             ],
         },
     },
@@ -79,9 +81,45 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # A file rather than the in-memory default, so threaded tests get
+        # real SQLite locking instead of shared-cache table locks
+        'TEST': {
+            'NAME': BASE_DIR / 'test_db.sqlite3',
+        },
+        # Persistent connections, so the pragmas below run once per
+        # connection rather than once per request
+        'CONN_MAX_AGE': 600,
+        'CONN_HEALTH_CHECKS': True,
     }
 }
 
+# Applied to every new SQLite connection by main.db.configure_sqlite. In WAL
+# mode readers no longer wait for cart writes (and the reverse); NORMAL
+# sync is still durable against application crashes in WAL mode
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': 5000,
+    'mmap_size': 256 * 1024 * 1024,
+    'cache_size': -64 * 1024,  # KiB, so 64 MiB
+    'temp_store': 'MEMORY',
+}
+
+# Alias that catalog reads (products, categories, images) are routed to, or
+# None to read everything from 'default'. To serve them from a second
+# connection or a replica file, add e.g.
+#
+#     DATABASES['catalog'] = {
+#         'ENGINE': 'django.db.backends.sqlite3',
+#         'NAME': BASE_DIR / 'db.sqlite3',  # or the replica's path
+#         'CONN_MAX_AGE': 600,
+#         'TEST': {'MIRROR': 'default'},
+#     }
+#     CATALOG_READ_DATABASE = 'catalog'
+CATALOG_READ_DATABASE = None
+
+DATABASE_ROUTERS = ['main.db.CatalogReadRouter']
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.0/ref/settings/#auth-password-validators
@@ -122,9 +160,74 @@ STATIC_URL = 'static/'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# Media URLs carry a content hash (?v=) so main.media.serve can send them
+# as immutable
+STORAGES = {
+    'default': {'BACKEND': 'main.media.VersionedMediaStorage'},
+    'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+}
+# 'X-Sendfile' (Apache, lighttpd) or 'X-Accel-Redirect' (nginx) to let the
+# front proxy send media bytes; the nginx internal location for
+# MEDIA_ACCEL_REDIRECT_PREFIX must alias MEDIA_ROOT
+MEDIA_SENDFILE_HEADER = None
+MEDIA_ACCEL_REDIRECT_PREFIX = '/protected-media/'
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.0/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
-LOGIN_URL = 'login'
\ No newline at end of file
+LOGIN_URL = 'login'
+
+# The navbar state, favorites, product pages and CacheCartBackend carts are
+# cached, and every web and worker process must see the same copies: a
+# change seen by one process drops its entries for all of them. Set
+# REDIS_URL wherever more than one process serves the shop; the per-process
+# locmem cache left without it is only fit for one process, and
+# `check --deploy` reports it (main.E001).
+REDIS_URL = os.environ.get('REDIS_URL')
+if REDIS_URL:
+    CACHES = {'default': {'BACKEND': 'django.core.cache.backends.redis.RedisCache', 'LOCATION': REDIS_URL}}
+else:
+    CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+# Where carts live between clicks: 'main.cart.DatabaseCartBackend' writes
+# Order/OrderProduct rows on every click, 'main.cart.CacheCartBackend' keeps
+# them in the CART_CACHE_ALIAS cache until checkout
+CART_BACKEND = 'main.cart.DatabaseCartBackend'
+CART_CACHE_ALIAS = 'default'
+CART_CACHE_TIMEOUT = 60 * 60 * 24 * 14
+# Seconds a cart add holds stock before release_expired_reservations frees it
+STOCK_RESERVATION_TTL = 60 * 15
+
+# Payment providers by the name in the payment page URL, see main.payments.
+# Charges run in the payment_worker command, never in a web request
+PAYMENT_PROVIDERS = {
+    'Tinkoff_bank': 'main.payments.FakeProvider',
+    'ZberBank': 'main.payments.FakeProvider',
+    'UMoney': 'main.payments.FakeProvider',
+}
+# Seconds every FakeProvider call takes, and the share of calls that fail
+PAYMENT_FAKE_LATENCY = 0.5
+PAYMENT_FAKE_FAILURE_RATE = 0.0
+# A failed charge is retried after PAYMENT_RETRY_DELAY seconds, doubling up
+# to PAYMENT_RETRY_MAX_DELAY, until PAYMENT_MAX_ATTEMPTS attempts were made
+PAYMENT_MAX_ATTEMPTS = 5
+PAYMENT_RETRY_DELAY = 5
+PAYMENT_RETRY_MAX_DELAY = 60 * 5
+# Seconds a worker holds a job before another worker may take it over
+PAYMENT_LEASE = 60
+
+# Resized WebP/JPEG copies of product images, built by main.images in a
+# process pool (or inline when IMAGE_DERIVATIVES_SYNC is set)
+IMAGE_DERIVATIVE_WIDTHS = (320, 640, 1280)
+IMAGE_DERIVATIVE_WORKERS = 2
+IMAGE_DERIVATIVES_SYNC = False
+
+# Tokens accepted by the product feed (Authorization: Bearer <token> or
+# ?token=), staff users can read it without one
+FEED_TOKENS = []
+
+# Seconds shared caches may reuse a catalog API response before revalidating
+# it with its ETag
+API_CACHE_MAX_AGE = 60
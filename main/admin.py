@@ -1,16 +1,172 @@
-from django.contrib import admin
+from django import forms
+from django.contrib import admin, messages
+from django.db.models import Sum
 from .models import *
+from . import inventory, refunds
+from .pagination import EstimatedCountPaginator
+
+
+class ShopAdmin(admin.ModelAdmin):
+	"""
+	Changelists that stay fast on big tables: no COUNT(*) over the whole
+	table, neither for the paginator nor for the "N total" next to filters.
+	"""
+	paginator = EstimatedCountPaginator
+	show_full_result_count = False
+	list_per_page = 50
+
+
+class ProductAdminForm(forms.ModelForm):
+	restock = forms.IntegerField(
+		required=False, label='Изменить кол-во на',
+		help_text='Прибавляется к текущему кол-ву товара, отрицательное число списывает товар',
+	)
+
+	class Meta:
+		model = Product
+		fields = '__all__'
+
+
+@admin.register(Product)
+class ProductAdmin(ShopAdmin):
+	list_display = ('id', 'title', 'category', 'price', 'discount_price', 'product_qt', 'reserved_qt')
+	list_select_related = ('category',)
+	list_filter = ('product_type_label',)
+	# Exact slug or title prefix, both served by an index
+	search_fields = ('=slug', '^title')
+	raw_id_fields = ('image_content',)
+	form = ProductAdminForm
+
+	def get_readonly_fields(self, request, obj=None):
+		# save() does not write stock back, it is changed by the restock field
+		return ('product_qt',) if obj is not None else ()
+
+	def save_model(self, request, obj, form, change):
+		super().save_model(request, obj, form, change)
+		if form.cleaned_data.get('restock'):
+			try:
+				inventory.restock(obj.pk, form.cleaned_data['restock'])
+			except inventory.OutOfStock:
+				self.message_user(request, 'Кол-во товара не изменено: столько товара зарезервировано', messages.ERROR)
+
+
+@admin.register(OrderProduct)
+class OrderProductAdmin(ShopAdmin):
+	list_display = ('id', 'user', 'product', 'quantity', 'order_status')
+	list_select_related = ('user', 'product')
+	list_filter = ('order_status',)
+	raw_id_fields = ('user',)
+	autocomplete_fields = ('product',)
+
+
+@admin.register(Order)
+class OrderAdmin(ShopAdmin):
+	list_display = (
+		'id', 'user', 'ref_code', 'ordered', 'ordered_date', 'total', 'item_count',
+		'being_delivered', 'recieved', 'refund_requested', 'refund_granted',
+	)
+	list_select_related = ('user',)
+	list_filter = ('ordered', 'being_delivered', 'recieved', 'refund_requested', 'refund_granted')
+	search_fields = ('=ref_code', '=user__username')
+	raw_id_fields = ('user', 'products', 'shipping_address', 'billing_address', 'payment', 'coupon')
+	actions = ('mark_being_delivered', 'mark_received', 'grant_refunds', 'deny_refunds')
+
+	def _updated(self, request, count, text):
+		self.message_user(request, f'{text}: {count}', messages.SUCCESS)
+
+	# Every action is one UPDATE over the selection, however many orders it holds
+
+	@admin.action(description='Отметить как доставляемые')
+	def mark_being_delivered(self, request, queryset):
+		self._updated(request, queryset.filter(ordered=True).update(being_delivered=True), 'Доставляются')
+
+	@admin.action(description='Отметить как полученные')
+	def mark_received(self, request, queryset):
+		self._updated(request, queryset.filter(ordered=True).update(being_delivered=False, recieved=True), 'Получены')
+
+	@admin.action(description='Одобрить возврат')
+	def grant_refunds(self, request, queryset):
+		self._updated(request, refunds.process_refunds(pks=queryset.values_list('pk', flat=True)), 'Возврат одобрен')
+
+	@admin.action(description='Отклонить возврат')
+	def deny_refunds(self, request, queryset):
+		self._updated(request, refunds.process_refunds(pks=queryset.values_list('pk', flat=True), grant=False), 'Возврат отклонен')
+
+
+@admin.register(Address)
+class AddressAdmin(ShopAdmin):
+	list_display = ('id', 'user', 'street_address', 'county', 'zip', 'address_type', 'default')
+	list_select_related = ('user',)
+	list_filter = ('address_type', 'default')
+	raw_id_fields = ('user',)
+
+
+@admin.register(Payment)
+class PaymentAdmin(ShopAdmin):
+	list_display = ('id', 'user', 'stripe_charge_id', 'amount', 'timestamp')
+	list_select_related = ('user',)
+	raw_id_fields = ('user',)
+
+
+@admin.register(PaymentJob)
+class PaymentJobAdmin(ShopAdmin):
+	list_display = ('id', 'idempotency_key', 'user', 'provider', 'amount', 'status', 'attempts', 'run_at')
+	list_select_related = ('user',)
+	list_filter = ('status',)
+	search_fields = ('=idempotency_key',)
+	raw_id_fields = ('order', 'user', 'payment')
+
+
+@admin.register(Refund)
+class RefundAdmin(ShopAdmin):
+	list_display = ('id', 'order', 'email', 'accepted')
+	list_select_related = ('order__user',)
+	list_filter = ('accepted',)
+	raw_id_fields = ('order',)
+
+
+@admin.register(Favorite)
+class FavoriteAdmin(ShopAdmin):
+	list_display = ('id', 'user')
+	list_select_related = ('user',)
+	raw_id_fields = ('user', 'fav_products')
+
+
+@admin.register(UserProfile)
+class UserProfileAdmin(ShopAdmin):
+	list_display = ('id', 'user', 'one_click_purchasing')
+	list_select_related = ('user',)
+	raw_id_fields = ('user',)
+
+
+@admin.register(ImageProductContent)
+class ImageProductContentAdmin(ShopAdmin):
+	list_display = ('id', 'image', 'user')
+	list_select_related = ('user',)
+	raw_id_fields = ('user',)
 
 
 admin.site.register(ProductCategory)
 admin.site.register(ForProductCategory)
-admin.site.register(ImageProductContent)
-admin.site.register(Product)
-admin.site.register(OrderProduct)
-admin.site.register(Order)
-admin.site.register(Address)
-admin.site.register(Payment)
-admin.site.register(Coupon)
-admin.site.register(Refund)
-admin.site.register(Favorite)
-admin.site.register(UserProfile)
\ No newline at end of file
+
+
+class CouponCounterInline(admin.TabularInline):
+	model = CouponCounter
+	fields = readonly_fields = ('shard', 'used', 'capacity')
+	extra = 0
+	max_num = 0
+	can_delete = False
+
+
+@admin.register(Coupon)
+class CouponAdmin(ShopAdmin):
+	list_display = ('id', 'code', 'amount', 'valid_from', 'valid_until', 'max_uses', 'max_uses_per_user', 'used')
+	search_fields = ('=code',)
+	inlines = (CouponCounterInline,)
+
+	def get_queryset(self, request):
+		return super().get_queryset(request).annotate(used=Sum('counters__used'))
+
+	@admin.display(description='Использовано', ordering='used')
+	def used(self, coupon):
+		return coupon.used or 0
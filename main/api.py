@@ -0,0 +1,156 @@
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.http import JsonResponse
+from django.urls import reverse
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition, require_safe
+
+from .models import CatalogVersion, ForProductCategory, Product, ProductCategory
+from .pagination import KeysetPaginator
+
+
+PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+PRODUCT_LIST_FIELDS = ('id', 'title', 'slug', 'price', 'discount_price', 'short_description', 'poster', 'category_id')
+
+
+def _catalog_version(request):
+	# Both validators come from the same row, read it once per request
+	if not hasattr(request, '_catalog_version'):
+		request._catalog_version = CatalogVersion.current()
+	return request._catalog_version
+
+
+def _etag(request, *args, **kwargs):
+	return f'catalog-{_catalog_version(request)[0]}'
+
+
+def _last_modified(request, *args, **kwargs):
+	return _catalog_version(request)[1]
+
+
+def catalog_endpoint(view):
+	"""
+	Read-only, public catalog view. Every response carries an ETag and a
+	Last-Modified taken from CatalogVersion, so a conditional request that
+	matches is answered with a 304 after that single lookup.
+	"""
+	view = condition(etag_func=_etag, last_modified_func=_last_modified)(view)
+	view = cache_control(public=True, max_age=settings.API_CACHE_MAX_AGE)(view)
+	return require_safe(view)
+
+
+def _json(data, status=200):
+	return JsonResponse(data, status=status, json_dumps_params={'ensure_ascii': False})
+
+
+def _not_found():
+	return _json({'detail': 'Not found'}, status=404)
+
+
+def _media_url(name):
+	return default_storage.url(name) if name else None
+
+
+def _product(product):
+	return {
+		'id': product.pk,
+		'title': product.title,
+		'slug': product.slug,
+		'price': str(product.price),
+		'discount_price': str(product.discount_price),
+		'short_description': product.short_description,
+		'poster': _media_url(product.poster.name),
+		'subcategory': product.category_id,
+		'url': reverse('api_product', args=[product.pk]),
+	}
+
+
+def _page_url(request, **params):
+	query = request.GET.copy()
+	for key in ('after', 'before'):
+		query.pop(key, None)
+	query.update(params)
+	return f'{request.path}?{query.urlencode()}'
+
+
+@catalog_endpoint
+def products(request):
+	"""
+	Products newest first, ``?subcategory=<id>`` narrows them down. Pages are
+	keyset paginated, follow ``next`` and ``previous``.
+	"""
+	queryset = Product.objects.only(*PRODUCT_LIST_FIELDS)
+	try:
+		if request.GET.get('subcategory'):
+			queryset = queryset.filter(category_id=int(request.GET['subcategory']))
+		limit = min(int(request.GET.get('limit', PAGE_SIZE)), MAX_PAGE_SIZE)
+	except ValueError:
+		return _json({'detail': 'subcategory and limit must be integers'}, status=400)
+	if limit < 1:
+		return _json({'detail': 'limit must be positive'}, status=400)
+	page = KeysetPaginator(queryset, limit).page(
+		after=request.GET.get('after'),
+		before=request.GET.get('before'),
+	)
+	return _json({
+		'results': [_product(product) for product in page],
+		'next': _page_url(request, after=page.next_cursor) if page.has_next else None,
+		'previous': _page_url(request, before=page.prev_cursor) if page.has_previous else None,
+	})
+
+
+@catalog_endpoint
+def product(request, product_id):
+	product = (
+		Product.objects.select_related('category__category')
+		.prefetch_related('image_content')
+		.filter(pk=product_id)
+		.first()
+	)
+	if product is None:
+		return _not_found()
+	subcategory = product.category
+	return _json(_product(product) | {
+		'description': product.description,
+		'product_type_label': product.product_type_label,
+		'subcategory': {'id': subcategory.pk, 'name': subcategory.name, 'slug': subcategory.slug},
+		'category': {'id': subcategory.category.pk, 'name': subcategory.category.name, 'slug': subcategory.category.slug},
+		'images': [_media_url(content.image.name) for content in product.image_content.all()],
+	})
+
+
+def _subcategory(subcategory):
+	return {
+		'id': subcategory.pk,
+		'name': subcategory.name,
+		'slug': subcategory.slug,
+		'product_count': subcategory.product_count,
+		'products': f'{reverse("api_products")}?subcategory={subcategory.pk}',
+	}
+
+
+@catalog_endpoint
+def categories(request):
+	return _json({'results': [
+		{
+			'id': category.pk,
+			'name': category.name,
+			'slug': category.slug,
+			'product_count': category.product_count,
+			'subcategories': [_subcategory(subcategory) for subcategory in category.pod.all()],
+		}
+		for category in ProductCategory.objects.order_by('pk').prefetch_related('pod')
+	]})
+
+
+@catalog_endpoint
+def subcategory(request, subcategory_id):
+	subcategory = ForProductCategory.objects.select_related('category').filter(pk=subcategory_id).first()
+	if subcategory is None:
+		return _not_found()
+	category = subcategory.category
+	return _json(_subcategory(subcategory) | {
+		'category': {'id': category.pk, 'name': category.name, 'slug': category.slug},
+	})
@@ -5,3 +5,11 @@ class MainConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'main'
     verbose_name = 'Главное приложение'
+
+    def ready(self):
+        from django.db.backends.signals import connection_created
+
+        from . import checks, signals
+        from .db import configure_sqlite
+
+        connection_created.connect(configure_sqlite)
@@ -0,0 +1,479 @@
+import random
+import statistics
+import threading
+import time
+
+from django.contrib.auth.models import User
+from django.db import close_old_connections, connection, connections
+from django.test.utils import override_settings
+
+from .models import Product, ProductCategory, ForProductCategory
+
+
+SCENARIOS = {}
+
+
+def scenario(name):
+	def register(func):
+		SCENARIOS[name] = func
+		return func
+	return register
+
+
+class Result:
+
+	def __init__(self, label, operations, elapsed, latencies, errors=0):
+		self.label = label
+		self.operations = operations
+		self.elapsed = elapsed
+		self.latencies = sorted(latencies)
+		self.errors = errors
+
+	@property
+	def throughput(self):
+		return self.operations / self.elapsed if self.elapsed else 0
+
+	def percentile(self, q):
+		if not self.latencies:
+			return 0
+		return self.latencies[min(len(self.latencies) - 1, int(len(self.latencies) * q))]
+
+	def __str__(self):
+		return (
+			f'{self.label:<40} {self.operations:>7} ops {self.throughput:>10.1f} ops/s '
+			f'p50 {self.percentile(0.5) * 1000:>7.2f}ms p95 {self.percentile(0.95) * 1000:>7.2f}ms '
+			f'p99 {self.percentile(0.99) * 1000:>7.2f}ms errors {self.errors}'
+		)
+
+
+def run_concurrently(label, clients, operations, func):
+	"""
+	Runs ``func(client_index, operation_index)`` ``operations`` times in each of
+	``clients`` threads and times every call.
+	"""
+	latencies, errors = [], []
+	lock = threading.Lock()
+	barrier = threading.Barrier(clients + 1)
+
+	def client(index):
+		local, failed = [], 0
+		barrier.wait()
+		for op in range(operations):
+			started = time.perf_counter()
+			try:
+				func(index, op)
+			except Exception:
+				failed += 1
+			local.append(time.perf_counter() - started)
+		with lock:
+			latencies.extend(local)
+			errors.append(failed)
+		connection.close()
+
+	threads = [threading.Thread(target=client, args=(i,)) for i in range(clients)]
+	for thread in threads:
+		thread.start()
+	barrier.wait()
+	started = time.perf_counter()
+	for thread in threads:
+		thread.join()
+	elapsed = time.perf_counter() - started
+	close_old_connections()
+	return Result(label, clients * operations, elapsed, latencies, sum(errors))
+
+
+def create_catalog(products=100):
+	category, _ = ProductCategory.objects.get_or_create(slug='bench', defaults={'name': 'Bench'})
+	subcategory, _ = ForProductCategory.objects.get_or_create(slug='bench', category=category, defaults={'name': 'Bench'})
+	Product.objects.bulk_create([
+		Product(
+			title=f'Bench product {i}', price=100 + i, discount_price=120 + i, category=subcategory,
+			product_type_label='P', slug=f'bench-product-{i}', description='Bench', short_description='Bench',
+			product_qt=1000,
+		)
+		for i in range(products)
+	])
+	return list(Product.objects.filter(category=subcategory).values_list('pk', flat=True))
+
+
+def create_users(count, prefix='bench'):
+	users = [User.objects.create_user(f'{prefix}-{i}') for i in range(count)]
+	return users
+
+
+@scenario('cart')
+def cart_scenario(clients, operations, **options):
+	"""
+	Add-to-cart write throughput of the database and cache cart backends.
+	"""
+	from .cart import get_cart_backend
+
+	product_ids = create_catalog()
+	results = []
+	for backend in ('main.cart.DatabaseCartBackend', 'main.cart.CacheCartBackend'):
+		users = create_users(clients, prefix=backend.rsplit('.', 1)[-1])
+		with override_settings(CART_BACKEND=backend):
+			cart = get_cart_backend()
+			results.append(run_concurrently(
+				f'cart add ({backend.rsplit(".", 1)[-1]})', clients, operations,
+				lambda client, op: cart.add(users[client], random.choice(product_ids)),
+			))
+	return results
+
+
+def flash_sale(stock, buyers, units_per_buyer):
+	"""
+	``buyers`` threads each put ``units_per_buyer`` units of one hot product in
+	their cart and check out. Returns the timing result, the product id and
+	the number of units that were sold.
+	"""
+	from . import inventory
+	from .cart import complete_order, get_cart_backend, open_order_id
+	from .models import Order
+
+	product_id = create_catalog(products=1)[0]
+	Product.objects.filter(pk=product_id).update(product_qt=stock)
+	users = create_users(buyers, prefix='flash-sale')
+	cart = get_cart_backend()
+
+	def buy(client, op):
+		user = users[client]
+		try:
+			inventory.reserve(user, product_id)
+		except inventory.OutOfStock:
+			pass
+		else:
+			cart.add(user, product_id)
+		if op == units_per_buyer - 1:
+			order = Order.objects.filter(pk=open_order_id(user)).first()
+			complete_order(order)
+
+	result = run_concurrently(
+		f'flash sale ({buyers} buyers, {stock} units)', buyers, units_per_buyer, buy,
+	)
+	sold = sum(
+		Order.objects.filter(user__in=users, ordered=True)
+		.values_list('products__quantity', flat=True)
+		.exclude(products__quantity=None)
+	)
+	return result, product_id, sold
+
+
+@scenario('inventory')
+def inventory_scenario(clients, operations, **options):
+	"""
+	Reserve-and-checkout throughput on a single hot SKU with less stock than demand.
+	"""
+	result, product_id, sold = flash_sale(stock=clients * operations // 2, buyers=clients, units_per_buyer=operations)
+	product = Product.objects.get(pk=product_id)
+	result.label += f' sold {sold}, left {product.product_qt}'
+	return [result]
+
+
+# Connection settings compared by the readwrite scenario
+SQLITE_PROFILES = {
+	'rollback journal': {'journal_mode': 'DELETE', 'synchronous': 'FULL', 'busy_timeout': 5000},
+	'tuned': None,  # settings.SQLITE_PRAGMAS
+}
+
+
+@scenario('readwrite')
+def readwrite_scenario(clients, operations, **options):
+	"""
+	Catalog reads and cart writes side by side, half the clients each, under
+	every SQLITE_PROFILES entry.
+	"""
+	from django.conf import settings
+
+	from .cart import get_cart_backend
+
+	product_ids = create_catalog(products=500)
+	subcategory_id = Product.objects.values_list('category_id', flat=True).first()
+	cart = get_cart_backend()
+	writers = max(clients // 2, 1)
+	results = []
+	for profile, pragmas in SQLITE_PROFILES.items():
+		users = create_users(writers, prefix=f'readwrite-{len(results)}')
+		latencies = {'read': [], 'write': []}
+		lock = threading.Lock()
+
+		def visit(client, op):
+			started = time.perf_counter()
+			if client < writers:
+				kind = 'write'
+				cart.add(users[client], random.choice(product_ids))
+			else:
+				kind = 'read'
+				list(Product.objects.filter(category_id=subcategory_id).order_by('-pk')[:24])
+				Product.objects.get(pk=random.choice(product_ids))
+			with lock:
+				latencies[kind].append(time.perf_counter() - started)
+
+		with override_settings(SQLITE_PRAGMAS=pragmas or settings.SQLITE_PRAGMAS):
+			# Reconnect alone, the journal mode only changes without other connections
+			connections.close_all()
+			connection.ensure_connection()
+			total = run_concurrently(f'{profile}: all', clients, operations, visit)
+		results += [
+			Result(f'{profile}: {kind}s', len(latencies[kind]), total.elapsed, latencies[kind])
+			for kind in ('read', 'write')
+		]
+		results.append(total)
+	return results
+
+
+@scenario('asgi')
+def asgi_scenario(clients, operations, **options):
+	"""
+	Requests through the ASGI handler from 1, 10 and ``clients`` concurrent
+	connections, each logged in as its own shopper and sending ``operations``
+	requests that cycle through the catalog, cart and favorites pages.
+	"""
+	import asyncio
+
+	from asgiref.sync import async_to_sync
+	from django.test import AsyncClient
+
+	product_ids = create_catalog(products=200)
+	users = create_users(clients, prefix='asgi')
+	async_clients = []
+	for user in users:
+		client = AsyncClient(raise_request_exception=False)
+		# The session is created here, force_login has no async variant
+		client.cookies = _logged_in_cookies(user)
+		async_clients.append(client)
+	referer = {'headers': {'referer': '/'}}
+	paths = [
+		('/', {}),
+		('/category-list/', {}),
+		('/product-detail-{product}/', {}),
+		('/add-to-cart/{product}/', referer),
+		('/favorites/add/{product}/', referer),
+		('/favorites/', {}),
+	]
+
+	async def connection_loop(client, index, latencies, errors):
+		for op in range(operations):
+			path, extra = paths[(index + op) % len(paths)]
+			started = time.perf_counter()
+			response = await client.get(path.format(product=product_ids[(index * 7 + op) % len(product_ids)]), **extra)
+			latencies.append(time.perf_counter() - started)
+			errors[0] += response.status_code >= 400
+
+	async def run(count):
+		latencies, errors = [], [0]
+		started = time.perf_counter()
+		await asyncio.gather(*(
+			connection_loop(client, index, latencies, errors)
+			for index, client in enumerate(async_clients[:count])
+		))
+		return Result(f'asgi, {count} connections', len(latencies), time.perf_counter() - started, latencies, errors[0])
+
+	# AsyncClient always sends Host: testserver
+	with override_settings(ALLOWED_HOSTS=['testserver']):
+		return [async_to_sync(run)(count) for count in sorted({1, min(10, clients), clients})]
+
+
+def _logged_in_cookies(user):
+	from django.test import Client
+
+	client = Client()
+	client.force_login(user)
+	return client.cookies
+
+
+@scenario('checkout')
+def checkout_scenario(clients, operations, **options):
+	"""
+	Checkout form submissions with the default addresses, the way a shopper
+	resubmits the form, from ``clients`` logged-in shoppers with a cart each.
+	"""
+	from django.db import connection as default_connection
+	from django.test import Client
+	from django.test.utils import CaptureQueriesContext
+
+	from .cart import get_cart_backend
+	from .models import Address
+
+	product_ids = create_catalog(products=50)
+	users = create_users(clients, prefix='checkout')
+	cart = get_cart_backend()
+	Address.objects.bulk_create([
+		Address(
+			user=user, street_address='Ленина 1', apartment_address='5', county='RU', zip='101000',
+			address_type=address_type, default=True,
+		)
+		for user in users for address_type in ('S', 'B')
+	])
+	sessions = []
+	for user in users:
+		for product_id in random.sample(product_ids, 3):
+			cart.add(user, product_id)
+		client = Client(raise_request_exception=False)
+		client.force_login(user)
+		sessions.append(client)
+	form = {'use_default_shipping': 'on', 'use_default_billing': 'on', 'payment_option': 'U'}
+
+	def submit(client, op):
+		response = sessions[client].post('/cart/checkout/', form)
+		if response.status_code != 302 or 'payment-procedure' not in response['Location']:
+			raise AssertionError(response.status_code)
+
+	with override_settings(ALLOWED_HOSTS=['testserver']):
+		with CaptureQueriesContext(default_connection) as queries:
+			submit(0, 0)
+		label = f'checkout ({len(queries)} queries per submission)'
+		return [run_concurrently(label, clients, operations, submit)]
+
+
+@scenario('payments')
+def payments_scenario(clients, operations, **options):
+	"""
+	Payment checkout against a provider answering in 50ms: ``clients``
+	shoppers enqueueing ``operations`` payments each, then the worker
+	draining the same number of jobs with 1 and with ``clients`` threads.
+	"""
+	from django.db.models import F
+
+	from . import payments
+	from .cart import get_cart_backend
+	from .models import Order, PaymentJob
+
+	latency = 0.05
+	product_ids = create_catalog(products=50)
+	cart = get_cart_backend()
+	results = []
+	with override_settings(PAYMENT_FAKE_LATENCY=latency, PAYMENT_FAKE_FAILURE_RATE=0.0):
+		for concurrency in (1, clients):
+			users = create_users(clients * operations, prefix=f'payments-{concurrency}')
+
+			def pay(client, op):
+				user = users[client * operations + op]
+				cart.add(user, random.choice(product_ids))
+				payments.enqueue(Order.objects.get(user=user, ordered=False), 'UMoney')
+
+			results.append(run_concurrently('enqueue', clients, operations, pay))
+			worker = payments.Worker(concurrency=concurrency, poll_interval=0.01)
+			started = time.perf_counter()
+			worker.run(burst=True)
+			elapsed = time.perf_counter() - started
+			jobs = PaymentJob.objects.filter(user__in=users)
+			# Enqueue to placed order, queueing included
+			waited = [
+				duration.total_seconds()
+				for duration in jobs.filter(status='succeeded').annotate(waited=F('updated') - F('created')).values_list('waited', flat=True)
+			]
+			label = f'worker x{concurrency} (ceiling {concurrency / latency:.0f}/s)'
+			results.append(Result(label, worker.processed, elapsed, waited, jobs.exclude(status='succeeded').count()))
+	return results
+
+
+@scenario('refunds')
+def refunds_scenario(clients, operations, **options):
+	"""
+	Granting ``clients * operations`` requested refunds by ref code, an
+	order at a time the way the admin would, and with one process_refunds call.
+	"""
+	from django.utils import timezone
+
+	from . import refunds
+	from .cart import create_ref_code
+	from .models import Order, Refund
+
+	count = clients * operations
+	user = create_users(1, prefix='refunds')[0]
+	results = []
+	for label in ('one order at a time', 'process_refunds'):
+		codes = [create_ref_code() for _ in range(count)]
+		orders = Order.objects.bulk_create([
+			Order(user=user, ordered=True, ordered_date=timezone.now(), ref_code=code, refund_requested=True)
+			for code in codes
+		])
+		Refund.objects.bulk_create([Refund(order=order, reason_for='Bench', email='bench@example.com') for order in orders])
+		started = time.perf_counter()
+		if label == 'process_refunds':
+			refunds.process_refunds(codes)
+		else:
+			for code in codes:
+				order = Order.objects.get(ref_code=code)
+				order.refund_granted = True
+				order.save()
+				for refund in Refund.objects.filter(order=order):
+					refund.accepted = True
+					refund.save()
+		elapsed = time.perf_counter() - started
+		results.append(Result(label, count, elapsed, [elapsed]))
+	return results
+
+
+@scenario('product_page')
+def product_page_scenario(clients, operations, **options):
+	"""
+	Product detail pages from ``clients`` logged-in shoppers, with every
+	page body rendered afresh and then with a warm product page cache.
+	"""
+	from django.test import Client
+
+	from . import product_pages
+
+	product_ids = create_catalog(products=50)
+	sessions = []
+	for user in create_users(clients, prefix='product-page'):
+		client = Client(raise_request_exception=False)
+		client.force_login(user)
+		sessions.append(client)
+	results = []
+	with override_settings(ALLOWED_HOSTS=['testserver']):
+		for label in ('cold', 'warm'):
+			cold = label == 'cold'
+			for product_id in product_ids:
+				sessions[0].get(f'/product-detail-{product_id}/')
+			product_pages.reset_stats()
+
+			def view(client, op):
+				product_id = random.choice(product_ids)
+				if cold:
+					product_pages.bump(product_id)
+				if sessions[client].get(f'/product-detail-{product_id}/').status_code != 200:
+					raise AssertionError(product_id)
+
+			result = run_concurrently(label, clients, operations, view)
+			stats = product_pages.stats()
+			result.label += f' ({stats["hits"]} hits, {stats["misses"]} misses)'
+			results.append(result)
+	return results
+
+
+@scenario('coupons')
+def coupons_scenario(clients, operations, **options):
+	"""
+	``clients`` shoppers redeeming one code ``operations`` times each, with
+	its limit counted on a single row and split across the shards.
+	"""
+	from decimal import Decimal
+	from unittest import mock
+
+	from . import coupons
+	from .cart import add_product
+	from .models import Coupon, Order
+
+	product_ids = create_catalog(products=10)
+	count = clients * operations
+	results = []
+	for shards in (1, coupons.COUPON_SHARDS):
+		users = create_users(count, prefix=f'coupons-{shards}')
+		for user in users:
+			add_product(user, random.choice(product_ids))
+		orders = dict(Order.objects.filter(user__in=users, ordered=False).values_list('user_id', 'pk'))
+		code = f'BENCH{shards}'
+		with mock.patch.object(coupons, 'COUPON_SHARDS', shards):
+			coupon = Coupon.objects.create(code=code, amount=Decimal('10'), max_uses=count)
+
+			def redeem(client, op):
+				user = users[client * operations + op]
+				coupons.apply(user, orders[user.pk], code)
+
+			result = run_concurrently(f'{shards} counter row(s)', clients, operations, redeem)
+		result.label += f' ({coupons.redeemed(coupon.pk)} redeemed)'
+		results.append(result)
+	return results
@@ -0,0 +1,492 @@
+import random
+import secrets
+import string
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.db import IntegrityError, connection, transaction
+from django.db.models import DecimalField, F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce, Round
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import Coupon, Order, OrderProduct, Product
+
+
+# Creates the open cart line or bumps its quantity in one statement. Selecting
+# from main_product makes a missing product return no row instead of failing
+# the deferred foreign key check at commit.
+_UPSERT_LINE = '''
+	INSERT INTO main_orderproduct (user_id, product_id, order_status, quantity)
+	SELECT %s, id, %s, 1 FROM main_product WHERE id = %s
+	ON CONFLICT (user_id, product_id) WHERE NOT order_status
+	DO UPDATE SET quantity = quantity + 1
+	RETURNING id, quantity
+'''
+
+_DECREMENT_LINE = '''
+	UPDATE main_orderproduct SET quantity = quantity - 1
+	WHERE user_id = %s AND product_id = %s AND NOT order_status
+	RETURNING id, quantity
+'''
+
+_DELETE_LINE = '''
+	DELETE FROM main_orderproduct
+	WHERE user_id = %s AND product_id = %s AND NOT order_status
+	RETURNING id, quantity
+'''
+
+# Writes a line with an absolute quantity, used when a cached cart is saved
+_SET_LINE = '''
+	INSERT INTO main_orderproduct (user_id, product_id, order_status, quantity)
+	SELECT %s, id, %s, %s FROM main_product WHERE id = %s
+	ON CONFLICT (user_id, product_id) WHERE NOT order_status
+	DO UPDATE SET quantity = excluded.quantity
+	RETURNING id
+'''
+
+_LINK_LINE = 'INSERT OR IGNORE INTO main_order_products (order_id, orderproduct_id) VALUES (%s, %s)'
+
+_UNLINK_LINE = 'DELETE FROM main_order_products WHERE orderproduct_id = %s'
+
+# Moves the stored order totals by ``units`` of the product; run before the
+# line is unlinked, since the order is found through the link table
+_BUMP_ORDER_TOTALS = '''
+	UPDATE main_order SET
+		total = ROUND(total + %s * (SELECT price FROM main_product WHERE id = %s), 2),
+		item_count = item_count + %s
+	WHERE id IN (SELECT order_id FROM main_order_products WHERE orderproduct_id = %s)
+	RETURNING id, total, item_count
+'''
+
+
+class CartBusy(Exception):
+	"""
+	Another request kept the cached cart locked for longer than the backend
+	waits; nothing was changed.
+	"""
+
+
+@dataclass
+class CartState:
+	product_id: int
+	# Quantity of the product left in the cart, 0 once the line is gone
+	quantity: int
+	order_id: int = None
+	item_count: int = 0
+	total: Decimal = Decimal(0)
+
+
+def _money(value):
+	return Decimal(str(value)).quantize(Decimal('0.01'))
+
+
+def open_order_id(user):
+	order_id = Order.objects.filter(user=user, ordered=False).values_list('pk', flat=True).first()
+	if order_id is None:
+		try:
+			with transaction.atomic():
+				order_id = Order.objects.create(user=user, ordered_date=timezone.now()).pk
+		except IntegrityError:
+			# Another request opened the cart first
+			order_id = Order.objects.filter(user=user, ordered=False).values_list('pk', flat=True).get()
+	return order_id
+
+
+def in_cart(user, product_id):
+	return OrderProduct.objects.filter(user=user, product_id=product_id, order_status=False).exists()
+
+
+def _bump_order(cursor, state, line_id, units):
+	cursor.execute(_BUMP_ORDER_TOTALS, [units, state.product_id, units, line_id])
+	row = cursor.fetchone()
+	if row is not None:
+		state.order_id, total, state.item_count = row
+		state.total = _money(total)
+	return state
+
+
+def add_product(user, product_id):
+	"""
+	Adds one unit of the product to the user's open order.
+	Raises ``Product.DoesNotExist`` if there is no such product.
+	"""
+	order_id = open_order_id(user)
+	with transaction.atomic(), connection.cursor() as cursor:
+		cursor.execute(_UPSERT_LINE, [user.pk, False, product_id])
+		row = cursor.fetchone()
+		if row is None:
+			raise Product.DoesNotExist
+		line_id, quantity = row
+		cursor.execute(_LINK_LINE, [order_id, line_id])
+		return _bump_order(cursor, CartState(product_id, quantity, order_id), line_id, 1)
+
+
+def decrement_product(user, product_id):
+	"""
+	Takes one unit of the product out of the cart, dropping the line when it
+	reaches zero. Returns ``None`` if the product is not in the cart.
+	"""
+	with transaction.atomic(), connection.cursor() as cursor:
+		cursor.execute(_DECREMENT_LINE, [user.pk, product_id])
+		row = cursor.fetchone()
+		if row is None:
+			return None
+		line_id, quantity = row
+		state = _bump_order(cursor, CartState(product_id, max(quantity, 0)), line_id, -1)
+		if quantity <= 0:
+			cursor.execute(_UNLINK_LINE, [line_id])
+			cursor.execute('DELETE FROM main_orderproduct WHERE id = %s', [line_id])
+		return state
+
+
+def remove_product(user, product_id):
+	"""
+	Drops the product's line from the cart whatever its quantity.
+	Returns ``None`` if the product is not in the cart.
+	"""
+	with transaction.atomic(), connection.cursor() as cursor:
+		cursor.execute(_DELETE_LINE, [user.pk, product_id])
+		row = cursor.fetchone()
+		if row is None:
+			return None
+		line_id, quantity = row
+		state = _bump_order(cursor, CartState(product_id, 0), line_id, -quantity)
+		cursor.execute(_UNLINK_LINE, [line_id])
+		return state
+
+
+def _line_sum(expression):
+	return Sum(expression, output_field=DecimalField(max_digits=12, decimal_places=2))
+
+
+def calculate_totals(order_id):
+	"""
+	Order totals straight from the order lines, in one aggregate query.
+	"""
+	totals = OrderProduct.objects.filter(order=order_id).aggregate(
+		total=Coalesce(_line_sum(F('quantity') * F('product__price')), Decimal(0)),
+		discount_total=Coalesce(_line_sum(F('quantity') * F('product__discount_price')), Decimal(0)),
+		item_count=Coalesce(Sum('quantity'), 0),
+	)
+	totals['total'] = _money(totals['total'])
+	totals['discount_total'] = _money(totals['discount_total'])
+	# discount_price is the price before the discount, shown struck through
+	totals['saved'] = totals['discount_total'] - totals['total']
+	return totals
+
+
+def total_subqueries():
+	"""
+	Correlated subqueries computing an order's total and item count from its
+	lines, for annotating or bulk-updating ``Order`` querysets.
+	"""
+	lines = OrderProduct.objects.filter(order=OuterRef('pk')).values('order')
+	total = lines.annotate(value=Round(_line_sum(F('quantity') * F('product__price')), 2)).values('value')
+	item_count = lines.annotate(value=Sum('quantity')).values('value')
+	return (
+		Coalesce(Subquery(total, output_field=DecimalField(max_digits=12, decimal_places=2)), Decimal(0)),
+		Coalesce(Subquery(item_count), 0),
+	)
+
+
+def reprice_open_orders(product_id):
+	# A price change invalidates the stored totals of every cart holding the product
+	total, item_count = total_subqueries()
+	Order.objects.filter(ordered=False, products__product_id=product_id, products__order_status=False).update(
+		total=total, item_count=item_count,
+	)
+
+
+@dataclass
+class CartLine:
+	product: Product
+	quantity: int
+
+	def get_total_price(self):
+		return self.quantity * self.product.price
+
+
+@dataclass
+class CartSummary:
+	"""
+	A cart that only lives in the cache. Mirrors the ``Order`` attributes the
+	cart templates read, so both backends render through the same templates.
+	"""
+	lines: list = field(default_factory=list)
+	item_count: int = 0
+	total: Decimal = Decimal(0)
+	discount_total: Decimal = Decimal(0)
+	saved: Decimal = Decimal(0)
+	coupon: object = None
+
+	def get_total(self):
+		if self.coupon:
+			return max(self.total - self.coupon.amount, Decimal(0))
+		return self.total
+
+
+# Seconds the navbar state of a user stays cached; every cart and order write
+# drops it sooner through forget_navbar
+NAVBAR_TIMEOUT = 60 * 60
+
+
+def _navbar_key(user_id):
+	return f'navbar:{user_id}'
+
+
+def navbar_state(user):
+	"""
+	Returns ``{'has_orders': bool, 'item_count': int}`` for the navbar of
+	every page, from the cache when possible.
+	"""
+	key = _navbar_key(user.pk)
+	state = cache.get(key)
+	if state is None:
+		item_count = get_cart_backend().item_count(user)
+		state = {
+			'has_orders': item_count > 0 or Order.objects.filter(user=user).exists(),
+			'item_count': item_count,
+		}
+		cache.set(key, state, NAVBAR_TIMEOUT)
+	return state
+
+
+def forget_navbar(user):
+	# After commit, so a concurrent page view cannot cache the old state again
+	user_id = user.pk
+	transaction.on_commit(lambda: cache.delete(_navbar_key(user_id)))
+
+
+class DatabaseCartBackend:
+	"""
+	Keeps the cart in Order/OrderProduct rows, every click is a short write
+	transaction.
+	"""
+
+	def add(self, user, product_id):
+		state = add_product(user, product_id)
+		forget_navbar(user)
+		return state
+
+	def decrement(self, user, product_id):
+		state = decrement_product(user, product_id)
+		forget_navbar(user)
+		return state
+
+	def remove(self, user, product_id):
+		state = remove_product(user, product_id)
+		forget_navbar(user)
+		return state
+
+	def item_count(self, user):
+		return Order.objects.filter(user=user, ordered=False).values_list('item_count', flat=True).first() or 0
+
+	def contains(self, user, product_id):
+		return in_cart(user, product_id)
+
+	def summary(self, user):
+		"""
+		Returns ``(order, lines)`` for the cart pages, or ``None`` without a cart.
+		"""
+		order = Order.objects.select_related('coupon').filter(user=user, ordered=False).first()
+		if order is None:
+			return None
+		totals = calculate_totals(order.pk)
+		order.discount_total, order.saved = totals['discount_total'], totals['saved']
+		return order, order.products.select_related('product')
+
+	def materialize(self, user):
+		return Order.objects.filter(user=user, ordered=False).first()
+
+	def clear(self, user):
+		pass
+
+
+class CacheCartBackend:
+	"""
+	Keeps the cart as a ``{product_id: quantity}`` dict in the cache and only
+	writes Order/OrderProduct rows when the user checks out. Clicks cost one
+	read query for product prices and no database writes.
+	"""
+	# Seconds to wait for another request's lock on the cart, and the most a
+	# lock is held: far longer than a cart update, so a slow holder keeps it
+	lock_timeout = 5
+	lock_ttl = 60
+
+	def __init__(self):
+		self.cache = caches[settings.CART_CACHE_ALIAS]
+		self.timeout = settings.CART_CACHE_TIMEOUT
+
+	def _key(self, user):
+		return f'cart:{user.pk}'
+
+	@contextmanager
+	def _locked(self, user):
+		# cache.add is atomic on the locmem, memcached and redis backends, so it
+		# serializes read-modify-write cycles of one user's cart across processes
+		lock_key = f'{self._key(user)}:lock'
+		token = secrets.token_hex(8)
+		deadline = time.monotonic() + self.lock_timeout
+		while not self.cache.add(lock_key, token, self.lock_ttl):
+			if time.monotonic() > deadline:
+				raise CartBusy(f'Cart of user {user.pk} is locked')
+			time.sleep(0.001)
+		try:
+			yield
+		finally:
+			# Only our own lock, one that expired may belong to another request
+			if self.cache.get(lock_key) == token:
+				self.cache.delete(lock_key)
+
+	def _items(self, user):
+		return self.cache.get(self._key(user)) or {}
+
+	def _state(self, items, product_id, prices=None):
+		if prices is None:
+			prices = dict(Product.objects.filter(pk__in=items).values_list('pk', 'price'))
+		return CartState(
+			product_id,
+			items.get(product_id, 0),
+			item_count=sum(items.values()),
+			total=_money(sum((prices.get(pk, 0) * quantity for pk, quantity in items.items()), Decimal(0))),
+		)
+
+	def add(self, user, product_id):
+		with self._locked(user):
+			items = self._items(user)
+			items[product_id] = items.get(product_id, 0) + 1
+			prices = dict(Product.objects.filter(pk__in=items).values_list('pk', 'price'))
+			if product_id not in prices:
+				raise Product.DoesNotExist
+			self.cache.set(self._key(user), items, self.timeout)
+		forget_navbar(user)
+		return self._state(items, product_id, prices)
+
+	def _change(self, user, product_id, quantity):
+		with self._locked(user):
+			items = self._items(user)
+			if product_id not in items:
+				return None
+			items[product_id] = quantity(items[product_id])
+			if items[product_id] <= 0:
+				del items[product_id]
+			self.cache.set(self._key(user), items, self.timeout)
+		forget_navbar(user)
+		return self._state(items, product_id)
+
+	def decrement(self, user, product_id):
+		return self._change(user, product_id, lambda quantity: quantity - 1)
+
+	def remove(self, user, product_id):
+		return self._change(user, product_id, lambda quantity: 0)
+
+	def contains(self, user, product_id):
+		return product_id in self._items(user)
+
+	def item_count(self, user):
+		return sum(self._items(user).values())
+
+	def summary(self, user):
+		items = self._items(user)
+		if not items:
+			return None
+		products = Product.objects.in_bulk(items)
+		lines = [CartLine(products[pk], quantity) for pk, quantity in items.items() if pk in products]
+		total = sum((line.get_total_price() for line in lines), Decimal(0))
+		discount_total = sum((line.quantity * line.product.discount_price for line in lines), Decimal(0))
+		cart = CartSummary(
+			lines=lines,
+			item_count=sum(line.quantity for line in lines),
+			total=total,
+			discount_total=discount_total,
+			saved=discount_total - total,
+			# Applying a coupon writes the open order, the coupon is kept there
+			coupon=Coupon.objects.filter(order__user=user, order__ordered=False).first(),
+		)
+		return cart, lines
+
+	def materialize(self, user):
+		"""
+		Writes the cached cart into the user's open order and returns it.
+		"""
+		items = self._items(user)
+		if not items:
+			return Order.objects.filter(user=user, ordered=False).first()
+		order_id = open_order_id(user)
+		with transaction.atomic(), connection.cursor() as cursor:
+			cursor.execute(
+				'DELETE FROM main_order_products WHERE order_id = %s AND orderproduct_id IN '
+				'(SELECT id FROM main_orderproduct WHERE user_id = %s AND NOT order_status)',
+				[order_id, user.pk],
+			)
+			OrderProduct.objects.filter(user=user, order_status=False).exclude(product_id__in=items).delete()
+			for product_id, quantity in items.items():
+				cursor.execute(_SET_LINE, [user.pk, False, quantity, product_id])
+				row = cursor.fetchone()
+				if row is not None:
+					cursor.execute(_LINK_LINE, [order_id, row[0]])
+			total, item_count = total_subqueries()
+			Order.objects.filter(pk=order_id).update(total=total, item_count=item_count)
+		forget_navbar(user)
+		return Order.objects.get(pk=order_id)
+
+	def clear(self, user):
+		self.cache.delete(self._key(user))
+		forget_navbar(user)
+
+
+REF_CODE_ATTEMPTS = 5
+
+
+def create_ref_code():
+	return ''.join(random.choices(string.ascii_lowercase + string.digits, k=20))
+
+
+def with_ref_code(update):
+	"""
+	Runs ``update(ref_code)`` with a fresh random code and returns its result.
+	Order.ref_code is unique, so a code already taken fails the update and
+	it is retried with another one.
+	"""
+	for _ in range(REF_CODE_ATTEMPTS - 1):
+		try:
+			with transaction.atomic():
+				return update(create_ref_code())
+		except IntegrityError:
+			pass
+	return update(create_ref_code())
+
+
+def complete_order(order):
+	"""
+	Places the open order: marks it ordered, gives it a ref_code unless it
+	has one, freezes its lines and turns the user's stock reservations into
+	sold stock, all in one transaction. Returns ``False`` if the order was
+	already placed, raises ``inventory.OutOfStock`` (and changes nothing) if
+	stock ran out.
+	"""
+	from . import inventory
+
+	with transaction.atomic():
+		# The guard write goes first: it makes a resubmission a no-op and takes
+		# the write lock before anything is read
+		placed = with_ref_code(lambda ref_code: Order.objects.filter(pk=order.pk, ordered=False).update(
+			ordered=True, ordered_date=timezone.now(), ref_code=Coalesce(F('ref_code'), Value(ref_code)),
+		))
+		if not placed:
+			return False
+		lines = list(OrderProduct.objects.filter(order=order, order_status=False).values_list('pk', 'product_id', 'quantity'))
+		inventory.commit(order.user, [(product_id, quantity) for _, product_id, quantity in lines])
+		OrderProduct.objects.filter(pk__in=[pk for pk, _, _ in lines]).update(order_status=True)
+	get_cart_backend().clear(order.user)
+	forget_navbar(order.user)
+	return True
+
+
+def get_cart_backend():
+	return import_string(settings.CART_BACKEND)()
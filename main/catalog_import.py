@@ -0,0 +1,341 @@
+import csv
+import gzip
+import json
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from decimal import Decimal, InvalidOperation
+from itertools import islice
+
+from django.db import transaction
+from django.utils import timezone
+from django.utils.text import Truncator
+
+from . import images, inventory, product_pages, search
+from .cart import total_subqueries
+from .datagen import batched
+from .facets import rebuild_facets
+from .models import (
+	SHORT_DESCRIPTION_LENGTH, TYPE_PRODUCT_LABELS, CatalogVersion, ForProductCategory, ImageProductContent, Order, Product,
+	ProductCategory,
+)
+
+
+KINDS = ('subcategories', 'products')
+
+# CSV cells holding several image references separate them with this
+IMAGE_SEPARATOR = '|'
+
+# Stock is left out, inventory.set_stock applies it without going below holds
+PRODUCT_UPDATE_FIELDS = [
+	'title', 'price', 'discount_price', 'category', 'product_type_label', 'description', 'short_description',
+	'modified',
+]
+
+# Largest stock a PositiveSmallIntegerField holds on every backend
+MAX_PRODUCT_QT = 32767
+
+_LABELS = {label for label, _ in TYPE_PRODUCT_LABELS}
+
+
+class InvalidRecord(ValueError):
+	pass
+
+
+def read_records(path):
+	"""
+	Yields the records of a ``.csv`` or ``.jsonl`` file (optionally ``.gz``
+	compressed) one at a time. A JSON line that is not an object is yielded
+	as an ``InvalidRecord``, so it keeps its position and is skipped like any
+	other bad record.
+	"""
+	name = path[:-3] if path.endswith('.gz') else path
+	extension = os.path.splitext(name)[1].lower()
+	if extension not in ('.csv', '.jsonl'):
+		raise ValueError(f'{path}: expected a .csv or .jsonl file')
+	opener = gzip.open if path.endswith('.gz') else open
+	with opener(path, 'rt', encoding='utf-8', newline='') as file:
+		if extension == '.csv':
+			yield from csv.DictReader(file)
+		else:
+			for line in file:
+				if line.strip():
+					yield _json_record(line)
+
+
+def _json_record(line):
+	try:
+		record = json.loads(line)
+	except ValueError as e:
+		return InvalidRecord(f'bad JSON: {e}')
+	if not isinstance(record, dict):
+		return InvalidRecord('bad JSON: expected an object')
+	return record
+
+
+def _valid(record):
+	if isinstance(record, InvalidRecord):
+		raise record
+	return record
+
+
+def _required(record, field):
+	value = record.get(field)
+	if value in (None, ''):
+		raise InvalidRecord(f'missing {field}')
+	return str(value).strip()
+
+
+def _decimal(value, field):
+	try:
+		number = Decimal(str(value))
+		if not number.is_finite():
+			raise InvalidOperation
+		return number.quantize(Decimal('0.01'))
+	except InvalidOperation:
+		raise InvalidRecord(f'bad {field} {value!r}')
+
+
+def _image_list(value):
+	if not value:
+		return []
+	if isinstance(value, str):
+		return [ref.strip() for ref in value.split(IMAGE_SEPARATOR) if ref.strip()]
+	return list(value)
+
+
+def load_checkpoint(path):
+	if path and os.path.exists(path):
+		with open(path) as file:
+			return json.load(file)
+	return {}
+
+
+def save_checkpoint(path, state):
+	# Written next to the target and renamed, so a crash never leaves half a file
+	temporary = f'{path}.tmp'
+	with open(temporary, 'w') as file:
+		json.dump(state, file)
+	os.replace(temporary, path)
+
+
+class CatalogImporter:
+	"""
+	Streams records from files into the catalog. Records are upserted by slug
+	in batches, one transaction per batch; image references are fetched and
+	resized by a thread pool while the next batches are written.
+
+	With a checkpoint file, the number of records of each input that are fully
+	imported (images included) is saved after every batch, and a later run
+	skips them.
+	"""
+
+	def __init__(self, kind, batch_size=1000, workers=4, user=None, checkpoint=None, progress=None):
+		if kind not in KINDS:
+			raise ValueError(f'Unknown kind {kind!r}')
+		self.kind = kind
+		self.batch_size = batch_size
+		self.workers = workers
+		self.user = user
+		self.checkpoint = checkpoint
+		self.progress = progress or (lambda stats: None)
+		self.stats = {'read': 0, 'upserted': 0, 'skipped': 0, 'images': 0, 'image_errors': 0, 'errors': []}
+		self._categories = dict(ProductCategory.objects.values_list('slug', 'pk'))
+		self._subcategories = dict(ForProductCategory.objects.values_list('slug', 'pk'))
+		self._executor = None
+		# future -> (product_id, 'poster' or 'gallery', source)
+		self._futures = {}
+		# [position, futures] of batches whose images are still being fetched
+		self._pending = []
+
+	def _error(self, position, message):
+		self.stats['skipped'] += 1
+		if len(self.stats['errors']) < 20:
+			self.stats['errors'].append(f'record {position}: {message}')
+
+	@property
+	def rate(self):
+		elapsed = time.perf_counter() - self._started
+		return self.stats['read'] / elapsed if elapsed else 0
+
+	def run(self, paths):
+		self._started = time.perf_counter()
+		state = load_checkpoint(self.checkpoint)
+		with ThreadPoolExecutor(max_workers=self.workers) as self._executor:
+			for path in paths:
+				key = os.path.abspath(path)
+				position = state.get(key, 0)
+				for batch in batched(islice(read_records(path), position, None), self.batch_size):
+					futures = self._write(batch, position)
+					position += len(batch)
+					self.stats['read'] += len(batch)
+					self._pending.append([position, futures])
+					self._collect(block=len(self._futures) > self.workers * 32)
+					self._save(state, key)
+					self.progress(self.stats)
+				while self._futures:
+					self._collect(block=True)
+				self._save(state, key)
+		self._finish()
+		self.progress(self.stats)
+		return self.stats
+
+	def _save(self, state, key):
+		done = None
+		while self._pending and not (self._pending[0][1] & self._futures.keys()):
+			done = self._pending.pop(0)[0]
+		if done is not None and self.checkpoint:
+			state[key] = done
+			save_checkpoint(self.checkpoint, state)
+
+	def _write(self, records, position):
+		with transaction.atomic():
+			if self.kind == 'subcategories':
+				self._write_subcategories(records, position)
+				return set()
+			return self._write_products(records, position)
+
+	def _write_subcategories(self, records, position):
+		rows = {}
+		for offset, record in enumerate(records):
+			try:
+				record = _valid(record)
+				slug = _required(record, 'slug')
+				rows[slug] = (_required(record, 'name'), _required(record, 'category'), record.get('category_name'))
+			except InvalidRecord as e:
+				self._error(position + offset, e)
+
+		missing = {}
+		for _, category, name in rows.values():
+			if category not in self._categories:
+				missing[category] = name or missing.get(category) or category
+		if missing:
+			ProductCategory.objects.bulk_create(
+				[ProductCategory(slug=slug, name=name) for slug, name in missing.items()],
+				ignore_conflicts=True,
+			)
+			self._categories.update(ProductCategory.objects.filter(slug__in=missing).values_list('slug', 'pk'))
+
+		ForProductCategory.objects.bulk_create(
+			[ForProductCategory(slug=slug, name=name, category_id=self._categories[category]) for slug, (name, category, _) in rows.items()],
+			update_conflicts=True, unique_fields=['slug'], update_fields=['name', 'category'],
+		)
+		self._subcategories.update(ForProductCategory.objects.filter(slug__in=rows).values_list('slug', 'pk'))
+		self.stats['upserted'] += len(rows)
+
+	def _product(self, record):
+		record = _valid(record)
+		slug = _required(record, 'slug')
+		subcategory = _required(record, 'subcategory')
+		if subcategory not in self._subcategories:
+			raise InvalidRecord(f'unknown subcategory {subcategory!r}')
+		price = _decimal(_required(record, 'price'), 'price')
+		label = record.get('product_type_label') or 'P'
+		if label not in _LABELS:
+			raise InvalidRecord(f'bad product_type_label {label!r}')
+		description = record.get('description') or ''
+		try:
+			quantity = int(record.get('product_qt') or 0)
+		except (TypeError, ValueError):
+			quantity = -1
+		if not 0 <= quantity <= MAX_PRODUCT_QT:
+			raise InvalidRecord(f'bad product_qt {record["product_qt"]!r}')
+		return Product(
+			slug=slug,
+			title=_required(record, 'title'),
+			price=price,
+			discount_price=_decimal(record['discount_price'], 'discount_price') if record.get('discount_price') else price,
+			category_id=self._subcategories[subcategory],
+			product_type_label=label,
+			description=description,
+			short_description=Truncator(description).chars(SHORT_DESCRIPTION_LENGTH),
+			product_qt=quantity,
+		)
+
+	def _write_products(self, records, position):
+		products, image_refs = {}, {}
+		for offset, record in enumerate(records):
+			try:
+				product = self._product(record)
+			except InvalidRecord as e:
+				self._error(position + offset, e)
+				continue
+			# A slug repeated within a batch keeps its last record
+			products[product.slug] = product
+			image_refs[product.slug] = (record.get('poster') or None, _image_list(record.get('images')))
+
+		Product.objects.bulk_create(
+			products.values(), update_conflicts=True, unique_fields=['slug'], update_fields=PRODUCT_UPDATE_FIELDS,
+		)
+		inventory.set_stock({slug: product.product_qt for slug, product in products.items()})
+		self.stats['upserted'] += len(products)
+
+		futures = set()
+		wanted = {slug: refs for slug, refs in image_refs.items() if refs[0] or refs[1]}
+		if wanted:
+			if self.user is None:
+				raise ValueError('Importing images needs a user to own them')
+			for slug, pk in Product.objects.filter(slug__in=wanted).values_list('slug', 'pk'):
+				poster, gallery = wanted[slug]
+				if poster:
+					futures.add(self._submit(poster, 'product_posters/', pk, 'poster'))
+				for ref in gallery:
+					futures.add(self._submit(ref, 'product_images/', pk, 'gallery'))
+		return futures
+
+	def _submit(self, source, upload_to, product_id, role):
+		future = self._executor.submit(images.import_image, source, upload_to)
+		self._futures[future] = (product_id, role, source)
+		return future
+
+	def _collect(self, block=False):
+		"""
+		Stores the images fetched so far on their products.
+		"""
+		if block and self._futures:
+			wait(self._futures, return_when=FIRST_COMPLETED)
+		done = [future for future in self._futures if future.done()]
+		posters, gallery = {}, {}
+		for future in done:
+			product_id, role, source = self._futures.pop(future)
+			if future.exception() is not None:
+				self.stats['image_errors'] += 1
+				if len(self.stats['errors']) < 20:
+					self.stats['errors'].append(f'image {source}: {future.exception()}')
+				continue
+			self.stats['images'] += 1
+			if role == 'poster':
+				posters[product_id] = future.result()
+			else:
+				gallery.setdefault(product_id, set()).add(future.result())
+		if posters or gallery:
+			with transaction.atomic():
+				self._attach(posters, gallery)
+
+	def _attach(self, posters, gallery):
+		if posters:
+			now = timezone.now()
+			updates = [Product(pk=pk, poster=name, modified=now) for pk, name in posters.items()]
+			Product.objects.bulk_update(updates, ['poster', 'modified'], batch_size=self.batch_size)
+		if gallery:
+			Through = Product.image_content.through
+			existing = set(
+				Through.objects.filter(product_id__in=gallery)
+				.values_list('product_id', 'imageproductcontent__image')
+			)
+			new = [(pk, name) for pk, names in gallery.items() for name in names if (pk, name) not in existing]
+			contents = ImageProductContent.objects.bulk_create([ImageProductContent(user=self.user, image=name) for _, name in new])
+			Through.objects.bulk_create([
+				Through(product_id=pk, imageproductcontent_id=content.pk) for (pk, _), content in zip(new, contents)
+			])
+
+	def _finish(self):
+		# bulk_create skips the signals that keep rollups, the search index,
+		# product pages and open cart totals in step, so they are rebuilt once here
+		rebuild_facets()
+		search.rebuild_index()
+		CatalogVersion.bump()
+		product_pages.bump_all()
+		if self.kind == 'products':
+			total, item_count = total_subqueries()
+			Order.objects.filter(ordered=False).update(total=total, item_count=item_count)
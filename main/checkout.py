@@ -0,0 +1,115 @@
+from django.db import transaction
+from django.db.models import Q
+
+from .cart import get_cart_backend
+from .models import Address, Order
+
+
+# Payment page for every CheckOutForm.payment_option
+PAYMENT_PAGES = {
+	'T': 'Tinkoff_bank',
+	'Z': 'ZberBank',
+	'U': 'UMoney',
+}
+
+ADDRESS_FIELDS = ('street_address', 'apartment_address', 'county', 'zip')
+
+# (form prefix, address type, message without a default, message for missing fields)
+_ADDRESS_KINDS = (
+	('shipping', 'S', 'По умолчанию этот адрес не доступен', 'Пожалуйста, заполните обязательные поля адреса доставки '),
+	('billing', 'B', 'Нет доступных адресов такого типа по умолчанию', 'Пожалуйста, заполните обязательные поля платежного адреса '),
+)
+
+
+class CheckoutError(Exception):
+	"""
+	The submitted checkout form cannot be applied, the message is for the shopper.
+	"""
+
+
+def default_addresses(user):
+	"""
+	Returns the user's default addresses keyed by address type, in one query.
+	"""
+	return {address.address_type: address for address in Address.objects.filter(user=user, default=True).order_by('pk')}
+
+
+def _form_fields(data, prefix):
+	fields = {
+		'street_address': data.get(f'{prefix}_address'),
+		'apartment_address': data.get(f'{prefix}_address2') or '',
+		'county': data.get(f'{prefix}_country'),
+		'zip': data.get(f'{prefix}_zip'),
+	}
+	if not (fields['street_address'] and fields['county'] and fields['zip']):
+		return None
+	return fields
+
+
+def _matches(address, fields):
+	return address is not None and all(str(getattr(address, name)) == str(fields[name]) for name in ADDRESS_FIELDS)
+
+
+def checkout(user, data):
+	"""
+	Applies cleaned CheckOutForm ``data`` to the user's open order and
+	returns the order. Default addresses and the addresses already on the
+	order are read in one query, then new addresses are written with one
+	insert and the order with one UPDATE, all in one transaction.
+
+	Resubmitting the same form reuses the addresses the order already has,
+	so it writes nothing. Raises ``Order.DoesNotExist`` without a cart and
+	CheckoutError when the addresses cannot be resolved; nothing is written
+	then.
+	"""
+	order = get_cart_backend().materialize(user)
+	if order is None:
+		raise Order.DoesNotExist
+	on_order = {'S': order.shipping_address_id, 'B': order.billing_address_id}
+	known = list(
+		Address.objects.filter(user=user)
+		.filter(Q(default=True) | Q(pk__in=[pk for pk in on_order.values() if pk]))
+		.order_by('pk')
+	)
+	defaults = {address.address_type: address for address in known if address.default}
+	by_pk = {address.pk: address for address in known}
+
+	chosen, make_default = {}, {}
+	for prefix, address_type, no_default, missing_fields in _ADDRESS_KINDS:
+		if address_type == 'B' and data.get('same_billing_address'):
+			fields = {name: getattr(chosen['S'], name) for name in ADDRESS_FIELDS}
+		elif data.get(f'use_default_{prefix}'):
+			if address_type not in defaults:
+				raise CheckoutError(no_default)
+			chosen[address_type] = defaults[address_type]
+			continue
+		else:
+			fields = _form_fields(data, prefix)
+			if fields is None:
+				raise CheckoutError(missing_fields)
+		current = by_pk.get(on_order[address_type])
+		if _matches(current, fields):
+			chosen[address_type] = current
+		else:
+			chosen[address_type] = Address(user=user, address_type=address_type, **fields)
+		if data.get(f'set_default_{prefix}') and not chosen[address_type].default:
+			make_default[address_type] = chosen[address_type]
+
+	new = [address for address in chosen.values() if address.pk is None]
+	changed = (order.shipping_address_id, order.billing_address_id) != (chosen['S'].pk, chosen['B'].pk)
+	if not (make_default or new or changed):
+		return order
+	# The reads above stay outside: a SQLite transaction that reads before
+	# its first write cannot wait for the write lock, it fails as locked
+	with transaction.atomic():
+		if make_default:
+			# Keep one default address per type
+			Address.objects.filter(user=user, default=True, address_type__in=list(make_default)).update(default=False)
+			for address in make_default.values():
+				address.default = True
+			Address.objects.filter(pk__in=[address.pk for address in make_default.values() if address.pk]).update(default=True)
+		Address.objects.bulk_create(new)
+		order.shipping_address = chosen['S']
+		order.billing_address = chosen['B']
+		order.save(update_fields=['shipping_address', 'billing_address'])
+	return order
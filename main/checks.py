@@ -0,0 +1,29 @@
+from django.conf import settings
+from django.core.checks import Error, Tags, register
+
+
+# Backends whose entries only the process that wrote them can see
+PROCESS_LOCAL_CACHES = (
+	'django.core.cache.backends.locmem.LocMemCache',
+	'django.core.cache.backends.dummy.DummyCache',
+)
+
+
+@register(Tags.caches, deploy=True)
+def check_shared_cache(app_configs, **kwargs):
+	"""
+	The shop invalidates cached navbar state, favorites and product pages,
+	and keeps CacheCartBackend carts, in its caches. Deployed with more
+	than one process, a per-process cache leaves the other processes
+	serving stale entries and carts they cannot see.
+	"""
+	errors = []
+	for alias in sorted({'default', settings.CART_CACHE_ALIAS}):
+		backend = settings.CACHES.get(alias, {}).get('BACKEND')
+		if backend in PROCESS_LOCAL_CACHES:
+			errors.append(Error(
+				f'The {alias!r} cache ({backend}) is not shared between processes.',
+				hint='Set REDIS_URL, or point CACHES at redis or memcached.',
+				id='main.E001',
+			))
+	return errors
@@ -0,0 +1,16 @@
+from django.utils.functional import SimpleLazyObject
+
+from .cart import navbar_state
+
+
+def navbar(request):
+	"""
+	Cart presence and item count for base.html. Lazy, so pages that never read
+	it do not touch the cache.
+	"""
+	def state():
+		if not request.user.is_authenticated:
+			return {'has_orders': False, 'item_count': 0}
+		return navbar_state(request.user)
+
+	return {'navbar': SimpleLazyObject(state)}
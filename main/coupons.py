@@ -0,0 +1,174 @@
+import random
+import threading
+import time
+from dataclasses import dataclass
+from decimal import Decimal
+
+from django.db import connection, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .models import Coupon, CouponCounter, Order
+
+
+# Shards a coupon's total limit is split across. Redemptions of one busy code
+# spread over this many counter rows instead of all updating the same one.
+COUPON_SHARDS = 8
+
+# Seconds a coupon looked up by code stays in the in-process cache. Saving
+# or deleting a coupon drops it from the cache of the process that did it;
+# the other processes see the change when their entry expires.
+COUPON_CACHE_TIMEOUT = 60
+
+# Codes kept per process, the oldest entry is dropped past this
+COUPON_CACHE_SIZE = 1024
+
+# Counts a redemption by the user, stopping at the per-user limit: no row
+# comes back once the limit is reached
+_USE_COUPON = '''
+	INSERT INTO main_couponuse (coupon_id, user_id, count) VALUES (%s, %s, 1)
+	ON CONFLICT (coupon_id, user_id)
+	DO UPDATE SET count = count + 1 WHERE count < %s
+	RETURNING count
+'''
+
+
+class CouponError(Exception):
+	"""
+	The code cannot be applied, the message says why and is shown to the user.
+	"""
+
+
+@dataclass(frozen=True)
+class Offer:
+	"""
+	What redeeming a coupon needs to know about it, cached by code.
+	"""
+	pk: int
+	code: str
+	amount: Decimal
+	valid_from: object = None
+	valid_until: object = None
+	max_uses_per_user: int = 1
+
+	def check_window(self, now=None):
+		now = now or timezone.now()
+		if self.valid_from is not None and now < self.valid_from:
+			raise CouponError('Промо-код еще не действует')
+		if self.valid_until is not None and now >= self.valid_until:
+			raise CouponError('Срок действия промо-кода истек')
+
+
+_cache = {}
+_cache_lock = threading.Lock()
+
+
+def lookup(code):
+	"""
+	Returns the ``Offer`` of the coupon with the code, from the in-process
+	cache when possible, or ``None`` if there is no such coupon. Unknown
+	codes are not cached, they cost one lookup in the unique index.
+	"""
+	code = code.strip()
+	with _cache_lock:
+		entry = _cache.get(code)
+	if entry is not None and entry[0] > time.monotonic():
+		return entry[1]
+	coupon = Coupon.objects.filter(code=code).values(
+		'pk', 'code', 'amount', 'valid_from', 'valid_until', 'max_uses_per_user',
+	).first()
+	if coupon is None:
+		return None
+	offer = Offer(**coupon)
+	with _cache_lock:
+		_cache.pop(code, None)
+		while len(_cache) >= COUPON_CACHE_SIZE:
+			del _cache[next(iter(_cache))]
+		_cache[code] = (time.monotonic() + COUPON_CACHE_TIMEOUT, offer)
+	return offer
+
+
+def forget(coupon_id):
+	"""
+	Drops the coupon from this process's cache, whatever code it was cached under.
+	"""
+	with _cache_lock:
+		for code in [code for code, (_, offer) in _cache.items() if offer.pk == coupon_id]:
+			del _cache[code]
+
+
+def clear_cache():
+	with _cache_lock:
+		_cache.clear()
+
+
+def _shares(total, shards):
+	base, extra = divmod(total, shards)
+	return [base + (shard < extra) for shard in range(shards)]
+
+
+def allocate(coupon):
+	"""
+	Splits what is left of the coupon's total limit across its shards,
+	creating them for a new coupon. A shard's capacity is what it has used
+	plus its share of the rest, so lowering max_uses below what was already
+	redeemed closes the coupon rather than going over.
+	"""
+	with transaction.atomic():
+		used = dict(CouponCounter.objects.filter(coupon=coupon).values_list('shard', 'used'))
+		if coupon.max_uses is None:
+			capacities = [None] * COUPON_SHARDS
+		else:
+			left = max(coupon.max_uses - sum(used.values()), 0)
+			capacities = [used.get(shard, 0) + share for shard, share in enumerate(_shares(left, COUPON_SHARDS))]
+		for shard, capacity in enumerate(capacities):
+			if shard in used:
+				CouponCounter.objects.filter(coupon=coupon, shard=shard).update(capacity=capacity)
+			else:
+				CouponCounter.objects.create(coupon=coupon, shard=shard, capacity=capacity)
+
+
+def _take_slot(coupon_id):
+	# Starts at a random shard so concurrent redemptions update different rows
+	start = random.randrange(COUPON_SHARDS)
+	for i in range(COUPON_SHARDS):
+		shard = (start + i) % COUPON_SHARDS
+		if CouponCounter.objects.filter(coupon_id=coupon_id, shard=shard).filter(
+			Q(capacity=None) | Q(used__lt=F('capacity')),
+		).update(used=F('used') + 1):
+			return True
+	return False
+
+
+def redeemed(coupon_id):
+	"""
+	Returns how many times the coupon was redeemed.
+	"""
+	return sum(CouponCounter.objects.filter(coupon_id=coupon_id).values_list('used', flat=True))
+
+
+def apply(user, order_id, code):
+	"""
+	Applies the coupon with the code to the user's open order and returns
+	its ``Offer``. Raises ``CouponError`` (and changes nothing) for an
+	unknown or expired code, an order that already has a coupon, or a
+	coupon the user or everybody has used up.
+
+	Every limit is a guarded increment, so no counter is read and written
+	back and concurrent redemptions cannot go over a limit.
+	"""
+	offer = lookup(code)
+	if offer is None:
+		raise CouponError('Такого промо-кода нет')
+	offer.check_window()
+	with transaction.atomic(), connection.cursor() as cursor:
+		# The order goes first: one coupon per order, and the write lock is
+		# taken before anything is read
+		if not Order.objects.filter(pk=order_id, user=user, ordered=False, coupon=None).update(coupon_id=offer.pk):
+			raise CouponError('К заказу уже применен промо-код')
+		cursor.execute(_USE_COUPON, [offer.pk, user.pk, offer.max_uses_per_user])
+		if cursor.fetchone() is None:
+			raise CouponError('Вы уже использовали этот промо-код')
+		if not _take_slot(offer.pk):
+			raise CouponError('Промо-код больше не действует')
+	return offer
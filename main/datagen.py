@@ -0,0 +1,276 @@
+import random
+import string
+from array import array
+from decimal import Decimal
+from functools import lru_cache
+from itertools import islice
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+from django.utils.text import Truncator
+
+from . import product_pages, search
+from .cart import create_ref_code
+from .facets import rebuild_facets
+from .models import (
+	SHORT_DESCRIPTION_LENGTH, TYPE_PRODUCT_LABELS, Address, CatalogVersion, Favorite, ForProductCategory, Order, OrderProduct,
+	Payment, Product, ProductCategory, UserProfile,
+)
+
+
+# Every generated user can log in with this password
+PASSWORD = 'password'
+
+CATEGORY_NAMES = ['Одежда', 'Обувь', 'Электроника', 'Дом', 'Спорт', 'Книги', 'Игрушки', 'Красота', 'Сад', 'Авто']
+AUDIENCES = ['Мужская', 'Женская', 'Детская', 'Спортивная', 'Классическая', 'Повседневная', 'Походная']
+ADJECTIVES = ['Тёплая', 'Лёгкая', 'Прочная', 'Удобная', 'Стильная', 'Компактная', 'Надёжная', 'Мягкая']
+NOUNS = ['куртка', 'футболка', 'сумка', 'лампа', 'колонка', 'кружка', 'подушка', 'шапка', 'игрушка', 'книга']
+DESCRIPTION = (
+	'{adjective} {noun} для города и путешествий. Качественные материалы, '
+	'продуманные детали и гарантия производителя {years} года.'
+)
+
+
+def batched(iterable, size):
+	iterator = iter(iterable)
+	while batch := list(islice(iterator, size)):
+		yield batch
+
+
+@lru_cache(maxsize=None)
+def _short_description(description):
+	return Truncator(description).chars(SHORT_DESCRIPTION_LENGTH)
+
+
+class Catalog:
+	"""
+	Ids and prices (in kopecks) of generated products, in two parallel
+	arrays. Products are picked by index into them.
+	"""
+
+	def __init__(self):
+		self.product_ids = array('q')
+		self.kopecks = array('q')
+
+	def extend(self, products):
+		self.product_ids.extend(product.pk for product in products)
+		self.kopecks.extend(int(product.price * 100) for product in products)
+
+	def __len__(self):
+		return len(self.product_ids)
+
+	def total(self, indexes, quantities):
+		return Decimal(sum(self.kopecks[index] * qt for index, qt in zip(indexes, quantities))) / 100
+
+
+def _ref_code(rng):
+	return ''.join(rng.choices(string.ascii_lowercase + string.digits, k=20))
+
+
+def _next_index(model):
+	# Numbers generated names and slugs past the highest pk, which earlier
+	# runs numbered from; a count would reuse numbers once rows are deleted
+	return (model.objects.aggregate(top=Max('pk'))['top'] or 0) + 1
+
+
+class DataGenerator:
+	"""
+	Fills the database with a synthetic shop. Rows are built lazily and
+	written with ``bulk_create`` in batches of ``batch_size``; only the ids
+	of what was written are kept, in compact arrays, so millions of rows
+	fit in memory. ``progress(label, count)`` is called after every stage.
+	"""
+
+	def __init__(self, batch_size=5000, seed=None, progress=None):
+		self.batch_size = batch_size
+		self.rng = random.Random(seed)
+		self.progress = progress or (lambda label, count: None)
+		self.counts = {}
+
+	def _insert(self, model, rows, on_batch=None):
+		"""
+		Writes ``rows`` batch by batch and returns how many were written.
+		``on_batch(created)`` sees every written batch before it is dropped.
+		"""
+		count = 0
+		for batch in batched(rows, self.batch_size):
+			created = model.objects.bulk_create(batch)
+			if on_batch is not None:
+				on_batch(created)
+			count += len(created)
+		label = str(model._meta.verbose_name_plural)
+		self.counts[label] = self.counts.get(label, 0) + count
+		self.progress(label, count)
+		return count
+
+	def users(self, count, prefix='shopper'):
+		"""
+		Writes ``count`` users with their profiles, returns an array of their ids.
+		"""
+		# Hashing once keeps a million users from taking a million hashes
+		password = make_password(PASSWORD)
+		start = _next_index(User)
+		user_ids = array('q')
+
+		def written(users):
+			user_ids.extend(user.pk for user in users)
+			self._insert(UserProfile, (UserProfile(user_id=user.pk) for user in users))
+
+		self._insert(User, (
+			User(username=f'{prefix}{i}', email=f'{prefix}{i}@example.com', password=password)
+			for i in range(start, start + count)
+		), written)
+		return user_ids
+
+	def categories(self, count, subcategories):
+		start = _next_index(ProductCategory)
+		categories = []
+		self._insert(ProductCategory, (
+			ProductCategory(name=f'{CATEGORY_NAMES[i % len(CATEGORY_NAMES)]} {i // len(CATEGORY_NAMES) or ""}'.strip(), slug=f'category-{i}')
+			for i in range(start, start + count)
+		), categories.extend)
+		subcategory_ids = array('q')
+		self._insert(ForProductCategory, (
+			ForProductCategory(name=f'{AUDIENCES[j % len(AUDIENCES)]} {category.name.lower()}', slug=f'{category.slug}-{j}', category=category)
+			for category in categories for j in range(subcategories)
+		), lambda subs: subcategory_ids.extend(sub.pk for sub in subs))
+		return subcategory_ids
+
+	def _product(self, i, subcategory_ids):
+		adjective, noun = self.rng.choice(ADJECTIVES), self.rng.choice(NOUNS)
+		description = DESCRIPTION.format(adjective=adjective, noun=noun, years=self.rng.randint(1, 3))
+		# Log-normal prices: many cheap products, a long tail of expensive ones
+		price = Decimal(min(int(self.rng.lognormvariate(8, 1.2)), 9_999_999)).quantize(Decimal('0.01'))
+		return Product(
+			title=f'{adjective} {noun} {i}',
+			price=price,
+			discount_price=(price * Decimal('1.2')).quantize(Decimal('0.01')),
+			category_id=self.rng.choice(subcategory_ids),
+			product_type_label=self.rng.choice(TYPE_PRODUCT_LABELS)[0],
+			slug=f'product-{i}',
+			description=description,
+			short_description=_short_description(description),
+			product_qt=self.rng.randint(1, 500),
+		)
+
+	def products(self, count, subcategory_ids):
+		"""
+		Writes ``count`` products, returns a ``Catalog`` of their ids and prices.
+		"""
+		start = _next_index(Product)
+		catalog = Catalog()
+		self._insert(Product, (self._product(i, subcategory_ids) for i in range(start, start + count)), catalog.extend)
+		return catalog
+
+	def _orders(self, user_ids, catalog, lines_per_order, placed):
+		"""
+		Writes an order with its lines for every user id and returns how many
+		were written. Placed orders also get a payment and the user's default
+		addresses.
+		"""
+		lines_per_order = min(lines_per_order, len(catalog))
+		count = 0
+		for batch in batched(user_ids, max(self.batch_size // (lines_per_order + 1), 1)):
+			addresses = self._addresses(sorted(set(batch))) if placed else {}
+			picks = [self.rng.sample(range(len(catalog)), lines_per_order) for _ in batch]
+			quantities = [[self.rng.randint(1, 3) for _ in pick] for pick in picks]
+			totals = [catalog.total(pick, qts) for pick, qts in zip(picks, quantities)]
+			payments = [None] * len(batch)
+			if placed:
+				payments = []
+				self._insert(Payment, (
+					Payment(stripe_charge_id=_ref_code(self.rng), user_id=user_id, amount=float(total))
+					for user_id, total in zip(batch, totals)
+				), payments.extend)
+			orders, lines = [], []
+			self._insert(Order, (
+				Order(
+					user_id=user_id,
+					ordered=placed,
+					ordered_date=timezone.now(),
+					# Not from the seeded rng: a second run with the same seed must not reuse codes
+					ref_code=create_ref_code() if placed else None,
+					payment=payment,
+					shipping_address_id=addresses.get((user_id, 'S')),
+					billing_address_id=addresses.get((user_id, 'B')),
+					total=total,
+					item_count=sum(qts),
+				)
+				for user_id, payment, total, qts in zip(batch, payments, totals, quantities)
+			), orders.extend)
+			self._insert(OrderProduct, (
+				OrderProduct(user_id=user_id, product_id=catalog.product_ids[index], quantity=qt, order_status=placed)
+				for user_id, pick, qts in zip(batch, picks, quantities) for index, qt in zip(pick, qts)
+			), lines.extend)
+			self._insert(Order.products.through, (
+				Order.products.through(order_id=order.pk, orderproduct_id=line.pk)
+				for order, line in zip((order for order in orders for _ in range(lines_per_order)), lines)
+			))
+			count += len(orders)
+		return count
+
+	def _addresses(self, user_ids):
+		existing = {}
+		for batch in batched(user_ids, self.batch_size):
+			rows = Address.objects.filter(user_id__in=batch, default=True).values_list('pk', 'user_id', 'address_type')
+			existing.update({(user_id, address_type): pk for pk, user_id, address_type in rows})
+		missing = [
+			(user_id, address_type) for user_id in user_ids for address_type in ('S', 'B')
+			if (user_id, address_type) not in existing
+		]
+		self._insert(Address, (
+			Address(
+				user_id=user_id,
+				street_address=f'ул. Ленина, {self.rng.randint(1, 200)}',
+				apartment_address=f'кв. {self.rng.randint(1, 300)}',
+				county='RU',
+				zip=f'{self.rng.randint(100000, 199999)}',
+				address_type=address_type,
+				default=True,
+			)
+			for user_id, address_type in missing
+		), lambda created: existing.update({(address.user_id, address.address_type): address.pk for address in created}))
+		return existing
+
+	def carts(self, user_ids, catalog, lines):
+		return self._orders(user_ids, catalog, lines, placed=False)
+
+	def placed_orders(self, count, user_ids, catalog, lines):
+		return self._orders((self.rng.choice(user_ids) for _ in range(count)), catalog, lines, placed=True)
+
+	def favorites(self, user_ids, product_ids, per_user):
+		per_user = min(per_user, len(product_ids))
+
+		def written(favorites):
+			self._insert(Favorite.fav_products.through, (
+				Favorite.fav_products.through(favorite_id=favorite.pk, product_id=product_id)
+				for favorite in favorites for product_id in self.rng.sample(product_ids, per_user)
+			))
+
+		self._insert(Favorite, (Favorite(user_id=user_id) for user_id in user_ids), written)
+
+	def generate(self, users=1000, categories=10, subcategories=5, products=10000, carts=200, cart_lines=4,
+			orders=2000, order_lines=3, favorites=10, prefix='shopper'):
+		"""
+		Generates a whole shop. Carts go to the first ``carts`` new users,
+		placed orders to random new users. Returns the row counts per model.
+		"""
+		with transaction.atomic():
+			user_ids = self.users(users, prefix)
+			subcategory_ids = self.categories(categories, subcategories)
+			catalog = self.products(products, subcategory_ids)
+			if user_ids and catalog:
+				self.carts(user_ids[:carts], catalog, cart_lines)
+				self.placed_orders(orders, user_ids, catalog, order_lines)
+				if favorites:
+					self.favorites(user_ids, catalog.product_ids, favorites)
+			# bulk_create skips the signals that keep the rollups and the
+			# search index in step, rebuild them once at the end
+			rebuild_facets()
+			search.rebuild_index()
+			CatalogVersion.bump()
+			product_pages.bump_all()
+		return self.counts
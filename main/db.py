@@ -0,0 +1,62 @@
+from django.conf import settings
+from django.db import connections
+
+
+# Models served from the catalog read connection when one is configured
+CATALOG_MODELS = {'product', 'productcategory', 'forproductcategory', 'imageproductcontent'}
+
+
+def configure_sqlite(sender, connection, **kwargs):
+	"""
+	Applies SQLITE_PRAGMAS to every new SQLite connection. The catalog read
+	connection is also made query-only, so a misrouted write fails loudly.
+	"""
+	if connection.vendor != 'sqlite':
+		return
+	read_only = connection.alias == settings.CATALOG_READ_DATABASE
+	with connection.cursor() as cursor:
+		for name, value in settings.SQLITE_PRAGMAS.items():
+			# Changing the journal mode is a write, the primary takes care of it
+			if read_only and name == 'journal_mode':
+				continue
+			cursor.execute(f'PRAGMA {name} = {value}')
+		if read_only:
+			cursor.execute('PRAGMA query_only = ON')
+
+
+class CatalogReadRouter:
+	"""
+	Sends catalog reads to the CATALOG_READ_DATABASE alias (a second
+	connection to the same file, or a replica of it) and everything else to
+	``default``. Reads made inside a transaction on ``default`` stay there, so
+	they see the transaction's own writes.
+	"""
+
+	def _read_alias(self):
+		alias = settings.CATALOG_READ_DATABASE
+		if alias is None or connections['default'].in_atomic_block:
+			return None
+		return alias
+
+	def db_for_read(self, model, **hints):
+		instance = hints.get('instance')
+		if instance is not None and instance._state.db:
+			return instance._state.db
+		if model._meta.app_label == 'main' and model._meta.model_name in CATALOG_MODELS:
+			return self._read_alias()
+		return None
+
+	def db_for_write(self, model, **hints):
+		return 'default'
+
+	def allow_relation(self, obj1, obj2, **hints):
+		# Both aliases hold the same data
+		aliases = {'default', settings.CATALOG_READ_DATABASE}
+		if obj1._state.db in aliases and obj2._state.db in aliases:
+			return True
+		return None
+
+	def allow_migrate(self, db, app_label, model_name=None, **hints):
+		if db == settings.CATALOG_READ_DATABASE:
+			return False
+		return None
@@ -0,0 +1,130 @@
+from bisect import bisect_right
+from decimal import Decimal
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+from .models import Product, ProductCategory, ForProductCategory, ProductFacetCount, TYPE_PRODUCT_LABELS
+
+
+# Upper bounds (RUB) of the price facet buckets, the last bucket is open-ended
+PRICE_BUCKET_BOUNDS = (Decimal(1000), Decimal(5000), Decimal(20000), Decimal(100000))
+
+
+def price_bucket(price):
+	return bisect_right(PRICE_BUCKET_BOUNDS, Decimal(price))
+
+
+def price_bucket_range(bucket):
+	"""
+	Returns the ``(low, high)`` prices of the bucket, ``None`` for an open
+	end. Raises ``ValueError`` for a bucket that does not exist.
+	"""
+	if not 0 <= bucket <= len(PRICE_BUCKET_BOUNDS):
+		raise ValueError(f'No price bucket {bucket}')
+	low = PRICE_BUCKET_BOUNDS[bucket - 1] if bucket > 0 else None
+	high = PRICE_BUCKET_BOUNDS[bucket] if bucket < len(PRICE_BUCKET_BOUNDS) else None
+	return low, high
+
+
+def price_bucket_label(bucket):
+	low, high = price_bucket_range(bucket)
+	if low is None:
+		return f'до {high}'
+	if high is None:
+		return f'от {low}'
+	return f'{low} - {high}'
+
+
+def facet_key(product):
+	return product.category_id, product.product_type_label, price_bucket(product.price)
+
+
+def _bump_facet(category_id, label, bucket, delta):
+	rows = ProductFacetCount.objects.filter(category_id=category_id, product_type_label=label, price_bucket=bucket)
+	if rows.update(count=F('count') + delta):
+		return
+	try:
+		with transaction.atomic():
+			ProductFacetCount.objects.create(category_id=category_id, product_type_label=label, price_bucket=bucket, count=delta)
+	except IntegrityError:
+		# Another writer created the row first
+		rows.update(count=F('count') + delta)
+
+
+def _bump_category(category_id, delta):
+	ForProductCategory.objects.filter(pk=category_id).update(product_count=F('product_count') + delta)
+	ProductCategory.objects.filter(pod=category_id).update(product_count=F('product_count') + delta)
+
+
+def apply_change(old_key, new_key):
+	"""
+	Moves one product between rollup cells; ``None`` stands for "no product",
+	so a creation is ``(None, key)`` and a deletion is ``(key, None)``.
+	"""
+	if old_key == new_key:
+		return
+	if old_key is not None:
+		_bump_facet(*old_key, -1)
+	if new_key is not None:
+		_bump_facet(*new_key, 1)
+	old_category = old_key[0] if old_key else None
+	new_category = new_key[0] if new_key else None
+	if old_category != new_category:
+		if old_category is not None:
+			_bump_category(old_category, -1)
+		if new_category is not None:
+			_bump_category(new_category, 1)
+
+
+def rebuild_facets():
+	cells = {}
+	for row in Product.objects.values('category_id', 'product_type_label', 'price').annotate(n=Count('id')).order_by():
+		key = (row['category_id'], row['product_type_label'], price_bucket(row['price']))
+		cells[key] = cells.get(key, 0) + row['n']
+
+	with transaction.atomic():
+		ProductFacetCount.objects.all().delete()
+		ProductFacetCount.objects.bulk_create(
+			[
+				ProductFacetCount(category_id=category_id, product_type_label=label, price_bucket=bucket, count=count)
+				for (category_id, label, bucket), count in cells.items()
+			],
+			batch_size=1000,
+		)
+		ForProductCategory.objects.update(product_count=Coalesce(Subquery(
+			ProductFacetCount.objects.filter(category=OuterRef('pk'))
+			.values('category').annotate(total=Sum('count')).values('total')
+		), 0))
+		ProductCategory.objects.update(product_count=Coalesce(Subquery(
+			ForProductCategory.objects.filter(category=OuterRef('pk'))
+			.values('category').annotate(total=Sum('product_count')).values('total')
+		), 0))
+	return len(cells)
+
+
+class Facets:
+	"""
+	Label and price facet counts of one subcategory, computed from its rollup
+	rows. Each facet is counted under the other facet's active filter.
+	"""
+
+	def __init__(self, cells, label=None, bucket=None):
+		label_names = dict(TYPE_PRODUCT_LABELS)
+		label_counts, bucket_counts = {}, {}
+		for cell in cells:
+			if cell.count <= 0:
+				continue
+			if bucket is None or cell.price_bucket == bucket:
+				label_counts[cell.product_type_label] = label_counts.get(cell.product_type_label, 0) + cell.count
+			if label is None or cell.product_type_label == label:
+				bucket_counts[cell.price_bucket] = bucket_counts.get(cell.price_bucket, 0) + cell.count
+		self.labels = [
+			{'value': value, 'name': label_names.get(value, value), 'count': count, 'active': value == label}
+			for value, count in sorted(label_counts.items())
+		]
+		self.price_buckets = [
+			{'value': value, 'name': price_bucket_label(value), 'count': count, 'active': value == bucket}
+			for value, count in sorted(bucket_counts.items())
+		]
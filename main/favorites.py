@@ -0,0 +1,96 @@
+from django.core.cache import cache
+from django.db import router, transaction
+from django.db.models.signals import m2m_changed
+
+from .models import Favorite, Product
+
+
+# Seconds the favorites of a user stay cached; every change to them drops
+# the entry sooner through forget. The cache is shared by every process
+# (main.E001), so a drop is seen by all of them.
+FAVORITES_TIMEOUT = 60 * 60
+
+
+def _key(user_id):
+	return f'favorites:{user_id}'
+
+
+def favorite_ids(user):
+	"""
+	Returns the frozenset of the user's favorite product ids, from the
+	cache when possible.
+	"""
+	if not user.is_authenticated:
+		return frozenset()
+	key = _key(user.pk)
+	ids = cache.get(key)
+	if ids is None:
+		ids = frozenset(
+			Favorite.fav_products.through.objects.filter(favorite__user=user).values_list('product_id', flat=True)
+		)
+		cache.set(key, ids, FAVORITES_TIMEOUT)
+	return ids
+
+
+def forget(user_id):
+	# Now, so this request sees the change, and again after commit, so a
+	# concurrent page view cannot keep the old set cached
+	key = _key(user_id)
+	cache.delete(key)
+	transaction.on_commit(lambda: cache.delete(key))
+
+
+def mark(products, ids):
+	"""
+	Sets ``is_favorite`` on every product from the ``ids`` set, without a
+	query, and returns the products.
+	"""
+	for product in products:
+		product.is_favorite = product.pk in ids
+	return products
+
+
+def annotate(products, user):
+	return mark(products, favorite_ids(user))
+
+
+def toggle(user, product_id):
+	"""
+	Adds the product to the user's favorites, or removes it when it is one
+	already. Returns whether it is a favorite now, raises
+	``Product.DoesNotExist`` for a product that does not exist.
+
+	Decided by the database, not the cached ids: deleting the favorite row
+	either removes it or finds nothing, and only then is it added.
+	"""
+	through = Favorite.fav_products.through
+	favorite_id = Favorite.objects.filter(user=user).values_list('pk', flat=True).first()
+	if favorite_id is not None:
+		favorite = Favorite(pk=favorite_id, user=user)
+		# The manager's add() and remove() read before they write in their
+		# transaction, which SQLite fails as locked under concurrent toggles.
+		# The rows are written here in one statement each and the signals
+		# they would send are sent here, they keep every cached set fresh.
+		if through.objects.filter(favorite_id=favorite_id, product_id=product_id).delete()[0]:
+			m2m_changed.send(action='post_remove', **_signal(favorite, product_id))
+			return False
+	if not Product.objects.filter(pk=product_id).exists():
+		raise Product.DoesNotExist
+	if favorite_id is None:
+		# Favorite.user is unique, a concurrent toggle cannot create a second row
+		favorite_id = Favorite.objects.get_or_create(user=user)[0].pk
+		favorite = Favorite(pk=favorite_id, user=user)
+	signal = _signal(favorite, product_id)
+	m2m_changed.send(action='pre_add', **signal)
+	# Skips a row a concurrent toggle added first
+	through.objects.bulk_create([through(favorite_id=favorite_id, product_id=product_id)], ignore_conflicts=True)
+	m2m_changed.send(action='post_add', **signal)
+	return True
+
+
+def _signal(favorite, product_id):
+	through = Favorite.fav_products.through
+	return {
+		'sender': through, 'instance': favorite, 'reverse': False, 'model': Product,
+		'pk_set': {product_id}, 'using': router.db_for_write(through, instance=favorite),
+	}
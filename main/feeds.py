@@ -0,0 +1,139 @@
+import csv
+import json
+import zlib
+from io import StringIO
+from xml.sax.saxutils import escape
+
+from django.core.files.storage import default_storage
+from django.db.models import F
+from django.urls import reverse
+
+from .datagen import batched
+from .models import ForProductCategory, Product
+
+
+FORMATS = {
+	'csv': 'text/csv; charset=utf-8',
+	'jsonl': 'application/x-ndjson; charset=utf-8',
+	'xml': 'application/xml; charset=utf-8',
+}
+
+FIELDS = [
+	'id', 'slug', 'title', 'price', 'discount_price', 'stock', 'category', 'url', 'image', 'images', 'modified',
+]
+
+# Rows fetched per query, and rows rendered into each chunk of the response
+CHUNK_SIZE = 2000
+
+# CSV cells holding several image URLs separate them with this, like the
+# catalog import does
+IMAGE_SEPARATOR = '|'
+
+
+def feed_queryset(since=None):
+	if since is None:
+		return Product.objects.order_by('pk')
+	# Ordered by the filtered column, so the modified index serves the range
+	# instead of a primary key walk over the whole table
+	return Product.objects.filter(modified__gt=since).order_by('modified', 'pk')
+
+
+def feed_rows(since=None, base_url=''):
+	"""
+	Yields one dict per product. Products are read as plain tuples in chunks
+	with one gallery query per chunk, so memory stays flat and no model
+	instances are built however large the catalog is.
+	"""
+	paths = {
+		pk: f'{category} > {name}'
+		for pk, name, category in ForProductCategory.objects.values_list('pk', 'name', 'category__name')
+	}
+	# Product URLs only differ by the id, so reverse() runs once
+	url_prefix, url_suffix = reverse('product', args=[0]).rsplit('0', 1)
+	url_prefix = base_url + url_prefix
+	# Held units cannot be bought, the feed lists what is left
+	products = feed_queryset(since).annotate(available=F('product_qt') - F('reserved_qt')).values_list(
+		'pk', 'slug', 'title', 'price', 'discount_price', 'available', 'category_id', 'poster', 'modified',
+	)
+	for chunk in batched(products.iterator(chunk_size=CHUNK_SIZE), CHUNK_SIZE):
+		gallery = {}
+		images = Product.image_content.through.objects.filter(product_id__in=[row[0] for row in chunk])
+		for product_id, name in images.values_list('product_id', 'imageproductcontent__image').order_by('pk'):
+			gallery.setdefault(product_id, []).append(base_url + default_storage.url(name))
+		for pk, slug, title, price, discount_price, stock, category_id, poster, modified in chunk:
+			yield {
+				'id': pk,
+				'slug': slug,
+				'title': title,
+				'price': str(price),
+				'discount_price': str(discount_price),
+				'stock': stock,
+				'category': paths.get(category_id, ''),
+				'url': f'{url_prefix}{pk}{url_suffix}',
+				'image': base_url + default_storage.url(poster) if poster else '',
+				'images': gallery.get(pk, []),
+				'modified': modified.isoformat(),
+			}
+
+
+def _chunks(rows, render, header='', footer=''):
+	buffer = [header]
+	for count, row in enumerate(rows, start=1):
+		buffer.append(render(row))
+		if count % CHUNK_SIZE == 0:
+			yield ''.join(buffer)
+			buffer = []
+	buffer.append(footer)
+	yield ''.join(buffer)
+
+
+def _csv_row(row):
+	output = StringIO()
+	csv.writer(output).writerow([
+		IMAGE_SEPARATOR.join(row[field]) if field == 'images' else row[field] for field in FIELDS
+	])
+	return output.getvalue()
+
+
+def _jsonl_row(row):
+	return json.dumps(row, ensure_ascii=False) + '\n'
+
+
+def _xml_row(row):
+	parts = []
+	for field in FIELDS:
+		if field == 'images':
+			images = ''.join(f'<image>{escape(url)}</image>' for url in row[field])
+			parts.append(f'<images>{images}</images>')
+		else:
+			parts.append(f'<{field}>{escape(str(row[field]))}</{field}>')
+	return f'<product>{"".join(parts)}</product>\n'
+
+
+def render(rows, format):
+	"""
+	Renders feed rows as chunks of CSV, JSON lines or XML text.
+	"""
+	if format == 'csv':
+		return _chunks(rows, _csv_row, header=_csv_row({field: field for field in FIELDS} | {'images': ['images']}))
+	if format == 'jsonl':
+		return _chunks(rows, _jsonl_row)
+	if format == 'xml':
+		return _chunks(rows, _xml_row, header='<?xml version="1.0" encoding="UTF-8"?>\n<products>\n', footer='</products>\n')
+	raise ValueError(f'Unknown feed format {format!r}')
+
+
+def encode(chunks, compress=False):
+	"""
+	Encodes text chunks to UTF-8, gzipping them on the fly when asked.
+	"""
+	if not compress:
+		for chunk in chunks:
+			yield chunk.encode()
+		return
+	compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+	for chunk in chunks:
+		data = compressor.compress(chunk.encode())
+		if data:
+			yield data
+	yield compressor.flush()
@@ -0,0 +1,150 @@
+import hashlib
+import os
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+from urllib.parse import urlsplit
+from urllib.request import urlopen
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import transaction
+
+from PIL import Image, ImageOps
+
+
+DERIVATIVES_DIR = 'derivatives'
+
+# Pillow format name and save options of every derivative format
+FORMATS = {
+	'webp': ('WEBP', {'quality': 80, 'method': 4}),
+	'jpg': ('JPEG', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+
+_executor = None
+
+
+def derivative_name(name, width, extension):
+	stem = os.path.splitext(name)[0]
+	return f'{DERIVATIVES_DIR}/{stem}-{width}w.{extension}'
+
+
+def _cache_key(name):
+	return f'image-derivatives:{name}'
+
+
+def generate_derivatives(name, force=False):
+	"""
+	Writes every configured width of the image in every format next to each
+	other under ``derivatives/``. Widths larger than the original are skipped
+	and outputs newer than the source are kept unless ``force`` is set.
+	Returns the list of widths that exist afterwards.
+	"""
+	source_mtime = default_storage.get_modified_time(name)
+	with default_storage.open(name) as source:
+		image = ImageOps.exif_transpose(Image.open(source))
+		image.load()
+
+	widths = []
+	for width in settings.IMAGE_DERIVATIVE_WIDTHS:
+		if width >= image.width:
+			continue
+		widths.append(width)
+		resized = None
+		for extension, (image_format, options) in FORMATS.items():
+			target = derivative_name(name, width, extension)
+			if not force and default_storage.exists(target) and default_storage.get_modified_time(target) >= source_mtime:
+				continue
+			if resized is None:
+				resized = image.copy()
+				resized.thumbnail((width, image.height), Image.LANCZOS)
+			output = resized if image_format != 'JPEG' or resized.mode == 'RGB' else resized.convert('RGB')
+			content = ContentFile(b'')
+			output.save(content, image_format, **options)
+			if default_storage.exists(target):
+				default_storage.delete(target)
+			default_storage.save(target, content)
+	return widths
+
+
+def init_worker():
+	import django
+	django.setup()
+
+
+def _get_executor():
+	global _executor
+	if _executor is None:
+		_executor = ProcessPoolExecutor(max_workers=settings.IMAGE_DERIVATIVE_WORKERS, initializer=init_worker)
+	return _executor
+
+
+def remember_widths(name, widths):
+	cache.set(_cache_key(name), widths, None)
+
+
+def _on_done(name, future):
+	if future.exception() is None:
+		remember_widths(name, future.result())
+
+
+def schedule(name):
+	"""
+	Generates the derivatives of a stored image off the request, in the
+	worker pool, once the current transaction commits.
+	"""
+	if not name:
+		return
+
+	def submit():
+		if settings.IMAGE_DERIVATIVES_SYNC:
+			remember_widths(name, generate_derivatives(name, force=True))
+			return
+		future = _get_executor().submit(generate_derivatives, name, True)
+		future.add_done_callback(lambda done: _on_done(name, done))
+
+	transaction.on_commit(submit)
+
+
+def import_image(source, upload_to, timeout=30):
+	"""
+	Copies an image from a URL or a local path into storage under
+	``upload_to`` and builds its derivatives. The stored name is derived from
+	the source, so importing the same source again reuses the stored file.
+	Returns the stored name.
+	"""
+	parts = urlsplit(source)
+	extension = os.path.splitext(parts.path)[1].lower() or '.jpg'
+	name = f'{upload_to}{hashlib.sha1(source.encode()).hexdigest()[:20]}{extension}'
+	if not default_storage.exists(name):
+		if parts.scheme in ('http', 'https'):
+			with urlopen(source, timeout=timeout) as response:
+				data = response.read()
+		else:
+			with open(source, 'rb') as file:
+				data = file.read()
+		# Rejects truncated downloads and non-images before they are stored
+		Image.open(BytesIO(data)).verify()
+		name = default_storage.save(name, ContentFile(data))
+	remember_widths(name, generate_derivatives(name))
+	return name
+
+
+def available_widths(name):
+	widths = cache.get(_cache_key(name))
+	if widths is None:
+		# Not generated by this deployment's workers yet, look on disk once
+		widths = [
+			width for width in settings.IMAGE_DERIVATIVE_WIDTHS
+			if all(default_storage.exists(derivative_name(name, width, extension)) for extension in FORMATS)
+		]
+		cache.set(_cache_key(name), widths, 60 * 10 if not widths else None)
+	return widths
+
+
+def srcset(name, extension):
+	return ', '.join(
+		f'{default_storage.url(derivative_name(name, width, extension))} {width}w'
+		for width in available_widths(name)
+	)
@@ -0,0 +1,173 @@
+from collections import Counter
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, connection, transaction
+from django.db.models import F
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from .models import Product, StockReservation
+
+
+class OutOfStock(Exception):
+
+	def __init__(self, product_id):
+		super().__init__(f'Product {product_id} is out of stock')
+		self.product_id = product_id
+
+
+def _expiry():
+	return timezone.now() + timedelta(seconds=settings.STOCK_RESERVATION_TTL)
+
+
+def _unreserve(product_id, quantity):
+	Product.objects.filter(pk=product_id).update(
+		reserved_qt=Greatest(F('reserved_qt') - quantity, 0), modified=timezone.now(),
+	)
+
+
+def reserve(user, product_id, quantity=1):
+	"""
+	Holds ``quantity`` units of the product for the user until the reservation
+	expires. Stock is never read into Python: the hold only succeeds if the
+	conditional UPDATE finds enough unreserved units.
+	"""
+	with transaction.atomic():
+		# Available stock is feed data, so the change is stamped on modified
+		held = Product.objects.filter(pk=product_id, product_qt__gte=F('reserved_qt') + quantity).update(
+			reserved_qt=F('reserved_qt') + quantity, modified=timezone.now(),
+		)
+		if not held:
+			if not Product.objects.filter(pk=product_id).exists():
+				raise Product.DoesNotExist
+			raise OutOfStock(product_id)
+
+		reservations = StockReservation.objects.filter(user=user, product_id=product_id)
+		if not reservations.update(quantity=F('quantity') + quantity, expires_at=_expiry()):
+			try:
+				with transaction.atomic():
+					StockReservation.objects.create(user=user, product_id=product_id, quantity=quantity, expires_at=_expiry())
+			except IntegrityError:
+				reservations.update(quantity=F('quantity') + quantity, expires_at=_expiry())
+
+
+def restock(product_id, quantity):
+	"""
+	Adds ``quantity`` units of the product to stock, or takes them away when
+	negative. Like a sale, the change is a conditional UPDATE relative to the
+	current stock; raises ``OutOfStock`` if fewer units would be left than
+	are held.
+	"""
+	changed = Product.objects.filter(pk=product_id, product_qt__gte=F('reserved_qt') - quantity).update(
+		product_qt=F('product_qt') + quantity, modified=timezone.now(),
+	)
+	if not changed:
+		if not Product.objects.filter(pk=product_id).exists():
+			raise Product.DoesNotExist
+		raise OutOfStock(product_id)
+
+
+def set_stock(levels):
+	"""
+	Sets the stock of the products with the slugs in ``levels``, a dict of
+	slug to quantity, in one statement. A product never gets less stock than
+	its reserved units, so the holds of shoppers can still be sold.
+	"""
+	if not levels:
+		return
+	with connection.cursor() as cursor:
+		cursor.execute(
+			'WITH level (slug, quantity) AS (VALUES '
+			+ ', '.join(['(%s, %s)'] * len(levels)) +
+			') UPDATE main_product SET product_qt = MAX(level.quantity, reserved_qt) '
+			'FROM level WHERE main_product.slug = level.slug',
+			[value for item in levels.items() for value in item],
+		)
+
+
+def release(user, product_id, quantity=None):
+	"""
+	Gives back ``quantity`` held units of the product, or the whole hold.
+	Releasing more than is held (e.g. after expiry) only releases what is left.
+	"""
+	with transaction.atomic(), connection.cursor() as cursor:
+		if quantity is not None:
+			cursor.execute(
+				'UPDATE main_stockreservation SET quantity = quantity - %s '
+				'WHERE user_id = %s AND product_id = %s AND quantity > %s RETURNING quantity',
+				[quantity, user.pk, product_id, quantity],
+			)
+			if cursor.fetchone() is not None:
+				_unreserve(product_id, quantity)
+				return
+		cursor.execute(
+			'DELETE FROM main_stockreservation WHERE user_id = %s AND product_id = %s RETURNING quantity',
+			[user.pk, product_id],
+		)
+		row = cursor.fetchone()
+		if row is not None:
+			_unreserve(product_id, row[0])
+
+
+def commit(user, lines):
+	"""
+	Turns the user's holds into sold stock for ``lines`` of
+	``(product_id, quantity)``. Must run inside the order's transaction;
+	raises ``OutOfStock`` if a line can be covered neither by the user's hold
+	nor by unreserved stock, which rolls the whole order back.
+	"""
+	lines = dict(lines)
+	if not lines:
+		return
+	with connection.cursor() as cursor:
+		placeholders = ', '.join(['%s'] * len(lines))
+		cursor.execute(
+			f'DELETE FROM main_stockreservation WHERE user_id = %s AND product_id IN ({placeholders}) '
+			'RETURNING product_id, quantity',
+			[user.pk, *lines],
+		)
+		holds = dict(cursor.fetchall())
+		sales = []
+		for product_id, quantity in lines.items():
+			released = holds.get(product_id, 0)
+			sales += [product_id, quantity, min(released, quantity), released]
+		# One statement for the whole order. With a full hold the guard is
+		# product_qt >= n; an expired hold has to be made up from units nobody
+		# else is holding. Any excess hold is released at the same time.
+		cursor.execute(
+			'WITH sale (product_id, quantity, held, released) AS (VALUES '
+			+ ', '.join(['(%s, %s, %s, %s)'] * len(lines)) +
+			') UPDATE main_product SET product_qt = product_qt - sale.quantity, '
+			'reserved_qt = MAX(reserved_qt - sale.released, 0), modified = %s '
+			'FROM sale WHERE main_product.id = sale.product_id '
+			'AND main_product.product_qt >= main_product.reserved_qt - sale.held + sale.quantity '
+			'RETURNING main_product.id',
+			[*sales, connection.ops.adapt_datetimefield_value(timezone.now())],
+		)
+		sold = {row[0] for row in cursor.fetchall()}
+	for product_id in lines:
+		if product_id not in sold:
+			raise OutOfStock(product_id)
+
+
+def release_expired(batch_size=1000):
+	"""
+	Deletes up to ``batch_size`` expired reservations and returns their units
+	to stock. Returns the number of reservations released.
+	"""
+	now = connection.ops.adapt_datetimefield_value(timezone.now())
+	with transaction.atomic(), connection.cursor() as cursor:
+		cursor.execute(
+			'DELETE FROM main_stockreservation WHERE id IN ('
+			'SELECT id FROM main_stockreservation WHERE expires_at <= %s ORDER BY expires_at LIMIT %s'
+			') RETURNING product_id, quantity',
+			[now, batch_size],
+		)
+		rows = cursor.fetchall()
+		released = Counter()
+		for product_id, quantity in rows:
+			released[product_id] += quantity
+		for product_id, quantity in released.items():
+			_unreserve(product_id, quantity)
+	return len(rows)
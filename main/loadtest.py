@@ -0,0 +1,150 @@
+import random
+import threading
+import time
+
+from django.contrib.auth.models import User
+from django.db import close_old_connections, connection
+from django.test import Client
+
+from .benchmarks import Result
+from .datagen import NOUNS
+from .models import ForProductCategory, Product
+
+
+class Session:
+	"""
+	One simulated shopper: a logged-in test client that records the latency
+	of every request under the endpoint's label.
+	"""
+
+	def __init__(self, user, catalog, record, host, seed=None):
+		self.client = Client(raise_request_exception=False, SERVER_NAME=host)
+		self.client.force_login(user)
+		self.catalog = catalog
+		self.record = record
+		self.rng = random.Random(seed)
+		self.has_cart = False
+
+	def request(self, label, url, method='get', **extra):
+		started = time.perf_counter()
+		try:
+			response = getattr(self.client, method)(url, **extra)
+			failed = response.status_code >= 500
+		except Exception:
+			failed = True
+		self.record(label, time.perf_counter() - started, failed)
+
+	def product(self):
+		return self.rng.choice(self.catalog['products'])
+
+	def subcategory(self):
+		return self.rng.choice(self.catalog['subcategories'])
+
+
+def browse(session):
+	session.request('index', '/')
+	session.request('product detail', f'/product-detail-{session.product()}/')
+
+
+def categories(session):
+	session.request('category list', '/category-list/')
+	session.request('subcategory', f'/subcategory-{session.subcategory()}/')
+
+
+def search(session):
+	session.request('search', f'/search/?q={session.rng.choice(NOUNS)}')
+
+
+def add_to_cart(session):
+	session.request('add to cart', f'/add-to-cart/{session.product()}/', HTTP_REFERER='/')
+	session.has_cart = True
+
+
+def checkout(session):
+	if not session.has_cart:
+		add_to_cart(session)
+	session.request('order summary', '/cart/order-sum/')
+	session.request('checkout', '/cart/checkout/')
+	session.request('place order', '/cart/payment-procedure/UMoney/', method='post')
+	session.has_cart = False
+
+
+def favorites(session):
+	session.request('add to favorites', f'/favorites/add/{session.product()}/', HTTP_REFERER='/')
+	session.request('favorites', '/favorites/')
+
+
+# Relative weight of every kind of visit in the replayed traffic
+MIX = [
+	(browse, 40),
+	(categories, 15),
+	(search, 15),
+	(add_to_cart, 15),
+	(checkout, 5),
+	(favorites, 10),
+]
+
+
+def load_catalog(sample=5000):
+	return {
+		'products': list(Product.objects.order_by('?').values_list('pk', flat=True)[:sample]),
+		'subcategories': list(ForProductCategory.objects.values_list('pk', flat=True)),
+	}
+
+
+def run(clients, visits, users, host='localhost', seed=None):
+	"""
+	Replays ``visits`` visits from the traffic MIX in each of ``clients``
+	threads, one shopper per thread. Returns a Result per endpoint followed by
+	the overall Result.
+	"""
+	catalog = load_catalog()
+	if not catalog['products']:
+		raise ValueError('The catalog is empty, run generate_data first')
+	rng = random.Random(seed)
+	actions, weights = zip(*MIX)
+	latencies, errors = {}, {}
+	lock = threading.Lock()
+	barrier = threading.Barrier(clients + 1)
+
+	def record(label, latency, failed):
+		with lock:
+			latencies.setdefault(label, []).append(latency)
+			errors[label] = errors.get(label, 0) + failed
+
+	sessions = [Session(user, catalog, record, host, seed=rng.random()) for user in users[:clients]]
+	plans = [rng.choices(actions, weights, k=visits) for _ in sessions]
+	# Logging in is setup, not traffic
+	latencies.clear()
+	errors.clear()
+
+	def client(session, plan):
+		barrier.wait()
+		for action in plan:
+			action(session)
+		connection.close()
+
+	threads = [threading.Thread(target=client, args=pair) for pair in zip(sessions, plans)]
+	for thread in threads:
+		thread.start()
+	barrier.wait()
+	started = time.perf_counter()
+	for thread in threads:
+		thread.join()
+	elapsed = time.perf_counter() - started
+	close_old_connections()
+
+	results = [
+		Result(label, len(latencies[label]), elapsed, latencies[label], errors[label])
+		for label in sorted(latencies, key=lambda label: -len(latencies[label]))
+	]
+	every = [latency for label in latencies for latency in latencies[label]]
+	results.append(Result('all requests', len(every), elapsed, every, sum(errors.values())))
+	return results
+
+
+def shoppers(prefix, count):
+	users = list(User.objects.filter(username__startswith=prefix).order_by('pk')[:count])
+	if len(users) < count:
+		raise ValueError(f'Need {count} users named {prefix}<n>, found {len(users)}; run generate_data first')
+	return users
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from main.query_audit import HOT_QUERIES, full_scans
+
+
+class Command(BaseCommand):
+	help = 'Explains the hot-path queries and fails if any of them scans a whole table'
+
+	def add_arguments(self, parser):
+		parser.add_argument('--plans', action='store_true', help='Print every query plan')
+
+	def handle(self, *args, **options):
+		failed = []
+		for label, queryset in HOT_QUERIES.items():
+			plan, scans = full_scans(queryset())
+			if scans:
+				failed.append(label)
+				self.stdout.write(self.style.ERROR(f'{label}: full scan of {", ".join(scans)}'))
+			else:
+				self.stdout.write(f'{label}: ok')
+			if options['plans'] or scans:
+				for line in plan.splitlines():
+					self.stdout.write(f'    {line}')
+		if failed:
+			raise CommandError(f'{len(failed)} of {len(HOT_QUERIES)} hot queries scan whole tables')
+		self.stdout.write(self.style.SUCCESS(f'All {len(HOT_QUERIES)} hot queries use indexes'))
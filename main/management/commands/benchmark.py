@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import setup_databases, teardown_databases
+
+from main.benchmarks import SCENARIOS
+
+
+class Command(BaseCommand):
+	help = 'Runs a benchmark scenario against a freshly migrated scratch database'
+
+	def add_arguments(self, parser):
+		parser.add_argument('scenario', choices=sorted(SCENARIOS))
+		parser.add_argument('--clients', type=int, default=8, help='Concurrent client threads')
+		parser.add_argument('--operations', type=int, default=200, help='Operations per client')
+
+	def handle(self, *args, **options):
+		# The scratch database is the test database, so the real one is never touched
+		old_config = setup_databases(verbosity=0, interactive=False)
+		try:
+			for result in SCENARIOS[options['scenario']](**options):
+				self.stdout.write(str(result))
+		finally:
+			teardown_databases(old_config, verbosity=0)
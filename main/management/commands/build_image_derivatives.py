@@ -0,0 +1,31 @@
+from concurrent.futures import ProcessPoolExecutor
+
+from django.core.management.base import BaseCommand
+
+from main import images
+from main.models import Product, ImageProductContent
+
+
+class Command(BaseCommand):
+	help = 'Generates resized WebP/JPEG derivatives of every product image in parallel'
+
+	def add_arguments(self, parser):
+		parser.add_argument('--workers', type=int, default=None, help='Worker processes, defaults to the CPU count')
+		parser.add_argument('--force', action='store_true', help='Regenerate derivatives that are up to date')
+
+	def handle(self, *args, **options):
+		names = set(Product.objects.exclude(poster='').exclude(poster=None).values_list('poster', flat=True))
+		names.update(ImageProductContent.objects.values_list('image', flat=True))
+		names = sorted(names)
+
+		done = failed = 0
+		with ProcessPoolExecutor(max_workers=options['workers'], initializer=images.init_worker) as executor:
+			futures = {executor.submit(images.generate_derivatives, name, options['force']): name for name in names}
+			for future, name in futures.items():
+				try:
+					images.remember_widths(name, future.result())
+					done += 1
+				except Exception as exc:
+					failed += 1
+					self.stderr.write(f'{name}: {exc}')
+		self.stdout.write(self.style.SUCCESS(f'Processed {done} images, {failed} failed'))
@@ -0,0 +1,41 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from main import feeds
+
+
+class Command(BaseCommand):
+	help = 'Writes the product feed as CSV, JSON lines or XML, optionally only products changed since a timestamp'
+
+	def add_arguments(self, parser):
+		parser.add_argument('format', choices=sorted(feeds.FORMATS))
+		parser.add_argument('--since', help='ISO 8601 timestamp, only export products changed after it')
+		parser.add_argument('--output', help='File to write, defaults to stdout')
+		parser.add_argument('--gzip', action='store_true', help='Gzip the output')
+		parser.add_argument('--base-url', default='', help='Prefix of product and image URLs, e.g. https://shop.example')
+
+	def handle(self, *args, **options):
+		since = None
+		if options['since']:
+			since = parse_datetime(options['since'])
+			if since is None:
+				raise CommandError('--since must be an ISO 8601 timestamp')
+			if timezone.is_naive(since):
+				since = timezone.make_aware(since)
+		generated = timezone.now()
+		rows = feeds.feed_rows(since, base_url=options['base_url'].rstrip('/'))
+		chunks = feeds.encode(feeds.render(rows, options['format']), compress=options['gzip'])
+		output = open(options['output'], 'wb') if options['output'] else sys.stdout.buffer
+		try:
+			for chunk in chunks:
+				output.write(chunk)
+		finally:
+			if options['output']:
+				output.close()
+			else:
+				output.flush()
+		# Pass this as --since to the next incremental export
+		self.stderr.write(f'Generated at {generated.isoformat()}')
@@ -0,0 +1,51 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from main.datagen import PASSWORD, DataGenerator
+
+
+class Command(BaseCommand):
+	help = 'Fills the database with a synthetic shop of the given size'
+
+	def add_arguments(self, parser):
+		parser.add_argument('--users', type=int, default=1000)
+		parser.add_argument('--categories', type=int, default=10)
+		parser.add_argument('--subcategories', type=int, default=5, help='Subcategories per category')
+		parser.add_argument('--products', type=int, default=10000)
+		parser.add_argument('--carts', type=int, default=200, help='Users with an open cart')
+		parser.add_argument('--cart-lines', type=int, default=4)
+		parser.add_argument('--orders', type=int, default=2000, help='Placed orders')
+		parser.add_argument('--order-lines', type=int, default=3)
+		parser.add_argument('--favorites', type=int, default=10, help='Favorite products per user')
+		parser.add_argument('--prefix', default='shopper', help='Username prefix of the generated users')
+		parser.add_argument('--batch-size', type=int, default=5000)
+		parser.add_argument('--seed', type=int, help='Random seed, for a reproducible dataset')
+
+	def handle(self, *args, **options):
+		def progress(label, count):
+			if options['verbosity'] > 1:
+				self.stdout.write(f'  {label}: +{count}')
+
+		generator = DataGenerator(batch_size=options['batch_size'], seed=options['seed'], progress=progress)
+		started = time.perf_counter()
+		counts = generator.generate(
+			users=options['users'],
+			categories=options['categories'],
+			subcategories=options['subcategories'],
+			products=options['products'],
+			carts=options['carts'],
+			cart_lines=options['cart_lines'],
+			orders=options['orders'],
+			order_lines=options['order_lines'],
+			favorites=options['favorites'],
+			prefix=options['prefix'],
+		)
+		elapsed = time.perf_counter() - started
+		for label, count in counts.items():
+			self.stdout.write(f'{label:<40} {count:>10}')
+		rows = sum(counts.values())
+		self.stdout.write(self.style.SUCCESS(
+			f'Created {rows} rows in {elapsed:.1f}s ({rows / elapsed:.0f} rows/s). '
+			f'Users log in as {options["prefix"]}<n> / {PASSWORD}'
+		))
@@ -0,0 +1,55 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from main.catalog_import import KINDS, CatalogImporter
+
+
+class Command(BaseCommand):
+	help = 'Upserts subcategories or products (with their images) from CSV or JSONL files'
+
+	def add_arguments(self, parser):
+		parser.add_argument('kind', choices=KINDS)
+		parser.add_argument('paths', nargs='+', help='.csv or .jsonl files, optionally gzipped')
+		parser.add_argument('--batch-size', type=int, default=1000)
+		parser.add_argument('--workers', type=int, default=4, help='Threads fetching and resizing images')
+		parser.add_argument('--user', help='Username owning imported gallery images, defaults to the first superuser')
+		parser.add_argument('--checkpoint', help='File recording progress, an interrupted import resumes from it')
+		parser.add_argument('--report-every', type=int, default=10, help='Print throughput every N batches')
+
+	def handle(self, *args, **options):
+		if options['user']:
+			user = User.objects.filter(username=options['user']).first()
+			if user is None:
+				raise CommandError(f'No user {options["user"]!r}')
+		else:
+			user = User.objects.filter(is_superuser=True).order_by('pk').first()
+
+		batches = 0
+
+		def progress(stats):
+			nonlocal batches
+			batches += 1
+			if batches % options['report_every'] == 0:
+				self.stdout.write(self._summary(stats, importer.rate))
+
+		importer = CatalogImporter(
+			options['kind'],
+			batch_size=options['batch_size'],
+			workers=options['workers'],
+			user=user,
+			checkpoint=options['checkpoint'],
+			progress=progress,
+		)
+		try:
+			stats = importer.run(options['paths'])
+		except (OSError, ValueError) as e:
+			raise CommandError(e)
+		for error in stats['errors']:
+			self.stderr.write(error)
+		self.stdout.write(self.style.SUCCESS(self._summary(stats, importer.rate)))
+
+	def _summary(self, stats, rate):
+		return (
+			f'{stats["read"]} records, {stats["upserted"]} upserted, {stats["skipped"]} skipped, '
+			f'{stats["images"]} images ({stats["image_errors"]} failed), {rate:.0f} records/s'
+		)
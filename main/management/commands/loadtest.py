@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import setup_databases, teardown_databases
+
+from main import loadtest
+from main.datagen import DataGenerator
+
+
+class Command(BaseCommand):
+	help = 'Replays a browse/cart/checkout/favorites traffic mix in-process and reports latency per endpoint'
+
+	def add_arguments(self, parser):
+		parser.add_argument('--clients', type=int, default=8, help='Concurrent shoppers')
+		parser.add_argument('--visits', type=int, default=100, help='Visits per shopper')
+		parser.add_argument('--prefix', default='shopper', help='Username prefix of the shoppers, see generate_data')
+		parser.add_argument('--host', default='localhost', help='Host name the requests are sent to')
+		parser.add_argument('--seed', type=int)
+		parser.add_argument(
+			'--scratch', action='store_true',
+			help='Run against a freshly generated scratch database instead of the configured one',
+		)
+
+	def handle(self, *args, **options):
+		old_config = None
+		if options['scratch']:
+			old_config = setup_databases(verbosity=0, interactive=False)
+			DataGenerator(seed=options['seed']).generate(users=max(options['clients'], 100), products=5000, orders=1000)
+		try:
+			users = loadtest.shoppers(options['prefix'], options['clients'])
+			results = loadtest.run(options['clients'], options['visits'], users, host=options['host'], seed=options['seed'])
+		except ValueError as e:
+			raise CommandError(e)
+		finally:
+			if old_config is not None:
+				teardown_databases(old_config, verbosity=0)
+		for result in results:
+			self.stdout.write(str(result))
@@ -0,0 +1,22 @@
+import signal
+
+from django.core.management.base import BaseCommand
+
+from main.payments import Worker
+
+
+class Command(BaseCommand):
+	help = 'Runs queued payment charges outside the request cycle'
+
+	def add_arguments(self, parser):
+		parser.add_argument('--concurrency', type=int, default=8, help='Charges in flight at once')
+		parser.add_argument('--poll-interval', type=float, default=1.0, help='Seconds between polls of an idle queue')
+		parser.add_argument('--burst', action='store_true', help='Exit once no job is due')
+
+	def handle(self, *args, **options):
+		worker = Worker(concurrency=options['concurrency'], poll_interval=options['poll_interval'])
+		# Finish the charges in flight on Ctrl+C or a deploy's SIGTERM
+		for signum in (signal.SIGINT, signal.SIGTERM):
+			signal.signal(signum, lambda *args: worker.stop())
+		processed = worker.run(burst=options['burst'])
+		self.stdout.write(self.style.SUCCESS(f'Ran {processed} payment jobs'))
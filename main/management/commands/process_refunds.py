@@ -0,0 +1,29 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from main.refunds import pending_orders, process_refunds
+
+
+class Command(BaseCommand):
+	help = 'Grants or denies refunds in bulk, by order ref codes or for every pending request'
+
+	def add_arguments(self, parser):
+		parser.add_argument('file', nargs='?', help="File with one ref code per line, '-' for stdin")
+		parser.add_argument('--pending', action='store_true', help='Process every pending refund request')
+		parser.add_argument('--deny', action='store_true', help='Deny the refunds instead of granting them')
+
+	def handle(self, *args, **options):
+		if options['pending'] == bool(options['file']):
+			raise CommandError('Pass either a file of ref codes or --pending')
+		if options['pending']:
+			ref_codes = None
+			self.stdout.write(f'{pending_orders().count()} pending refund requests')
+		elif options['file'] == '-':
+			ref_codes = [line.strip() for line in sys.stdin if line.strip()]
+		else:
+			with open(options['file'], encoding='utf-8') as f:
+				ref_codes = [line.strip() for line in f if line.strip()]
+		changed = process_refunds(ref_codes, grant=not options['deny'])
+		action = 'Denied' if options['deny'] else 'Granted'
+		self.stdout.write(self.style.SUCCESS(f'{action} refunds of {changed} orders'))
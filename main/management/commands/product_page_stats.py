@@ -0,0 +1,27 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from main import product_pages
+from main.checks import PROCESS_LOCAL_CACHES
+
+
+class Command(BaseCommand):
+	help = 'Shows the hit and miss counts of the product page cache'
+
+	def add_arguments(self, parser):
+		parser.add_argument('--reset', action='store_true', help='Start counting from zero afterwards')
+
+	def handle(self, *args, **options):
+		backend = settings.CACHES['default']['BACKEND']
+		if backend in PROCESS_LOCAL_CACHES:
+			# The web processes count in caches this command cannot see
+			raise CommandError(
+				f'The default cache ({backend}) is not shared between processes, set REDIS_URL. '
+				'Each product page response says whether it was a hit in its X-Product-Page-Cache header.'
+			)
+		stats = product_pages.stats()
+		total = stats['hits'] + stats['misses']
+		ratio = stats['hits'] / total if total else 0
+		self.stdout.write(f'hits {stats["hits"]}, misses {stats["misses"]}, hit ratio {ratio:.1%}')
+		if options['reset']:
+			product_pages.reset_stats()
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from main.facets import rebuild_facets
+
+
+class Command(BaseCommand):
+	help = 'Recomputes category product counts and facet rollups from the product table'
+
+	def handle(self, *args, **options):
+		cells = rebuild_facets()
+		self.stdout.write(self.style.SUCCESS(f'Rebuilt {cells} facet cells'))
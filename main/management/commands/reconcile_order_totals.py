@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import F, Max, Min
+
+from main.cart import total_subqueries
+from main.models import Order
+
+
+class Command(BaseCommand):
+	help = 'Recomputes stored order totals from the order lines and reports drift'
+
+	def add_arguments(self, parser):
+		parser.add_argument('--batch-size', type=int, default=5000)
+		parser.add_argument('--dry-run', action='store_true', help='Only report drifted orders')
+
+	def handle(self, *args, **options):
+		batch_size = options['batch_size']
+		total, item_count = total_subqueries()
+		bounds = Order.objects.aggregate(low=Min('pk'), high=Max('pk'))
+		checked = drifted = 0
+		if bounds['low'] is not None:
+			for start in range(bounds['low'], bounds['high'] + 1, batch_size):
+				orders = Order.objects.filter(pk__gte=start, pk__lt=start + batch_size)
+				rows = list(
+					orders.annotate(expected_total=total, expected_count=item_count)
+					.exclude(total=F('expected_total'), item_count=F('expected_count'))
+					.values_list('pk', 'total', 'expected_total', 'item_count', 'expected_count')
+				)
+				checked += orders.count()
+				drifted += len(rows)
+				for pk, stored_total, expected_total, stored_count, expected_count in rows:
+					self.stdout.write(
+						f'Order {pk}: total {stored_total} -> {expected_total}, '
+						f'items {stored_count} -> {expected_count}'
+					)
+				if rows and not options['dry_run']:
+					with transaction.atomic():
+						Order.objects.filter(pk__in=[row[0] for row in rows]).update(total=total, item_count=item_count)
+
+		action = 'found' if options['dry_run'] else 'fixed'
+		self.stdout.write(self.style.SUCCESS(f'Checked {checked} orders, {action} {drifted} with drifted totals'))
@@ -0,0 +1,26 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from main.inventory import release_expired
+
+
+class Command(BaseCommand):
+	help = 'Returns the stock of expired cart reservations'
+
+	def add_arguments(self, parser):
+		parser.add_argument('--batch-size', type=int, default=1000)
+		parser.add_argument('--interval', type=float, default=0, help='Keep sweeping every N seconds')
+
+	def handle(self, *args, **options):
+		while True:
+			total = 0
+			while True:
+				released = release_expired(batch_size=options['batch_size'])
+				total += released
+				if released < options['batch_size']:
+					break
+			self.stdout.write(f'Released {total} expired reservations')
+			if not options['interval']:
+				break
+			time.sleep(options['interval'])
@@ -0,0 +1,176 @@
+import hashlib
+import mimetypes
+import os
+import re
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.files.storage import FileSystemStorage
+from django.http import FileResponse, Http404, HttpResponse, StreamingHttpResponse
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, parse_http_date_safe
+from django.views.decorators.http import require_safe
+
+
+# Length of the content digest put into ?v= of versioned media URLs
+VERSION_LENGTH = 16
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+REVALIDATE_CACHE_CONTROL = 'public, max-age=0, must-revalidate'
+CHUNK_SIZE = 64 * 1024
+
+_RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+@lru_cache(maxsize=4096)
+def _digest(path, mtime_ns, size):
+	sha = hashlib.sha256()
+	with open(path, 'rb') as file:
+		for chunk in iter(lambda: file.read(CHUNK_SIZE), b''):
+			sha.update(chunk)
+	return sha.hexdigest()
+
+
+def file_digest(path, stat=None):
+	"""
+	SHA-256 of the file's content, hashed once per (mtime, size) of the file
+	in each process.
+	"""
+	stat = stat or os.stat(path)
+	return _digest(str(path), stat.st_mtime_ns, stat.st_size)
+
+
+class VersionedMediaStorage(FileSystemStorage):
+	"""
+	Media storage whose URLs carry a content hash (``?v=``), so the media view
+	can mark them immutable and a replaced file gets a new URL.
+	"""
+
+	def url(self, name):
+		url = super().url(name)
+		try:
+			digest = file_digest(self.path(name))
+		except OSError:
+			return url
+		return f'{url}?v={digest[:VERSION_LENGTH]}'
+
+
+def _parse_range(header, size):
+	"""
+	Returns the (start, end) inclusive byte span of a single-range ``Range``
+	header, None when the header should be ignored and ``False`` when the
+	range cannot be satisfied.
+	"""
+	match = _RANGE_RE.match(header.replace(' ', ''))
+	if not match:
+		# Malformed and multi-range requests get the whole file
+		return None
+	first, last = match.groups()
+	if not first and not last:
+		return None
+	if not first:
+		length = int(last)
+		if length == 0:
+			return False
+		return max(size - length, 0), size - 1
+	start = int(first)
+	end = min(int(last), size - 1) if last else size - 1
+	if last and int(last) < start:
+		return None
+	if start >= size:
+		return False
+	return start, end
+
+
+def _if_range_matches(request, etag, mtime):
+	if_range = request.META.get('HTTP_IF_RANGE')
+	if if_range is None:
+		return True
+	if if_range.startswith('"'):
+		return if_range == etag
+	# A date only validates when it is exactly the file's Last-Modified
+	return parse_http_date_safe(if_range) == int(mtime)
+
+
+def _read_span(path, start, length):
+	with open(path, 'rb') as file:
+		file.seek(start)
+		while length > 0:
+			chunk = file.read(min(CHUNK_SIZE, length))
+			if not chunk:
+				break
+			length -= len(chunk)
+			yield chunk
+
+
+def _offload(path, name):
+	header = settings.MEDIA_SENDFILE_HEADER
+	response = HttpResponse()
+	if header == 'X-Accel-Redirect':
+		response[header] = settings.MEDIA_ACCEL_REDIRECT_PREFIX + name
+	else:
+		response[header] = path
+	# The front proxy fills in the body and answers Range requests itself
+	del response['Content-Type']
+	return response
+
+
+@require_safe
+def serve(request, path):
+	"""
+	Serves a file from MEDIA_ROOT with a strong content ETag, conditional and
+	byte-range support. URLs carrying the current ``?v=`` version are cached
+	for a year; the bytes themselves are handed to the front proxy when
+	MEDIA_SENDFILE_HEADER is set.
+	"""
+	try:
+		full_path = safe_join(settings.MEDIA_ROOT, path)
+	except SuspiciousFileOperation:
+		raise Http404
+	try:
+		stat = os.stat(full_path)
+	except OSError:
+		raise Http404
+	if not os.path.isfile(full_path):
+		raise Http404
+
+	digest = file_digest(full_path, stat)
+	etag = f'"{digest}"'
+	immutable = request.GET.get('v') == digest[:VERSION_LENGTH]
+
+	response = get_conditional_response(request, etag=etag, last_modified=int(stat.st_mtime))
+	if response is None:
+		if settings.MEDIA_SENDFILE_HEADER:
+			response = _offload(full_path, path)
+		else:
+			response = _file_response(request, full_path, stat, etag)
+
+	if 'Content-Type' not in response and response.status_code == 200:
+		response['Content-Type'] = mimetypes.guess_type(full_path)[0] or 'application/octet-stream'
+	response['ETag'] = etag
+	response['Last-Modified'] = http_date(stat.st_mtime)
+	response['Cache-Control'] = IMMUTABLE_CACHE_CONTROL if immutable else REVALIDATE_CACHE_CONTROL
+	response['Accept-Ranges'] = 'bytes'
+	return response
+
+
+def _file_response(request, full_path, stat, etag):
+	size = stat.st_size
+	span = None
+	if 'HTTP_RANGE' in request.META and _if_range_matches(request, etag, stat.st_mtime):
+		span = _parse_range(request.META['HTTP_RANGE'], size)
+
+	if span is False:
+		response = HttpResponse(status=416)
+		response['Content-Range'] = f'bytes */{size}'
+		return response
+	if span is None:
+		return FileResponse(open(full_path, 'rb'))
+
+	start, end = span
+	response = StreamingHttpResponse(_read_span(full_path, start, end - start + 1), status=206)
+	response['Content-Length'] = end - start + 1
+	response['Content-Range'] = f'bytes {start}-{end}/{size}'
+	response['Content-Type'] = mimetypes.guess_type(full_path)[0] or 'application/octet-stream'
+	return response
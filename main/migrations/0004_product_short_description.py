@@ -0,0 +1,33 @@
+# Generated by Django 4.2.30 on 2026-10-18 11:35
+
+from django.db import migrations, models
+from django.utils.text import Truncator
+
+
+def fill_short_description(apps, schema_editor):
+    Product = apps.get_model('main', 'Product')
+    batch = []
+    for product in Product.objects.only('id', 'description').iterator(chunk_size=2000):
+        product.short_description = Truncator(product.description).chars(50)
+        batch.append(product)
+        if len(batch) >= 2000:
+            Product.objects.bulk_update(batch, ['short_description'])
+            batch = []
+    if batch:
+        Product.objects.bulk_update(batch, ['short_description'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0003_userprofile'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='short_description',
+            field=models.CharField(blank=True, editable=False, max_length=50, verbose_name='Краткое описание'),
+        ),
+        migrations.RunPython(fill_short_description, migrations.RunPython.noop),
+    ]
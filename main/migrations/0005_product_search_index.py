@@ -0,0 +1,26 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0004_product_short_description'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            sql=[
+                "CREATE VIRTUAL TABLE main_product_fts USING fts5("
+                "title, description, category, "
+                "tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')",
+                # Title matches outweigh category matches, which outweigh description
+                "INSERT INTO main_product_fts (main_product_fts, rank) VALUES ('rank', 'bm25(10.0, 1.0, 4.0)')",
+                "INSERT INTO main_product_fts (rowid, title, description, category) "
+                "SELECT p.id, p.title, p.description, sc.name || ' ' || c.name "
+                "FROM main_product p "
+                "JOIN main_forproductcategory sc ON sc.id = p.category_id "
+                "JOIN main_productcategory c ON c.id = sc.category_id",
+            ],
+            reverse_sql="DROP TABLE main_product_fts",
+        ),
+    ]
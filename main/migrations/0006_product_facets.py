@@ -0,0 +1,89 @@
+# Generated by Django 4.2.30 on 2026-10-18 11:36
+
+from bisect import bisect_right
+from decimal import Decimal
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+# Copied from main.facets as of this migration, so later changes there do
+# not change what it computes
+PRICE_BUCKET_BOUNDS = (Decimal(1000), Decimal(5000), Decimal(20000), Decimal(100000))
+
+
+def price_bucket(price):
+    return bisect_right(PRICE_BUCKET_BOUNDS, Decimal(price))
+
+
+def fill_facets(apps, schema_editor):
+    Product = apps.get_model('main', 'Product')
+    ProductFacetCount = apps.get_model('main', 'ProductFacetCount')
+    ForProductCategory = apps.get_model('main', 'ForProductCategory')
+    ProductCategory = apps.get_model('main', 'ProductCategory')
+
+    cells, subcategories = {}, {}
+    for row in Product.objects.values('category_id', 'product_type_label', 'price').annotate(n=models.Count('id')).order_by():
+        key = (row['category_id'], row['product_type_label'], price_bucket(row['price']))
+        cells[key] = cells.get(key, 0) + row['n']
+        subcategories[row['category_id']] = subcategories.get(row['category_id'], 0) + row['n']
+    ProductFacetCount.objects.bulk_create([
+        ProductFacetCount(category_id=category_id, product_type_label=label, price_bucket=bucket, count=count)
+        for (category_id, label, bucket), count in cells.items()
+    ], batch_size=1000)
+
+    categories = {}
+    for subcategory in ForProductCategory.objects.filter(pk__in=subcategories):
+        subcategory.product_count = subcategories[subcategory.pk]
+        subcategory.save(update_fields=['product_count'])
+        categories[subcategory.category_id] = categories.get(subcategory.category_id, 0) + subcategory.product_count
+    for category in ProductCategory.objects.filter(pk__in=categories):
+        category.product_count = categories[category.pk]
+        category.save(update_fields=['product_count'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0005_product_search_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductFacetCount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('product_type_label', models.CharField(choices=[('P', 'primary'), ('S', 'secondary'), ('D', 'danger')], max_length=1, verbose_name='Тип редкости')),
+                ('price_bucket', models.PositiveSmallIntegerField(verbose_name='Ценовой диапазон')),
+                ('count', models.IntegerField(default=0, verbose_name='Кол-во продуктов')),
+            ],
+            options={
+                'verbose_name': 'Счетчик фасета',
+                'verbose_name_plural': 'Счетчики фасетов',
+            },
+        ),
+        migrations.AddField(
+            model_name='forproductcategory',
+            name='product_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Кол-во продуктов'),
+        ),
+        migrations.AddField(
+            model_name='productcategory',
+            name='product_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Кол-во продуктов'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['category', 'product_type_label'], name='product_category_label_idx'),
+        ),
+        migrations.AddField(
+            model_name='productfacetcount',
+            name='category',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='facet_counts', to='main.forproductcategory', verbose_name='Под-категория'),
+        ),
+        migrations.AddConstraint(
+            model_name='productfacetcount',
+            constraint=models.UniqueConstraint(fields=('category', 'product_type_label', 'price_bucket'), name='unique_product_facet'),
+        ),
+        migrations.RunPython(fill_facets, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 4.2.30 on 2026-10-18 11:39
+
+from django.db import migrations, models
+
+
+def merge_duplicate_lines(apps, schema_editor):
+    OrderProduct = apps.get_model('main', 'OrderProduct')
+    OrderProducts = apps.get_model('main', 'Order').products.through
+    duplicates = (
+        OrderProduct.objects.filter(order_status=False)
+        .values('user_id', 'product_id')
+        .annotate(n=models.Count('id'), total=models.Sum('quantity'))
+        .filter(n__gt=1)
+    )
+    for row in duplicates:
+        lines = list(OrderProduct.objects.filter(
+            user_id=row['user_id'], product_id=row['product_id'], order_status=False,
+        ).order_by('pk').values_list('pk', flat=True))
+        keep, extra = lines[0], lines[1:]
+        OrderProduct.objects.filter(pk=keep).update(quantity=row['total'])
+        OrderProducts.objects.filter(orderproduct_id__in=extra).delete()
+        OrderProduct.objects.filter(pk__in=extra).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0006_product_facets'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_lines, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='orderproduct',
+            constraint=models.UniqueConstraint(condition=models.Q(('order_status', False)), fields=('user', 'product'), name='unique_open_order_product'),
+        ),
+    ]
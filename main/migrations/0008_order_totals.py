@@ -0,0 +1,39 @@
+# Generated by Django 4.2.30 on 2026-10-18 11:39
+
+from django.db import migrations, models
+from django.db.models.functions import Coalesce
+
+
+def fill_order_totals(apps, schema_editor):
+    Order = apps.get_model('main', 'Order')
+    OrderProduct = apps.get_model('main', 'OrderProduct')
+    lines = OrderProduct.objects.filter(order=models.OuterRef('pk')).values('order')
+    money = models.DecimalField(max_digits=12, decimal_places=2)
+    Order.objects.update(
+        total=Coalesce(models.Subquery(
+            lines.annotate(value=models.Sum(models.F('quantity') * models.F('product__price'), output_field=money)).values('value'),
+            output_field=money,
+        ), 0, output_field=money),
+        item_count=Coalesce(models.Subquery(lines.annotate(value=models.Sum('quantity')).values('value')), 0),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0007_unique_open_order_product'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='item_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Кол-во товаров'),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='total',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=12, verbose_name='Сумма заказа'),
+        ),
+        migrations.RunPython(fill_order_totals, migrations.RunPython.noop),
+    ]
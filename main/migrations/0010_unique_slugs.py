@@ -0,0 +1,39 @@
+# Generated by Django 4.2.30 on 2026-10-18 11:59
+
+from django.db import migrations, models
+
+
+def deduplicate_slugs(apps, schema_editor):
+    # Later rows sharing a slug get their primary key appended
+    for model_name in ('ProductCategory', 'ForProductCategory', 'Product'):
+        model = apps.get_model('main', model_name)
+        duplicates = model.objects.values('slug').annotate(n=models.Count('id')).filter(n__gt=1).values_list('slug', flat=True)
+        for slug in list(duplicates):
+            for pk in model.objects.filter(slug=slug).order_by('pk').values_list('pk', flat=True)[1:]:
+                model.objects.filter(pk=pk).update(slug=f'{slug}-{pk}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0009_stock_reservation'),
+    ]
+
+    operations = [
+        migrations.RunPython(deduplicate_slugs, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='forproductcategory',
+            name='slug',
+            field=models.SlugField(max_length=255, unique=True, verbose_name='URL для под-категории'),
+        ),
+        migrations.AlterField(
+            model_name='product',
+            name='slug',
+            field=models.SlugField(max_length=150, unique=True, verbose_name='URL для продукта'),
+        ),
+        migrations.AlterField(
+            model_name='productcategory',
+            name='slug',
+            field=models.SlugField(max_length=255, unique=True, verbose_name='URL для категории'),
+        ),
+    ]
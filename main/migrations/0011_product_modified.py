@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-18 12:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0010_unique_slugs'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='modified',
+            field=models.DateTimeField(auto_now=True, db_index=True, verbose_name='Изменен'),
+        ),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 4.2.30 on 2026-10-18 12:12
+
+from django.db import migrations, models
+
+
+def merge_open_orders(apps, schema_editor):
+    # Users with several open orders keep the oldest, which is the one the
+    # cart code already picked, with the lines of the others moved onto it
+    Order = apps.get_model('main', 'Order')
+    OrderProduct = apps.get_model('main', 'OrderProduct')
+    OrderProducts = Order.products.through
+    duplicates = (
+        Order.objects.filter(ordered=False)
+        .values('user_id')
+        .annotate(n=models.Count('id'))
+        .filter(n__gt=1)
+        .values_list('user_id', flat=True)
+    )
+    for user_id in list(duplicates):
+        orders = list(Order.objects.filter(user_id=user_id, ordered=False).order_by('pk').values_list('pk', flat=True))
+        keep, extra = orders[0], orders[1:]
+        linked = set(OrderProducts.objects.filter(order_id=keep).values_list('orderproduct_id', flat=True))
+        moved = set(OrderProducts.objects.filter(order_id__in=extra).values_list('orderproduct_id', flat=True)) - linked
+        OrderProducts.objects.bulk_create([OrderProducts(order_id=keep, orderproduct_id=pk) for pk in moved])
+        Order.objects.filter(pk__in=extra).delete()
+        lines = OrderProduct.objects.filter(pk__in=linked | moved).values_list('quantity', 'product__price')
+        Order.objects.filter(pk=keep).update(
+            total=sum((quantity * price for quantity, price in lines), 0),
+            item_count=sum(quantity for quantity, _ in lines),
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0012_catalog_version'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_open_orders, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='address',
+            index=models.Index(condition=models.Q(('default', True)), fields=['user', 'address_type'], name='address_default_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='order',
+            constraint=models.UniqueConstraint(condition=models.Q(('ordered', False)), fields=('user',), name='unique_open_order'),
+        ),
+    ]
@@ -0,0 +1,55 @@
+# Generated by Django 4.2.30 on 2026-10-18 12:35
+
+import random
+import string
+
+from django.db import migrations, models
+
+
+def _new_code(taken):
+    code = None
+    while code is None or code in taken:
+        code = ''.join(random.choices(string.ascii_lowercase + string.digits, k=20))
+    taken.add(code)
+    return code
+
+
+def dedupe_ref_codes(apps, schema_editor):
+    # Blank codes become NULL, which the unique index allows any number of;
+    # the later orders sharing a code get fresh ones, and placed orders
+    # without a code get one so refunds can find them
+    Order = apps.get_model('main', 'Order')
+    Order.objects.filter(ref_code='').update(ref_code=None)
+    duplicates = (
+        Order.objects.exclude(ref_code=None)
+        .values('ref_code')
+        .annotate(n=models.Count('id'))
+        .filter(n__gt=1)
+        .values_list('ref_code', flat=True)
+    )
+    taken = set(Order.objects.exclude(ref_code=None).values_list('ref_code', flat=True))
+    for ref_code in list(duplicates):
+        for pk in Order.objects.filter(ref_code=ref_code).order_by('pk').values_list('pk', flat=True)[1:]:
+            Order.objects.filter(pk=pk).update(ref_code=_new_code(taken))
+    for pk in Order.objects.filter(ordered=True, ref_code=None).values_list('pk', flat=True).iterator():
+        Order.objects.filter(pk=pk).update(ref_code=_new_code(taken))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0014_payment_job'),
+    ]
+
+    operations = [
+        migrations.RunPython(dedupe_ref_codes, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='order',
+            name='ref_code',
+            field=models.CharField(blank=True, max_length=20, null=True, unique=True, verbose_name='Код заказа'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(condition=models.Q(('refund_granted', False), ('refund_requested', True)), fields=['ordered_date'], name='order_refund_pending_idx'),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 4.2.30 on 2026-10-18 12:37
+
+from django.db import migrations, models
+
+
+def merge_favorites(apps, schema_editor):
+    # Users with several Favorite rows keep the oldest, with the products of
+    # the others moved onto it
+    Favorite = apps.get_model('main', 'Favorite')
+    FavoriteProducts = Favorite.fav_products.through
+    duplicates = (
+        Favorite.objects.values('user_id')
+        .annotate(n=models.Count('id'))
+        .filter(n__gt=1)
+        .values_list('user_id', flat=True)
+    )
+    for user_id in list(duplicates):
+        favorites = list(Favorite.objects.filter(user_id=user_id).order_by('pk').values_list('pk', flat=True))
+        keep, extra = favorites[0], favorites[1:]
+        kept = set(FavoriteProducts.objects.filter(favorite_id=keep).values_list('product_id', flat=True))
+        moved = set(FavoriteProducts.objects.filter(favorite_id__in=extra).values_list('product_id', flat=True)) - kept
+        FavoriteProducts.objects.bulk_create([FavoriteProducts(favorite_id=keep, product_id=pk) for pk in moved])
+        Favorite.objects.filter(pk__in=extra).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0015_refunds'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_favorites, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='favorite',
+            constraint=models.UniqueConstraint(fields=('user',), name='unique_favorite_user'),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 4.2.30 on 2026-10-18 12:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0016_unique_favorite_user'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(condition=models.Q(('ordered', False)), fields=['-id'], name='order_open_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(condition=models.Q(('being_delivered', True)), fields=['-id'], name='order_delivering_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(condition=models.Q(('refund_requested', True)), fields=['-id'], name='order_refund_requested_idx'),
+        ),
+    ]
@@ -0,0 +1,123 @@
+# Generated by Django 4.2.30 on 2026-10-18 12:45
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def dedupe_codes(apps, schema_editor):
+    # Coupon codes become unique; the oldest coupon keeps a shared code and
+    # the others get their pk appended
+    Coupon = apps.get_model('main', 'Coupon')
+    duplicates = (
+        Coupon.objects.values('code')
+        .annotate(n=models.Count('id'))
+        .filter(n__gt=1)
+        .values_list('code', flat=True)
+    )
+    for code in list(duplicates):
+        for coupon in Coupon.objects.filter(code=code).order_by('pk')[1:]:
+            suffix = f'-{coupon.pk}'
+            coupon.code = code[:15 - len(suffix)] + suffix
+            coupon.save(update_fields=['code'])
+
+
+def count_past_uses(apps, schema_editor):
+    # Existing coupons have no total limit; orders already carrying one count
+    # as redemptions, on the first shard and per user
+    Coupon = apps.get_model('main', 'Coupon')
+    CouponCounter = apps.get_model('main', 'CouponCounter')
+    CouponUse = apps.get_model('main', 'CouponUse')
+    Order = apps.get_model('main', 'Order')
+    uses = (
+        Order.objects.filter(coupon__isnull=False)
+        .values('coupon_id', 'user_id')
+        .annotate(n=models.Count('id'))
+    )
+    CouponUse.objects.bulk_create([CouponUse(coupon_id=row['coupon_id'], user_id=row['user_id'], count=row['n']) for row in uses])
+    totals = {}
+    for row in uses:
+        totals[row['coupon_id']] = totals.get(row['coupon_id'], 0) + row['n']
+    CouponCounter.objects.bulk_create([
+        CouponCounter(coupon_id=pk, shard=shard, used=totals.get(pk, 0) if shard == 0 else 0)
+        for pk in Coupon.objects.values_list('pk', flat=True)
+        for shard in range(8)
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('main', '0017_admin_order_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='coupon',
+            name='max_uses',
+            field=models.PositiveIntegerField(blank=True, null=True, verbose_name='Всего применений'),
+        ),
+        migrations.AddField(
+            model_name='coupon',
+            name='max_uses_per_user',
+            field=models.PositiveIntegerField(default=1, verbose_name='Применений на пользователя'),
+        ),
+        migrations.AddField(
+            model_name='coupon',
+            name='valid_from',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Действует с'),
+        ),
+        migrations.AddField(
+            model_name='coupon',
+            name='valid_until',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Действует до'),
+        ),
+        migrations.AlterField(
+            model_name='coupon',
+            name='amount',
+            field=models.DecimalField(decimal_places=2, max_digits=12),
+        ),
+        migrations.RunPython(dedupe_codes, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='coupon',
+            name='code',
+            field=models.CharField(max_length=15, unique=True),
+        ),
+        migrations.CreateModel(
+            name='CouponUse',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('count', models.PositiveIntegerField(default=0, verbose_name='Применений')),
+                ('coupon', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='main.coupon', verbose_name='Купон')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL, verbose_name='Пользователь')),
+            ],
+            options={
+                'verbose_name': 'Применение купона',
+                'verbose_name_plural': 'Применения купонов',
+            },
+        ),
+        migrations.CreateModel(
+            name='CouponCounter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('shard', models.PositiveSmallIntegerField(verbose_name='Шард')),
+                ('used', models.PositiveIntegerField(default=0, verbose_name='Использовано')),
+                ('capacity', models.PositiveIntegerField(blank=True, null=True, verbose_name='Емкость')),
+                ('coupon', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='counters', to='main.coupon', verbose_name='Купон')),
+            ],
+            options={
+                'verbose_name': 'Счетчик купона',
+                'verbose_name_plural': 'Счетчики купонов',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='couponuse',
+            constraint=models.UniqueConstraint(fields=('coupon', 'user'), name='unique_coupon_use'),
+        ),
+        migrations.AddConstraint(
+            model_name='couponcounter',
+            constraint=models.UniqueConstraint(fields=('coupon', 'shard'), name='unique_coupon_shard'),
+        ),
+        migrations.RunPython(count_past_uses, migrations.RunPython.noop),
+    ]
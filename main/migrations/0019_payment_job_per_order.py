@@ -0,0 +1,28 @@
+# Generated by Django 4.2.30 on 2026-10-18 13:16
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def drop_extra_jobs(apps, schema_editor):
+    # An order may have been enqueued twice before jobs became one per
+    # order; the newest job is the one payment_status reported on
+    PaymentJob = apps.get_model('main', 'PaymentJob')
+    newest = PaymentJob.objects.values('order_id').annotate(newest=models.Max('id')).values('newest')
+    PaymentJob.objects.exclude(pk__in=newest).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0018_coupons'),
+    ]
+
+    operations = [
+        migrations.RunPython(drop_extra_jobs, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='paymentjob',
+            name='order',
+            field=models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='payment_job', to='main.order', verbose_name='Заказ'),
+        ),
+    ]
@@ -1,8 +1,12 @@
+from decimal import Decimal
+
 from django.db import models
 from django.contrib.auth.models import User
 from django.db.models.signals import post_save
 from django.db.models import Sum
 from django.urls import reverse
+from django.utils import timezone
+from django.utils.text import Truncator
 
 from django_countries.fields import CountryField
 
@@ -18,6 +22,29 @@ ADDRESS_CHOICES = (
 	('S', 'shipping'),
 )
 
+PAYMENT_JOB_STATUSES = (
+	('pending', 'В очереди'),
+	('running', 'Выполняется'),
+	('succeeded', 'Оплачен'),
+	('failed', 'Ошибка'),
+)
+
+SHORT_DESCRIPTION_LENGTH = 50
+
+# Columns a product card needs in listings
+PRODUCT_CARD_FIELDS = ('id', 'title', 'poster', 'price', 'short_description')
+
+
+def fields_without_counters(instance, counters, update_fields=None):
+	# Counter columns are maintained with F() updates, so a full save must not
+	# write back the stale values loaded with the instance
+	if instance._state.adding or update_fields is not None:
+		return update_fields
+	return [
+		field.name for field in instance._meta.concrete_fields
+		if not field.primary_key and field.name not in counters
+	]
+
 
 class UserProfile(models.Model):
 	user = models.OneToOneField(User, on_delete=models.CASCADE, verbose_name='Пользователь', related_name='profile')
@@ -30,11 +57,16 @@ class UserProfile(models.Model):
 
 class ProductCategory(models.Model):
 	name = models.CharField(max_length=255, verbose_name='Название категории')
-	slug = models.SlugField(max_length=255, verbose_name='URL для категории')
+	slug = models.SlugField(max_length=255, unique=True, verbose_name='URL для категории')
+	product_count = models.PositiveIntegerField(default=0, editable=False, verbose_name='Кол-во продуктов')
 
 	def __str__(self):
 		return self.name
 
+	def save(self, *args, **kwargs):
+		kwargs['update_fields'] = fields_without_counters(self, ('product_count',), kwargs.get('update_fields'))
+		super().save(*args, **kwargs)
+
 	class Meta:
 		verbose_name = 'Категория (продукта)'
 		verbose_name_plural = 'Категории (продуктов)'
@@ -42,12 +74,17 @@ class ProductCategory(models.Model):
 
 class ForProductCategory(models.Model):
 	name = models.CharField(max_length=255, verbose_name='Название под-категории')
-	slug = models.SlugField(max_length=255, verbose_name='URL для под-категории')
+	slug = models.SlugField(max_length=255, unique=True, verbose_name='URL для под-категории')
 	category = models.ForeignKey(ProductCategory, on_delete=models.CASCADE, verbose_name='Категория для под-категории', related_name="pod")
+	product_count = models.PositiveIntegerField(default=0, editable=False, verbose_name='Кол-во продуктов')
 
 	def __str__(self):
 		return self.name
 
+	def save(self, *args, **kwargs):
+		kwargs['update_fields'] = fields_without_counters(self, ('product_count',), kwargs.get('update_fields'))
+		super().save(*args, **kwargs)
+
 	class Meta:
 		verbose_name = 'Под-категория'
 		verbose_name_plural = 'Под-категории'
@@ -69,18 +106,90 @@ class Product(models.Model):
 	discount_price = models.DecimalField(max_digits=10, decimal_places=2, verbose_name='Начальная цена товара')
 	category = models.ForeignKey(ForProductCategory, on_delete=models.CASCADE, verbose_name='Категория товара')
 	product_type_label = models.CharField(max_length=1, choices=TYPE_PRODUCT_LABELS, verbose_name='Тип редкости')
-	slug = models.SlugField(max_length=150, verbose_name='URL для продукта')
+	slug = models.SlugField(max_length=150, unique=True, verbose_name='URL для продукта')
 	description = models.TextField("Описание товара")
+	short_description = models.CharField(max_length=SHORT_DESCRIPTION_LENGTH, blank=True, editable=False, verbose_name='Краткое описание')
 	image_content = models.ManyToManyField(ImageProductContent, blank=True, verbose_name='Фотки продукта')
+	# Stock and holds only change through the conditional UPDATEs in main.inventory
 	product_qt = models.PositiveSmallIntegerField(default=1, verbose_name='Кол-во товара в наличии')
+	# Units held by StockReservation rows, see main.inventory
+	reserved_qt = models.PositiveIntegerField(default=0, editable=False, verbose_name='Кол-во товара в резерве')
+	# Set by save(); bulk writes that change feed data set it themselves
+	modified = models.DateTimeField(auto_now=True, db_index=True, verbose_name='Изменен')
 
 	def __str__(self):
 		return self.title
 
+	def save(self, *args, **kwargs):
+		self.short_description = Truncator(self.description).chars(SHORT_DESCRIPTION_LENGTH)
+		update_fields = fields_without_counters(self, ('product_qt', 'reserved_qt'), kwargs.get('update_fields'))
+		if update_fields is not None and 'description' in update_fields:
+			update_fields = {*update_fields, 'short_description'}
+		kwargs['update_fields'] = update_fields
+		super().save(*args, **kwargs)
+
 	class Meta:
 		verbose_name = 'Продукт'
 		verbose_name_plural = 'Продукты'
 		ordering = ['-pk']
+		indexes = [
+			models.Index(fields=['category', 'product_type_label'], name='product_category_label_idx'),
+		]
+
+
+class ProductFacetCount(models.Model):
+	category = models.ForeignKey(ForProductCategory, on_delete=models.CASCADE, verbose_name='Под-категория', related_name='facet_counts')
+	product_type_label = models.CharField(max_length=1, choices=TYPE_PRODUCT_LABELS, verbose_name='Тип редкости')
+	price_bucket = models.PositiveSmallIntegerField(verbose_name='Ценовой диапазон')
+	count = models.IntegerField(default=0, verbose_name='Кол-во продуктов')
+
+	class Meta:
+		verbose_name = 'Счетчик фасета'
+		verbose_name_plural = 'Счетчики фасетов'
+		constraints = [
+			models.UniqueConstraint(fields=['category', 'product_type_label', 'price_bucket'], name='unique_product_facet'),
+		]
+
+
+class CatalogVersion(models.Model):
+	"""
+	Single row counting catalog changes. The JSON API derives its ETag and
+	Last-Modified validators from it, so a conditional request costs one
+	query however much catalog data the response holds.
+	"""
+	version = models.PositiveBigIntegerField(default=0)
+	updated = models.DateTimeField(default=timezone.now)
+
+	@classmethod
+	def current(cls):
+		return cls.objects.filter(pk=1).values_list('version', 'updated').first() or (0, None)
+
+	@classmethod
+	def bump(cls):
+		now = timezone.now()
+		if not cls.objects.filter(pk=1).update(version=models.F('version') + 1, updated=now):
+			cls.objects.get_or_create(pk=1, defaults={'version': 1, 'updated': now})
+
+	class Meta:
+		verbose_name = 'Версия каталога'
+		verbose_name_plural = 'Версии каталога'
+
+
+class StockReservation(models.Model):
+	user = models.ForeignKey(User, on_delete=models.CASCADE, verbose_name='Пользователь')
+	product = models.ForeignKey(Product, on_delete=models.CASCADE, verbose_name='Продукт')
+	quantity = models.PositiveIntegerField(default=0, verbose_name='Кол-во')
+	expires_at = models.DateTimeField(db_index=True, verbose_name='Истекает')
+
+	def __str__(self):
+		return f'{self.product_id} x {self.quantity}'
+
+	class Meta:
+		verbose_name = 'Резерв товара'
+		verbose_name_plural = 'Резервы товаров'
+		constraints = [
+			models.UniqueConstraint(fields=['user', 'product'], name='unique_stock_reservation'),
+		]
 
 
 class OrderProduct(models.Model):
@@ -109,11 +218,16 @@ class OrderProduct(models.Model):
 	class Meta:
 		verbose_name = 'Продукт для заказа'
 		verbose_name_plural = 'Продукты для заказов'
+		constraints = [
+			# One open cart line per user and product, the target of the cart upsert
+			models.UniqueConstraint(fields=['user', 'product'], condition=models.Q(order_status=False), name='unique_open_order_product'),
+		]
 
 
 class Order(models.Model):
 	user = models.ForeignKey(User, on_delete=models.CASCADE, verbose_name='Пользователь', related_name='orders')
-	ref_code = models.CharField(max_length=20, blank=True, null=True)
+	# Assigned when the order is paid or placed, see main.cart.with_ref_code
+	ref_code = models.CharField(max_length=20, blank=True, null=True, unique=True, verbose_name='Код заказа')
 	products = models.ManyToManyField(OrderProduct)
 	start_date = models.DateTimeField(auto_now_add=True)
 	ordered_date = models.DateTimeField()
@@ -126,21 +240,42 @@ class Order(models.Model):
 	recieved = models.BooleanField(default=False, verbose_name='Получен')
 	refund_requested = models.BooleanField(default=False, verbose_name='Запрошен возврат')
 	refund_granted = models.BooleanField(default=False, verbose_name='Возврат гарантирован')
+	# Maintained by the cart mutations in main.cart, see reconcile_order_totals
+	total = models.DecimalField(max_digits=12, decimal_places=2, default=0, editable=False, verbose_name='Сумма заказа')
+	item_count = models.PositiveIntegerField(default=0, editable=False, verbose_name='Кол-во товаров')
 
 	def __str__(self):
 		return self.user.username
 
+	def save(self, *args, **kwargs):
+		kwargs['update_fields'] = fields_without_counters(self, ('total', 'item_count'), kwargs.get('update_fields'))
+		super().save(*args, **kwargs)
+
 	def get_total(self):
-		total_price = 0
-		for order_product in self.products.all():
-			total_price += int(order_product.get_total_price())
+		total_price = self.total
 		if self.coupon:
-			total_price -= int(self.coupon.amount)
+			# A coupon worth more than the order makes it free, not negative
+			total_price = max(total_price - self.coupon.amount, Decimal(0))
 		return total_price
 
 	class Meta:
 		verbose_name = 'Заказ'
 		verbose_name_plural = 'Заказы'
+		constraints = [
+			# One open order (the cart) per user, also the index behind every cart lookup
+			models.UniqueConstraint(fields=['user'], condition=models.Q(ordered=False), name='unique_open_order'),
+		]
+		indexes = [
+			# The refund queue staff works through, see main.refunds.pending_orders
+			models.Index(fields=['ordered_date'], condition=models.Q(refund_requested=True, refund_granted=False), name='order_refund_pending_idx'),
+			# Admin changelist filters on the rare side of a flag, newest first.
+			# Partial, because Django filters booleans with a bare column that
+			# SQLite matches to an index condition but not to an index column;
+			# the common side is read newest first off the primary key
+			models.Index(fields=['-id'], condition=models.Q(ordered=False), name='order_open_idx'),
+			models.Index(fields=['-id'], condition=models.Q(being_delivered=True), name='order_delivering_idx'),
+			models.Index(fields=['-id'], condition=models.Q(refund_requested=True), name='order_refund_requested_idx'),
+		]
 
 
 class Address(models.Model):
@@ -158,6 +293,9 @@ class Address(models.Model):
 	class Meta:
 		verbose_name = 'Адрес'
 		verbose_name_plural = 'Адреса'
+		indexes = [
+			models.Index(fields=['user', 'address_type'], condition=models.Q(default=True), name='address_default_idx'),
+		]
 
 
 class Payment(models.Model):
@@ -174,9 +312,48 @@ class Payment(models.Model):
 		verbose_name_plural = 'Платежи'
 
 
+class PaymentJob(models.Model):
+	"""
+	A charge waiting for, or handled by, the payment worker (main.payments),
+	one per order. The order's ref_code is the idempotency key sent to the
+	provider, a failed job paid again gets a fresh one.
+	"""
+	order = models.OneToOneField(Order, on_delete=models.CASCADE, verbose_name='Заказ', related_name='payment_job')
+	user = models.ForeignKey(User, on_delete=models.CASCADE, verbose_name='Пользователь')
+	provider = models.CharField(max_length=20, verbose_name='Платежная система')
+	idempotency_key = models.CharField(max_length=20, unique=True, verbose_name='Ключ идемпотентности')
+	amount = models.DecimalField(max_digits=12, decimal_places=2, verbose_name='Сумма')
+	status = models.CharField(max_length=10, choices=PAYMENT_JOB_STATUSES, default='pending', verbose_name='Статус')
+	attempts = models.PositiveSmallIntegerField(default=0, verbose_name='Попыток')
+	# Due time of the next attempt, pushed back after every retryable failure
+	run_at = models.DateTimeField(default=timezone.now, verbose_name='Следующая попытка')
+	# A running job whose worker died is picked up again after this
+	locked_until = models.DateTimeField(blank=True, null=True, verbose_name='Заблокирован до')
+	last_error = models.TextField(blank=True, verbose_name='Последняя ошибка')
+	payment = models.ForeignKey(Payment, on_delete=models.SET_NULL, verbose_name='Платеж', blank=True, null=True)
+	created = models.DateTimeField(auto_now_add=True, verbose_name='Создан')
+	updated = models.DateTimeField(auto_now=True, verbose_name='Изменен')
+
+	def __str__(self):
+		return f'{self.idempotency_key} ({self.status})'
+
+	class Meta:
+		verbose_name = 'Задание на оплату'
+		verbose_name_plural = 'Задания на оплату'
+		indexes = [
+			models.Index(fields=['status', 'run_at'], name='paymentjob_due_idx'),
+		]
+
+
 class Coupon(models.Model):
-	code = models.CharField(max_length=15)
-	amount = models.FloatField()
+	code = models.CharField(max_length=15, unique=True)
+	amount = models.DecimalField(max_digits=12, decimal_places=2)
+	# Redeemable from valid_from until valid_until, either end may be open
+	valid_from = models.DateTimeField(blank=True, null=True, verbose_name='Действует с')
+	valid_until = models.DateTimeField(blank=True, null=True, verbose_name='Действует до')
+	# Redemptions in total (empty for no limit) and per user, see main.coupons
+	max_uses = models.PositiveIntegerField(blank=True, null=True, verbose_name='Всего применений')
+	max_uses_per_user = models.PositiveIntegerField(default=1, verbose_name='Применений на пользователя')
 
 	def __str__(self):
 		return self.code
@@ -186,6 +363,49 @@ class Coupon(models.Model):
 		verbose_name_plural = 'Купоны'
 
 
+class CouponCounter(models.Model):
+	"""
+	One of the shards counting a coupon's redemptions. max_uses is split
+	across the shards and a redemption takes a slot from any shard with
+	room, so a busy campaign does not queue on a single row.
+	"""
+	coupon = models.ForeignKey(Coupon, on_delete=models.CASCADE, related_name='counters', verbose_name='Купон')
+	shard = models.PositiveSmallIntegerField(verbose_name='Шард')
+	used = models.PositiveIntegerField(default=0, verbose_name='Использовано')
+	# Empty for a coupon without a total limit
+	capacity = models.PositiveIntegerField(blank=True, null=True, verbose_name='Емкость')
+
+	def __str__(self):
+		return f'{self.coupon_id}/{self.shard}'
+
+	class Meta:
+		verbose_name = 'Счетчик купона'
+		verbose_name_plural = 'Счетчики купонов'
+		constraints = [
+			models.UniqueConstraint(fields=['coupon', 'shard'], name='unique_coupon_shard'),
+		]
+
+
+class CouponUse(models.Model):
+	"""
+	How many times a user redeemed a coupon, bumped by an upsert in
+	main.coupons that stops at Coupon.max_uses_per_user.
+	"""
+	coupon = models.ForeignKey(Coupon, on_delete=models.CASCADE, verbose_name='Купон')
+	user = models.ForeignKey(User, on_delete=models.CASCADE, verbose_name='Пользователь')
+	count = models.PositiveIntegerField(default=0, verbose_name='Применений')
+
+	def __str__(self):
+		return f'{self.coupon_id}/{self.user_id}'
+
+	class Meta:
+		verbose_name = 'Применение купона'
+		verbose_name_plural = 'Применения купонов'
+		constraints = [
+			models.UniqueConstraint(fields=['coupon', 'user'], name='unique_coupon_use'),
+		]
+
+
 class Refund(models.Model):
 	order = models.ForeignKey(Order, on_delete=models.CASCADE, verbose_name='Заказ')
 	reason_for = models.TextField()
@@ -210,6 +430,10 @@ class Favorite(models.Model):
 	class Meta:
 		verbose_name = 'Избранное'
 		verbose_name_plural = 'Избранные'
+		constraints = [
+			# One Favorite per user, main.favorites caches its products by user
+			models.UniqueConstraint(fields=['user'], name='unique_favorite_user'),
+		]
 
 
 def userprofile_receiver(sender, instance, created, *args, **kwargs):
@@ -0,0 +1,128 @@
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Max
+from django.utils.encoding import force_bytes, force_str
+from django.utils.functional import cached_property
+from django.utils.http import urlsafe_base64_decode, urlsafe_base64_encode
+
+
+def encode_cursor(value):
+	return urlsafe_base64_encode(force_bytes(value))
+
+
+def decode_cursor(cursor):
+	if not cursor:
+		return None
+	try:
+		return int(force_str(urlsafe_base64_decode(cursor)))
+	except (TypeError, ValueError):
+		return None
+
+
+class KeysetPage:
+
+	def __init__(self, object_list, next_cursor=None, prev_cursor=None):
+		self.object_list = object_list
+		self.next_cursor = next_cursor
+		self.prev_cursor = prev_cursor
+
+	def __iter__(self):
+		return iter(self.object_list)
+
+	def __len__(self):
+		return len(self.object_list)
+
+	@property
+	def has_next(self):
+		return self.next_cursor is not None
+
+	@property
+	def has_previous(self):
+		return self.prev_cursor is not None
+
+
+class KeysetPaginator:
+	"""
+	Seek pagination over a unique integer column (``pk`` by default).
+
+	Pages are fetched with ``WHERE key < cursor ORDER BY key LIMIT n`` so the
+	cost of a page does not depend on how deep it is, unlike OFFSET.
+	"""
+
+	def __init__(self, queryset, per_page, key='pk', descending=True):
+		self.queryset = queryset
+		self.per_page = per_page
+		self.key = key
+		self.descending = descending
+
+	def _ordered(self, forward):
+		descending = self.descending if forward else not self.descending
+		return self.queryset.order_by(('-' if descending else '') + self.key)
+
+	def _seek(self, value, forward):
+		lookup = 'lt' if self.descending == forward else 'gt'
+		return self._ordered(forward).filter(**{f'{self.key}__{lookup}': value})
+
+	def _query(self, after, before):
+		if before is not None:
+			return self._seek(before, forward=False)[:self.per_page + 1]
+		qs = self._seek(after, forward=True) if after is not None else self._ordered(forward=True)
+		return qs[:self.per_page + 1]
+
+	def _page(self, rows, after, before):
+		if before is not None:
+			has_more = len(rows) > self.per_page
+			rows = rows[:self.per_page][::-1]
+			has_prev, has_next = has_more, True
+		else:
+			has_next = len(rows) > self.per_page
+			rows = rows[:self.per_page]
+			has_prev = after is not None
+
+		if not rows:
+			return KeysetPage(rows)
+		return KeysetPage(
+			rows,
+			next_cursor=encode_cursor(getattr(rows[-1], self.key)) if has_next else None,
+			prev_cursor=encode_cursor(getattr(rows[0], self.key)) if has_prev else None,
+		)
+
+	def page(self, after=None, before=None):
+		after, before = decode_cursor(after), decode_cursor(before)
+		return self._page(list(self._query(after, before)), after, before)
+
+	async def apage(self, after=None, before=None):
+		after, before = decode_cursor(after), decode_cursor(before)
+		return self._page([row async for row in self._query(after, before)], after, before)
+
+
+class EstimatedCountPaginator(Paginator):
+	"""
+	Paginator for admin changelists. A whole big table is not counted: its
+	size is estimated from the planner statistics on PostgreSQL and from the
+	largest primary key on SQLite, both without reading the table. Filtered
+	changelists, and tables below ``estimate_above`` rows, get exact counts.
+	"""
+	estimate_above = 100_000
+
+	def _estimate(self):
+		queryset = self.object_list
+		connection = connections[queryset.db]
+		if connection.vendor == 'postgresql':
+			with connection.cursor() as cursor:
+				cursor.execute('SELECT reltuples FROM pg_class WHERE relname = %s', [queryset.model._meta.db_table])
+				row = cursor.fetchone()
+			return int(row[0]) if row else None
+		if connection.vendor == 'sqlite':
+			# Read from the end of the primary key index, deleted rows make it an upper bound
+			return queryset.model._default_manager.using(queryset.db).aggregate(n=Max('pk'))['n'] or 0
+		return None
+
+	@cached_property
+	def count(self):
+		queryset = self.object_list
+		if hasattr(queryset, 'query') and not queryset.query.where:
+			estimate = self._estimate()
+			if estimate is not None and estimate > self.estimate_above:
+				return estimate
+		return super().count
@@ -0,0 +1,225 @@
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from functools import lru_cache
+
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from . import inventory
+from .cart import complete_order, create_ref_code, with_ref_code
+from .models import Order, Payment, PaymentJob
+
+
+class ProviderError(Exception):
+	"""
+	The provider could not be reached or failed; the charge is retried.
+	"""
+
+
+class PaymentDeclined(Exception):
+	"""
+	The provider refused the charge; retrying will not help.
+	"""
+
+
+class FakeProvider:
+	"""
+	In-process stand-in for a payment provider. Every call sleeps
+	PAYMENT_FAKE_LATENCY seconds and fails with PAYMENT_FAKE_FAILURE_RATE
+	probability. Charges are remembered by idempotency key, so charging a
+	key twice returns the first charge, like real providers do.
+	"""
+	_charges = {}
+	_lock = threading.Lock()
+
+	def __init__(self, name):
+		self.name = name
+
+	def _call(self):
+		time.sleep(settings.PAYMENT_FAKE_LATENCY)
+		if random.random() < settings.PAYMENT_FAKE_FAILURE_RATE:
+			raise ProviderError(f'{self.name} is unavailable')
+
+	def charge(self, idempotency_key, amount):
+		self._call()
+		with self._lock:
+			if idempotency_key not in self._charges:
+				self._charges[idempotency_key] = f'{self.name}-{create_ref_code()}'
+			return self._charges[idempotency_key]
+
+	def refund(self, charge_id):
+		self._call()
+
+
+@lru_cache(maxsize=None)
+def get_provider(name):
+	try:
+		path = settings.PAYMENT_PROVIDERS[name]
+	except KeyError:
+		raise ValueError(f'Unknown payment provider {name!r}')
+	return import_string(path)(name)
+
+
+def enqueue(order, provider):
+	"""
+	Queues a charge of the order's total with the provider and returns the
+	job. The order's ref_code becomes the idempotency key; enqueueing an
+	order again returns its existing job. A failed job is queued again
+	for the order's current total, under a new idempotency key since the
+	provider would answer the old one with the charge it refunded.
+	"""
+	get_provider(provider)
+	with transaction.atomic():
+		# The guarded write goes first, it also takes the write lock
+		with_ref_code(lambda ref_code: Order.objects.filter(pk=order.pk, ref_code=None).update(ref_code=ref_code))
+		order = Order.objects.select_related('coupon').get(pk=order.pk)
+		job, created = PaymentJob.objects.get_or_create(
+			order=order,
+			defaults={'idempotency_key': order.ref_code, 'user_id': order.user_id, 'provider': provider, 'amount': order.get_total()},
+		)
+		if not created and job.status == 'failed':
+			now = timezone.now()
+			with_ref_code(lambda key: PaymentJob.objects.filter(pk=job.pk, status='failed').update(
+				idempotency_key=key, provider=provider, amount=order.get_total(), status='pending', attempts=0,
+				run_at=now, locked_until=None, last_error='', payment=None, updated=now,
+			))
+			job.refresh_from_db()
+	return job
+
+
+_CLAIM = '''
+	UPDATE main_paymentjob
+	SET status = 'running', attempts = attempts + 1, locked_until = %s, updated = %s
+	WHERE id IN (
+		SELECT id FROM main_paymentjob
+		WHERE (status = 'pending' AND run_at <= %s) OR (status = 'running' AND locked_until < %s)
+		ORDER BY run_at
+		LIMIT %s
+	)
+	RETURNING id
+'''
+
+
+def claim(limit):
+	"""
+	Marks up to ``limit`` due jobs as running and returns their ids. Jobs
+	whose lease ran out (their worker died) are due again.
+	"""
+	now = timezone.now()
+	with transaction.atomic(), connection.cursor() as cursor:
+		cursor.execute(_CLAIM, [now + timedelta(seconds=settings.PAYMENT_LEASE), now, now, now, limit])
+		return [row[0] for row in cursor.fetchall()]
+
+
+def retry_delay(attempts):
+	# Exponential backoff: base, 2 * base, 4 * base, ... up to the cap
+	return min(settings.PAYMENT_RETRY_DELAY * 2 ** (attempts - 1), settings.PAYMENT_RETRY_MAX_DELAY)
+
+
+def _finish(job, charge_id):
+	order = job.order
+	# Read before the transaction, a SQLite transaction has to write first
+	if order.get_total() != job.amount:
+		raise PaymentDeclined('Заказ изменился во время оплаты')
+	with transaction.atomic():
+		payment = Payment.objects.create(stripe_charge_id=charge_id, user_id=job.user_id, amount=job.amount)
+		Order.objects.filter(pk=order.pk).update(payment=payment)
+		complete_order(order)
+		PaymentJob.objects.filter(pk=job.pk).update(status='succeeded', payment=payment, last_error='', updated=timezone.now())
+
+
+def run_job(job_id):
+	"""
+	Charges a claimed job and places its order. Provider failures are
+	retried with backoff up to PAYMENT_MAX_ATTEMPTS; a declined charge, or
+	one the order can no longer be placed for, fails the job and is refunded.
+	"""
+	job = PaymentJob.objects.select_related('order__coupon', 'order__user').get(pk=job_id)
+	provider = get_provider(job.provider)
+	try:
+		charge_id = provider.charge(job.idempotency_key, job.amount)
+	except ProviderError as e:
+		if job.attempts >= settings.PAYMENT_MAX_ATTEMPTS:
+			_fail(job, e)
+		else:
+			PaymentJob.objects.filter(pk=job.pk).update(
+				status='pending', run_at=timezone.now() + timedelta(seconds=retry_delay(job.attempts)),
+				locked_until=None, last_error=str(e), updated=timezone.now(),
+			)
+		return
+	except PaymentDeclined as e:
+		_fail(job, e)
+		return
+	try:
+		_finish(job, charge_id)
+	except (PaymentDeclined, inventory.OutOfStock) as e:
+		provider.refund(charge_id)
+		_fail(job, e)
+
+
+def _fail(job, error):
+	PaymentJob.objects.filter(pk=job.pk).update(status='failed', locked_until=None, last_error=str(error), updated=timezone.now())
+
+
+def _run(job_id):
+	try:
+		run_job(job_id)
+	except Exception as e:
+		# Left running, a later claim takes it over once the lease runs out
+		PaymentJob.objects.filter(pk=job_id).update(last_error=repr(e))
+	finally:
+		close_old_connections()
+
+
+def run_due():
+	"""
+	Runs every due job inline, in this thread, and returns how many ran.
+	"""
+	count = 0
+	while job_ids := claim(100):
+		for job_id in job_ids:
+			run_job(job_id)
+		count += len(job_ids)
+	return count
+
+
+class Worker:
+	"""
+	Claims due jobs and runs them in ``concurrency`` threads, so that many
+	slow provider calls wait side by side.
+	"""
+
+	def __init__(self, concurrency=8, poll_interval=1.0):
+		self.concurrency = concurrency
+		self.poll_interval = poll_interval
+		self.processed = 0
+		self._stop = threading.Event()
+
+	def stop(self):
+		self._stop.set()
+
+	def run(self, burst=False):
+		"""
+		Works until stop() is called, or with ``burst`` until no job is due.
+		Returns the number of jobs run.
+		"""
+		running = set()
+		with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+			while not self._stop.is_set():
+				running = {future for future in running if not future.done()}
+				free = self.concurrency - len(running)
+				job_ids = claim(free) if free else []
+				for job_id in job_ids:
+					running.add(executor.submit(_run, job_id))
+				self.processed += len(job_ids)
+				if not job_ids:
+					if burst and not running:
+						break
+					self._stop.wait(self.poll_interval if not running else 0.01)
+		close_old_connections()
+		return self.processed
@@ -0,0 +1,120 @@
+import time
+
+from django.core.cache import cache
+from django.db import transaction
+from django.template.loader import render_to_string
+
+from .models import Product
+
+
+# Seconds a rendered product body stays cached; a change to the product or
+# its images moves the product to a new version sooner. Versions and hit
+# counts are only seen by every process in a shared cache (main.E001).
+PRODUCT_PAGE_TIMEOUT = 60 * 60 * 24
+
+_STATS = ('hits', 'misses')
+
+
+# Moved on by bulk catalog writes, which send no signals per product
+_GENERATION_KEY = 'product-page-generation'
+
+
+def _version_key(product_id):
+	return f'product-page-version:{product_id}'
+
+
+def _stat_key(name):
+	return f'product-page-stats:{name}'
+
+
+def version(product_id):
+	"""
+	Returns the current version of the product's page, its own version and
+	the catalog's generation, read together. A version lost from the cache
+	starts over from the clock, so it never names an old body.
+	"""
+	keys = [_GENERATION_KEY, _version_key(product_id)]
+	current = cache.get_many(keys)
+	for key in keys:
+		if key not in current:
+			cache.add(key, time.time_ns(), None)
+			current[key] = cache.get(key)
+	return f'{current[_GENERATION_KEY]}.{current[keys[1]]}'
+
+
+def bump(*product_ids):
+	"""
+	Moves the products to a new page version; the bodies cached under the
+	old one are never read again and expire. Moved again after commit, so a
+	page rendered from the uncommitted state meanwhile is not kept.
+	"""
+	def move():
+		now = time.time_ns()
+		cache.set_many({_version_key(product_id): now for product_id in product_ids}, None)
+
+	if product_ids:
+		move()
+		transaction.on_commit(move)
+
+
+def bump_all():
+	"""
+	Moves every product to a new page version, for bulk writes that skip
+	the model signals.
+	"""
+	def move():
+		cache.set(_GENERATION_KEY, time.time_ns(), None)
+
+	move()
+	transaction.on_commit(move)
+
+
+def _count(name):
+	key = _stat_key(name)
+	try:
+		cache.incr(key)
+	except ValueError:
+		# First count, or the counter was evicted
+		if not cache.add(key, 1, None):
+			cache.incr(key)
+
+
+def stats():
+	"""
+	Returns the hit and miss counts of the product page cache.
+	"""
+	counts = cache.get_many([_stat_key(name) for name in _STATS])
+	return {name: counts.get(_stat_key(name), 0) for name in _STATS}
+
+
+def reset_stats():
+	cache.delete_many([_stat_key(name) for name in _STATS])
+
+
+def get_page(product_id):
+	"""
+	Returns ``{'title': ..., 'body': ...}``, the part of the product page
+	that is the same for every viewer, rendered once per product version.
+	Raises ``Product.DoesNotExist`` for a product that does not exist.
+	"""
+	return lookup(product_id)[0]
+
+
+def lookup(product_id):
+	"""
+	Returns ``(page, hit)``: the page of get_page, and whether it came from
+	the cache.
+	"""
+	key = f'product-page:{product_id}:{version(product_id)}'
+	page = cache.get(key)
+	if page is not None:
+		_count('hits')
+		return page, True
+	_count('misses')
+	product = Product.objects.prefetch_related('image_content').get(pk=product_id)
+	page = {
+		'title': product.title,
+		'body': render_to_string('product_body.html', {'product': product}),
+	}
+	cache.set(key, page, PRODUCT_PAGE_TIMEOUT)
+	return page, False
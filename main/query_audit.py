@@ -0,0 +1,66 @@
+import re
+
+from django.db import connection
+from django.utils import timezone
+
+from .feeds import feed_queryset
+from .refunds import pending_orders
+from .models import Address, Coupon, CouponCounter, CouponUse, Favorite, Order, OrderProduct, Product, StockReservation
+
+
+# Lookups that run on every cart, checkout or catalog request and must be
+# served by an index. Ids are placeholders, the plans do not depend on them.
+HOT_QUERIES = {
+	'open order': lambda: Order.objects.filter(user_id=1, ordered=False),
+	'orders of a user': lambda: Order.objects.filter(user_id=1),
+	'order by ref code': lambda: Order.objects.filter(ref_code='ref', user_id=1, ordered=True),
+	'pending refunds': lambda: pending_orders().order_by('ordered_date'),
+	'admin: open orders': lambda: Order.objects.filter(ordered=False).order_by('-pk')[:50],
+	'admin: orders being delivered': lambda: Order.objects.filter(being_delivered=True).order_by('-pk')[:50],
+	'admin: refund requests': lambda: Order.objects.filter(refund_requested=True).order_by('-pk')[:50],
+	'admin: order by ref code': lambda: Order.objects.filter(ref_code='ref').select_related('user'),
+	'open cart line': lambda: OrderProduct.objects.filter(user_id=1, product_id=1, order_status=False),
+	'open cart lines': lambda: OrderProduct.objects.filter(user_id=1, order_status=False),
+	'open orders holding a product': lambda: Order.objects.filter(
+		ordered=False, products__product_id=1, products__order_status=False,
+	),
+	'default address': lambda: Address.objects.filter(user_id=1, address_type='S', default=True),
+	'favorites': lambda: Favorite.objects.filter(user_id=1),
+	'favorite ids': lambda: Favorite.fav_products.through.objects.filter(favorite__user_id=1),
+	'favorites page': lambda: Product.objects.filter(favorite__user_id=1),
+	'coupon by code': lambda: Coupon.objects.filter(code='code'),
+	'coupon shard': lambda: CouponCounter.objects.filter(coupon_id=1, shard=0),
+	'coupon uses of a user': lambda: CouponUse.objects.filter(coupon_id=1, user_id=1),
+	'subcategory page': lambda: Product.objects.filter(category_id=1).order_by('-pk')[:25],
+	'product by slug': lambda: Product.objects.filter(slug='slug'),
+	'incremental feed': lambda: feed_queryset(since=timezone.now()),
+	'expired reservations': lambda: StockReservation.objects.filter(expires_at__lt=timezone.now()),
+}
+
+# EXPLAIN output lines that read a whole table, per database vendor, with
+# the index the scan walks where the plan names one
+_FULL_SCAN = {
+	'sqlite': re.compile(r'\bSCAN (\w+)(?: USING (?:COVERING )?INDEX (\w+))?'),
+	'postgresql': re.compile(r'Seq Scan on (\w+)()'),
+}
+
+
+def _partial_indexes():
+	if connection.vendor != 'sqlite':
+		return set()
+	with connection.cursor() as cursor:
+		cursor.execute("SELECT name FROM sqlite_master WHERE type = 'index' AND sql LIKE '% WHERE %'")
+		return {row[0] for row in cursor.fetchall()}
+
+
+def full_scans(queryset):
+	"""
+	Returns the query plan of the queryset and the tables it reads in full.
+	Walking a partial index only reads the rows it holds, so it does not count.
+	"""
+	pattern = _FULL_SCAN.get(connection.vendor)
+	if pattern is None:
+		raise ValueError(f'Cannot read {connection.vendor} query plans')
+	plan = queryset.explain()
+	partial = _partial_indexes()
+	return plan, [match.group(1) for match in pattern.finditer(plan) if match.group(2) not in partial]
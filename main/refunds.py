@@ -0,0 +1,70 @@
+from django.db import transaction
+
+from .models import Order, Refund
+
+
+# Ref codes per UPDATE, well under SQLite's bound parameter limit
+PROCESS_BATCH_SIZE = 500
+
+
+class RefundError(Exception):
+	"""
+	The refund request cannot be recorded, the message is for the shopper.
+	"""
+
+
+def request_refund(user, ref_code, reason, email):
+	"""
+	Records a refund request for the user's placed order with ``ref_code``
+	and returns the Refund. The order is found with one lookup on the unique
+	ref_code index; a second request for the same order raises RefundError.
+	"""
+	order = Order.objects.filter(ref_code=ref_code, user=user, ordered=True).values('pk', 'refund_requested').first()
+	if order is None:
+		raise RefundError('Заказ с таким кодом не найден')
+	if order['refund_requested']:
+		raise RefundError('Возврат по этому заказу уже запрошен')
+	with transaction.atomic():
+		# The guarded write goes first, a concurrent resubmission records nothing
+		if not Order.objects.filter(pk=order['pk'], refund_requested=False).update(refund_requested=True):
+			raise RefundError('Возврат по этому заказу уже запрошен')
+		return Refund.objects.create(order_id=order['pk'], reason_for=reason, email=email)
+
+
+def pending_orders():
+	"""
+	Placed orders with a refund requested and not granted yet.
+	"""
+	return Order.objects.filter(refund_requested=True, refund_granted=False)
+
+
+def process_refunds(ref_codes=None, grant=True, pks=None):
+	"""
+	Grants, or with ``grant=False`` denies, the refunds of the orders with
+	``ref_codes`` or primary keys ``pks``, or of every pending order without
+	either, and returns how many orders changed. Every batch is two
+	set-based UPDATEs, all in one transaction.
+
+	Granting marks the orders refund_requested and refund_granted, whether
+	the shopper asked or not. Denying clears refund_requested, so the order
+	leaves the pending queue; its Refund rows stay, not accepted.
+	"""
+	if ref_codes is None and pks is None:
+		batches = [pending_orders()]
+	else:
+		lookup, values = ('ref_code__in', ref_codes) if pks is None else ('pk__in', pks)
+		values = list(dict.fromkeys(values))
+		batches = [
+			Order.objects.filter(**{lookup: values[start:start + PROCESS_BATCH_SIZE]}, ordered=True)
+			for start in range(0, len(values), PROCESS_BATCH_SIZE)
+		]
+	changed = 0
+	with transaction.atomic():
+		for orders in batches:
+			# Refunds first, the order update may take the orders out of the batch
+			Refund.objects.filter(order__in=orders.values('pk')).update(accepted=grant)
+			if grant:
+				changed += orders.exclude(refund_granted=True).update(refund_requested=True, refund_granted=True)
+			else:
+				changed += orders.filter(refund_granted=False, refund_requested=True).update(refund_requested=False)
+	return changed
@@ -0,0 +1,79 @@
+import re
+
+from django.db import connection, transaction
+
+
+FTS_TABLE = 'main_product_fts'
+
+# Product rows with their category path, in the column order of the FTS table
+_INDEX_SELECT = f'''
+	INSERT INTO {FTS_TABLE} (rowid, title, description, category)
+	SELECT p.id, p.title, p.description, sc.name || ' ' || c.name
+	FROM main_product p
+	JOIN main_forproductcategory sc ON sc.id = p.category_id
+	JOIN main_productcategory c ON c.id = sc.category_id
+'''
+
+MAX_QUERY_TERMS = 8
+
+
+def build_match_expression(query):
+	# Every word becomes a quoted prefix term, so user input can never be
+	# parsed as FTS5 syntax ("AND", "NEAR", column filters, ...)
+	terms = re.findall(r'\w+', query or '')[:MAX_QUERY_TERMS]
+	return ' '.join(f'"{term}"*' for term in terms)
+
+
+def search_product_ids(query, limit, offset=0):
+	match = build_match_expression(query)
+	if not match:
+		return []
+	with connection.cursor() as cursor:
+		cursor.execute(
+			f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s ORDER BY rank LIMIT %s OFFSET %s',
+			[match, limit, offset],
+		)
+		return [row[0] for row in cursor.fetchall()]
+
+
+def _reindex(where, params):
+	with connection.cursor() as cursor:
+		cursor.execute(
+			f'DELETE FROM {FTS_TABLE} WHERE rowid IN (SELECT p.id FROM main_product p '
+			f'JOIN main_forproductcategory sc ON sc.id = p.category_id WHERE {where})',
+			params,
+		)
+		cursor.execute(f'{_INDEX_SELECT} WHERE {where}', params)
+
+
+def index_product(product_id):
+	with connection.cursor() as cursor:
+		cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [product_id])
+		cursor.execute(f'{_INDEX_SELECT} WHERE p.id = %s', [product_id])
+
+
+def unindex_product(product_id):
+	with connection.cursor() as cursor:
+		cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [product_id])
+
+
+def reindex_subcategory(subcategory_id):
+	_reindex('p.category_id = %s', [subcategory_id])
+
+
+def reindex_category(category_id):
+	_reindex('sc.category_id = %s', [category_id])
+
+
+def rebuild_index(batch_size=10000):
+	with transaction.atomic(), connection.cursor() as cursor:
+		cursor.execute(f'DELETE FROM {FTS_TABLE}')
+		cursor.execute('SELECT MIN(id), MAX(id) FROM main_product')
+		low, high = cursor.fetchone()
+		indexed = 0
+		if low is not None:
+			for start in range(low, high + 1, batch_size):
+				cursor.execute(f'{_INDEX_SELECT} WHERE p.id >= %s AND p.id < %s', [start, start + batch_size])
+				indexed += cursor.rowcount
+		cursor.execute(f"INSERT INTO {FTS_TABLE} ({FTS_TABLE}) VALUES ('optimize')")
+	return indexed
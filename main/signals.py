@@ -0,0 +1,123 @@
+from django.db.models.signals import m2m_changed, pre_delete, pre_save, post_save, post_delete
+from django.utils import timezone
+
+from . import cart, coupons, facets, favorites, images, product_pages, search
+from .models import CatalogVersion, Coupon, Favorite, Product, ProductCategory, ForProductCategory, ImageProductContent
+
+
+def product_pre_save(sender, instance, raw=False, **kwargs):
+	instance._stored = None
+	if not raw and not instance._state.adding:
+		instance._stored = Product.objects.filter(pk=instance.pk).only('category_id', 'product_type_label', 'price', 'poster').first()
+
+
+def product_saved(sender, instance, raw=False, **kwargs):
+	if raw:
+		return
+	stored = getattr(instance, '_stored', None)
+	search.index_product(instance.pk)
+	facets.apply_change(stored and facets.facet_key(stored), facets.facet_key(instance))
+	if stored is not None and stored.price != instance.price:
+		cart.reprice_open_orders(instance.pk)
+	if instance.poster and (stored is None or stored.poster.name != instance.poster.name):
+		images.schedule(instance.poster.name)
+
+
+def product_deleted(sender, instance, **kwargs):
+	search.unindex_product(instance.pk)
+	facets.apply_change(facets.facet_key(instance), None)
+
+
+def subcategory_saved(sender, instance, created, raw=False, **kwargs):
+	if not created and not raw:
+		search.reindex_subcategory(instance.pk)
+		# The category path is part of the product feed
+		Product.objects.filter(category=instance).update(modified=timezone.now())
+
+
+def category_saved(sender, instance, created, raw=False, **kwargs):
+	if not created and not raw:
+		search.reindex_category(instance.pk)
+		Product.objects.filter(category__category=instance).update(modified=timezone.now())
+
+
+def image_content_saved(sender, instance, raw=False, **kwargs):
+	if not raw:
+		images.schedule(instance.image.name)
+
+
+def catalog_changed(sender, action=None, **kwargs):
+	if action is None or action.startswith('post_'):
+		CatalogVersion.bump()
+
+
+def product_page_changed(sender, instance, raw=False, **kwargs):
+	if not raw:
+		product_pages.bump(instance.pk)
+
+
+def image_content_changed(sender, instance, raw=False, **kwargs):
+	# Before a delete, the links to the products are gone after it
+	if not raw:
+		product_pages.bump(*instance.product_set.values_list('pk', flat=True))
+
+
+def product_images_changed(sender, instance, action, reverse, pk_set, **kwargs):
+	if not reverse:
+		if action.startswith('post_'):
+			product_pages.bump(instance.pk)
+	elif action == 'pre_clear':
+		product_pages.bump(*instance.product_set.values_list('pk', flat=True))
+	elif action in ('post_add', 'post_remove'):
+		product_pages.bump(*pk_set)
+
+
+def favorite_products_changed(sender, instance, action, reverse, pk_set, **kwargs):
+	if not reverse:
+		if action.startswith('post_'):
+			favorites.forget(instance.user_id)
+		return
+	# From the product side: the favorites are gone after a clear, collect them before
+	if action == 'pre_clear':
+		user_ids = Favorite.objects.filter(fav_products=instance).values_list('user_id', flat=True)
+	elif action in ('post_add', 'post_remove'):
+		user_ids = Favorite.objects.filter(pk__in=pk_set).values_list('user_id', flat=True)
+	else:
+		return
+	for user_id in user_ids:
+		favorites.forget(user_id)
+
+
+def favorite_deleted(sender, instance, **kwargs):
+	favorites.forget(instance.user_id)
+
+
+def coupon_saved(sender, instance, raw=False, **kwargs):
+	coupons.forget(instance.pk)
+	if not raw:
+		coupons.allocate(instance)
+
+
+def coupon_deleted(sender, instance, **kwargs):
+	coupons.forget(instance.pk)
+
+
+pre_save.connect(product_pre_save, sender=Product)
+post_save.connect(product_saved, sender=Product)
+post_delete.connect(product_deleted, sender=Product)
+post_save.connect(subcategory_saved, sender=ForProductCategory)
+post_save.connect(category_saved, sender=ProductCategory)
+post_save.connect(image_content_saved, sender=ImageProductContent)
+for model in (Product, ProductCategory, ForProductCategory, ImageProductContent):
+	post_save.connect(catalog_changed, sender=model)
+	post_delete.connect(catalog_changed, sender=model)
+m2m_changed.connect(catalog_changed, sender=Product.image_content.through)
+post_save.connect(product_page_changed, sender=Product)
+post_delete.connect(product_page_changed, sender=Product)
+post_save.connect(image_content_changed, sender=ImageProductContent)
+pre_delete.connect(image_content_changed, sender=ImageProductContent)
+m2m_changed.connect(product_images_changed, sender=Product.image_content.through)
+m2m_changed.connect(favorite_products_changed, sender=Favorite.fav_products.through)
+post_delete.connect(favorite_deleted, sender=Favorite)
+post_save.connect(coupon_saved, sender=Coupon)
+post_delete.connect(coupon_deleted, sender=Coupon)
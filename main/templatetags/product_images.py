@@ -0,0 +1,25 @@
+from django import template
+
+from main import images
+
+
+register = template.Library()
+
+
+@register.simple_tag
+def image_srcset(image, extension='webp'):
+	return images.srcset(image.name, extension) if image else ''
+
+
+@register.inclusion_tag('picture.html')
+def picture(image, sizes='100vw', css_class='', width=None, height=None, alt=''):
+	return {
+		'image': image,
+		'webp_srcset': images.srcset(image.name, 'webp') if image else '',
+		'jpg_srcset': images.srcset(image.name, 'jpg') if image else '',
+		'sizes': sizes,
+		'css_class': css_class,
+		'width': width,
+		'height': height,
+		'alt': alt,
+	}
@@ -0,0 +1,119 @@
+from unittest import mock
+
+from django.contrib import admin
+from django.contrib.auth.models import User
+from django.db import connection
+from django.db.models import F
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from main import cart
+from main.models import Order, Product, Refund
+from main.pagination import EstimatedCountPaginator
+from main.tests.test_cart import create_product
+
+
+class AdminTests(TestCase):
+
+	@classmethod
+	def setUpTestData(cls):
+		cls.admin = User.objects.create_superuser('admin', password='password')
+		cls.product = create_product()
+
+	def setUp(self):
+		self.client.force_login(self.admin)
+
+	def add_orders(self, count, start=0):
+		users = [User.objects.create_user(f'shopper{i}') for i in range(start, start + count)]
+		for user in users:
+			cart.add_product(user, self.product.pk)
+		Order.objects.filter(user__in=users).update(ordered=True, ordered_date=timezone.now())
+		for i, order in enumerate(Order.objects.filter(user__in=users)):
+			Order.objects.filter(pk=order.pk).update(ref_code=f'ref{start + i}')
+
+	def queries(self, url):
+		self.client.get(url)
+		with CaptureQueriesContext(connection) as context:
+			response = self.client.get(url)
+		self.assertEqual(response.status_code, 200)
+		return len(context)
+
+	def test_changelists_render(self):
+		self.add_orders(2)
+		for model in admin.site._registry:
+			if model._meta.app_label != 'main':
+				continue
+			url = reverse(f'admin:main_{model._meta.model_name}_changelist')
+			with self.subTest(url=url):
+				self.assertEqual(self.client.get(url).status_code, 200)
+
+	def test_queries_do_not_grow_with_rows(self):
+		self.add_orders(2)
+		counts = {url: self.queries(url) for url in ('/admin/main/order/', '/admin/main/orderproduct/')}
+		self.add_orders(20, start=2)
+		for url, count in counts.items():
+			with self.subTest(url=url):
+				self.assertEqual(self.queries(url), count)
+
+	def test_big_table_is_not_counted(self):
+		self.add_orders(3)
+		with mock.patch.object(EstimatedCountPaginator, 'estimate_above', 1):
+			paginator = EstimatedCountPaginator(Order.objects.order_by('-pk'), 50)
+			with self.assertNumQueries(1) as context:
+				count = paginator.count
+			self.assertEqual(count, Order.objects.latest('pk').pk)
+			self.assertNotIn('COUNT', context.captured_queries[0]['sql'])
+			# Filtered lists are counted exactly
+			self.assertEqual(EstimatedCountPaginator(Order.objects.filter(ordered=False), 50).count, 0)
+		self.assertEqual(EstimatedCountPaginator(Order.objects.all(), 50).count, 3)
+
+	def test_fulfillment_actions(self):
+		self.add_orders(3)
+		cart.add_product(self.admin, self.product.pk)
+		pks = list(Order.objects.values_list('pk', flat=True))
+		self.client.post('/admin/main/order/', {'action': 'mark_being_delivered', '_selected_action': pks})
+		self.assertEqual(Order.objects.filter(being_delivered=True).count(), 3)
+		self.client.post('/admin/main/order/', {'action': 'mark_received', '_selected_action': pks})
+		self.assertEqual(Order.objects.filter(recieved=True, being_delivered=False).count(), 3)
+		self.assertFalse(Order.objects.get(user=self.admin).recieved)
+
+	def test_stock_is_changed_by_restock(self):
+		url = reverse('admin:main_product_change', args=[self.product.pk])
+		self.assertContains(self.client.get(url), 'name="restock"')
+		self.assertContains(self.client.get(reverse('admin:main_product_add')), 'name="product_qt"')
+		product = self.product
+		data = {
+			'title': product.title, 'price': product.price, 'discount_price': product.discount_price,
+			'category': product.category_id, 'product_type_label': product.product_type_label,
+			'slug': product.slug, 'description': product.description,
+		}
+		shown = Product.objects.get(pk=product.pk).product_qt
+		# Sold after the form was opened
+		Product.objects.filter(pk=product.pk).update(product_qt=F('product_qt') - 10)
+		response = self.client.post(url, {**data, 'product_qt': 1000, 'restock': 5})
+		self.assertRedirects(response, reverse('admin:main_product_changelist'), fetch_redirect_response=False)
+		self.assertEqual(Product.objects.get(pk=product.pk).product_qt, shown - 5)
+		self.client.post(url, {**data, 'restock': -shown})
+		self.assertEqual(Product.objects.get(pk=product.pk).product_qt, shown - 5)
+
+	def test_refund_actions(self):
+		self.add_orders(2)
+		order = Order.objects.get(ref_code='ref0')
+		Refund.objects.create(order=order, reason_for='Брак', email='a@example.com')
+		self.client.post('/admin/main/order/', {'action': 'grant_refunds', '_selected_action': [order.pk]})
+		order.refresh_from_db()
+		self.assertTrue(order.refund_granted)
+		self.assertTrue(Refund.objects.get().accepted)
+		self.assertFalse(Order.objects.get(ref_code='ref1').refund_granted)
+
+	def test_refund_actions_do_not_need_a_ref_code(self):
+		# Placed before orders had to carry a ref code
+		self.add_orders(2)
+		Order.objects.filter(ordered=True).update(ref_code=None, refund_requested=True)
+		granted, denied = Order.objects.filter(ordered=True).order_by('pk')
+		self.client.post('/admin/main/order/', {'action': 'grant_refunds', '_selected_action': [granted.pk]})
+		self.client.post('/admin/main/order/', {'action': 'deny_refunds', '_selected_action': [denied.pk]})
+		self.assertTrue(Order.objects.get(pk=granted.pk).refund_granted)
+		self.assertFalse(Order.objects.get(pk=denied.pk).refund_requested)
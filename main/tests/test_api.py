@@ -0,0 +1,81 @@
+from django.contrib.auth.models import User
+from django.test import TestCase
+
+from main.models import CatalogVersion, ImageProductContent, Product
+from main.tests.test_cart import create_product
+
+
+class CatalogApiTests(TestCase):
+
+	@classmethod
+	def setUpTestData(cls):
+		cls.products = [create_product(title=f'Штаны {i}', slug=f'shtany-{i}') for i in range(5)]
+		cls.product = cls.products[0]
+		cls.subcategory = cls.product.category
+
+	def test_products_keyset_pages(self):
+		response = self.client.get('/api/products/', {'limit': 2})
+		self.assertEqual(response.status_code, 200)
+		self.assertEqual(response['Content-Type'], 'application/json')
+		data = response.json()
+		self.assertEqual([row['id'] for row in data['results']], [p.pk for p in self.products[:-3:-1]])
+		self.assertIsNone(data['previous'])
+		seen = [row['id'] for row in data['results']]
+		while data['next']:
+			data = self.client.get(data['next']).json()
+			seen += [row['id'] for row in data['results']]
+		self.assertEqual(seen, [p.pk for p in reversed(self.products)])
+		previous = self.client.get(data['previous']).json()
+		self.assertEqual([row['id'] for row in previous['results']], [p.pk for p in self.products[2:0:-1]])
+
+	def test_products_filter_and_bad_params(self):
+		data = self.client.get('/api/products/', {'subcategory': self.subcategory.pk + 1}).json()
+		self.assertEqual(data['results'], [])
+		self.assertEqual(self.client.get('/api/products/', {'subcategory': 'x'}).status_code, 400)
+		self.assertEqual(self.client.get('/api/products/', {'limit': 0}).status_code, 400)
+
+	def test_product_detail(self):
+		content = ImageProductContent.objects.create(user=User.objects.create_user('admin'), image='product_images/a.jpg')
+		self.product.image_content.add(content)
+		data = self.client.get(f'/api/products/{self.product.pk}/').json()
+		self.assertEqual(data['title'], 'Штаны 0')
+		self.assertEqual(data['subcategory']['id'], self.subcategory.pk)
+		self.assertEqual(data['category']['slug'], 'clothes')
+		self.assertEqual(len(data['images']), 1)
+		self.assertIn('product_images/a.jpg', data['images'][0])
+		self.assertEqual(self.client.get('/api/products/0/').status_code, 404)
+
+	def test_categories(self):
+		data = self.client.get('/api/categories/').json()
+		self.assertEqual(len(data['results']), 1)
+		subcategories = data['results'][0]['subcategories']
+		self.assertEqual(subcategories[0]['product_count'], 5)
+		detail = self.client.get(f'/api/subcategories/{self.subcategory.pk}/').json()
+		self.assertEqual(detail['category']['name'], 'Одежда')
+		self.assertEqual(len(self.client.get(detail['products']).json()['results']), 5)
+
+	def test_conditional_get_costs_one_query(self):
+		response = self.client.get('/api/categories/')
+		self.assertIn('public', response['Cache-Control'])
+		etag, last_modified = response['ETag'], response['Last-Modified']
+		with self.assertNumQueries(1):
+			response = self.client.get('/api/categories/', HTTP_IF_NONE_MATCH=etag)
+		self.assertEqual(response.status_code, 304)
+		with self.assertNumQueries(1):
+			response = self.client.get(f'/api/products/{self.product.pk}/', HTTP_IF_MODIFIED_SINCE=last_modified)
+		self.assertEqual(response.status_code, 304)
+
+	def test_catalog_changes_bump_the_version(self):
+		etag = self.client.get('/api/products/')['ETag']
+		version = CatalogVersion.current()[0]
+		self.product.price = 999
+		self.product.save()
+		self.assertEqual(CatalogVersion.current()[0], version + 1)
+		response = self.client.get('/api/products/', HTTP_IF_NONE_MATCH=etag)
+		self.assertEqual(response.status_code, 200)
+		self.assertNotEqual(response['ETag'], etag)
+		self.product.image_content.add(ImageProductContent.objects.create(user=User.objects.create_user('admin'), image='b.jpg'))
+		self.assertGreater(CatalogVersion.current()[0], version + 1)
+		before = CatalogVersion.current()[0]
+		Product.objects.get(pk=self.products[1].pk).delete()
+		self.assertEqual(CatalogVersion.current()[0], before + 1)
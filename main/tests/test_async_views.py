@@ -0,0 +1,49 @@
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.test import TestCase
+
+from main.models import Favorite, OrderProduct
+from main.tests.test_cart import create_product
+
+
+class AsyncViewTests(TestCase):
+	"""
+	The async views through AsyncClient, where any database access left on
+	the event loop raises SynchronousOnlyOperation.
+	"""
+
+	@classmethod
+	def setUpTestData(cls):
+		cls.user = User.objects.create_user('buyer', password='password')
+		cls.product = create_product()
+
+	def setUp(self):
+		cache.clear()
+		self.async_client.force_login(self.user)
+
+	async def test_catalog_pages(self):
+		for url in ['/', '/category-list/', f'/product-detail-{self.product.pk}/', '/favorites/']:
+			with self.subTest(url=url):
+				response = await self.async_client.get(url)
+				self.assertEqual(response.status_code, 200)
+		response = await self.async_client.get(f'/product-detail-{self.product.pk + 1}/')
+		self.assertEqual(response.status_code, 404)
+
+	async def test_cart_and_favorites(self):
+		headers = {'referer': '/'}
+		response = await self.async_client.get(f'/add-to-cart/{self.product.pk}/', headers=headers)
+		self.assertRedirects(response, '/', fetch_redirect_response=False)
+		self.assertEqual((await OrderProduct.objects.aget(user=self.user)).quantity, 1)
+		response = await self.async_client.get(f'/product-detail-{self.product.pk}/')
+		self.assertTrue(response.context['at_cart'])
+
+		await self.async_client.get(f'/favorites/add/{self.product.pk}/', headers=headers)
+		favorites = await Favorite.objects.aget(user=self.user)
+		self.assertTrue(await favorites.fav_products.filter(pk=self.product.pk).aexists())
+		await self.async_client.get(f'/favorites/add/{self.product.pk}/', headers=headers)
+		self.assertFalse(await favorites.fav_products.filter(pk=self.product.pk).aexists())
+
+	async def test_login_required(self):
+		self.async_client.cookies.clear()
+		response = await self.async_client.get('/favorites/')
+		self.assertRedirects(response, '/login/?next=/favorites/', fetch_redirect_response=False)
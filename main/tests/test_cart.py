@@ -0,0 +1,324 @@
+import threading
+from decimal import Decimal
+from io import StringIO
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, override_settings
+
+from main import cart
+from main.checks import check_shared_cache
+from main.models import Order, OrderProduct, Product, ProductCategory, ForProductCategory
+
+
+def create_product(**kwargs):
+	category, _ = ProductCategory.objects.get_or_create(slug='clothes', defaults={'name': 'Одежда'})
+	subcategory, _ = ForProductCategory.objects.get_or_create(slug='man-clothes', defaults={'name': 'Мужская одежда', 'category': category})
+	fields = {
+		'title': 'Мужские штаны',
+		'price': 1200,
+		'discount_price': 1400,
+		'category': subcategory,
+		'product_type_label': 'P',
+		'slug': 'myjskie-shtany',
+		'description': 'Штаны',
+		'product_qt': 100,
+	}
+	fields.update(kwargs)
+	return Product.objects.create(**fields)
+
+
+class CartServiceTests(TestCase):
+
+	@classmethod
+	def setUpTestData(cls):
+		cls.user = User.objects.create_user('buyer', password='password')
+		cls.product = create_product()
+
+	def test_add_creates_order_and_line(self):
+		state = cart.add_product(self.user, self.product.pk)
+		self.assertEqual(state.quantity, 1)
+		order = Order.objects.get(user=self.user, ordered=False)
+		self.assertEqual(state.order_id, order.pk)
+		self.assertEqual(list(order.products.values_list('product_id', 'quantity')), [(self.product.pk, 1)])
+
+	def test_add_increments_existing_line(self):
+		cart.add_product(self.user, self.product.pk)
+		state = cart.add_product(self.user, self.product.pk)
+		self.assertEqual(state.quantity, 2)
+		self.assertEqual(OrderProduct.objects.get().quantity, 2)
+
+	def test_add_missing_product(self):
+		with self.assertRaises(Product.DoesNotExist):
+			cart.add_product(self.user, self.product.pk + 1)
+		self.assertFalse(OrderProduct.objects.exists())
+
+	def test_add_to_existing_cart_query_count(self):
+		cart.add_product(self.user, self.product.pk)
+		# open order lookup, upsert, link, totals update (+ savepoint pair)
+		with self.assertNumQueries(6):
+			cart.add_product(self.user, self.product.pk)
+
+	def test_decrement_removes_last_unit(self):
+		cart.add_product(self.user, self.product.pk)
+		cart.add_product(self.user, self.product.pk)
+		self.assertEqual(cart.decrement_product(self.user, self.product.pk).quantity, 1)
+		self.assertEqual(cart.decrement_product(self.user, self.product.pk).quantity, 0)
+		self.assertFalse(OrderProduct.objects.exists())
+		self.assertFalse(Order.products.through.objects.exists())
+		self.assertIsNone(cart.decrement_product(self.user, self.product.pk))
+
+	def test_remove(self):
+		cart.add_product(self.user, self.product.pk)
+		cart.add_product(self.user, self.product.pk)
+		self.assertEqual(cart.remove_product(self.user, self.product.pk).quantity, 0)
+		self.assertFalse(cart.in_cart(self.user, self.product.pk))
+		self.assertIsNone(cart.remove_product(self.user, self.product.pk))
+
+	def test_stored_totals_follow_mutations(self):
+		other = create_product(title='Куртка', slug='kurtka', price=Decimal('999.99'), discount_price=1000, category=self.product.category)
+		cart.add_product(self.user, self.product.pk)
+		cart.add_product(self.user, self.product.pk)
+		state = cart.add_product(self.user, other.pk)
+		self.assertEqual((state.item_count, state.total), (3, Decimal('3399.99')))
+		state = cart.decrement_product(self.user, self.product.pk)
+		self.assertEqual((state.item_count, state.total), (2, Decimal('2199.99')))
+		state = cart.remove_product(self.user, other.pk)
+		self.assertEqual((state.item_count, state.total), (1, Decimal('1200.00')))
+
+		order = Order.objects.get()
+		totals = cart.calculate_totals(order.pk)
+		self.assertEqual((order.total, order.item_count), (totals['total'], totals['item_count']))
+		self.assertEqual((totals['discount_total'], totals['saved']), (Decimal('1400.00'), Decimal('200.00')))
+
+	def test_price_change_reprices_open_orders(self):
+		cart.add_product(self.user, self.product.pk)
+		cart.add_product(self.user, self.product.pk)
+		self.product.price = Decimal('1000.50')
+		self.product.save()
+		self.assertEqual(Order.objects.get().total, Decimal('2001.00'))
+
+	def test_reconcile_order_totals(self):
+		cart.add_product(self.user, self.product.pk)
+		Order.objects.update(total=5, item_count=7)
+		out = StringIO()
+		call_command('reconcile_order_totals', '--dry-run', stdout=out)
+		self.assertIn('found 1', out.getvalue())
+		self.assertEqual(Order.objects.get().total, 5)
+		call_command('reconcile_order_totals', stdout=out)
+		order = Order.objects.get()
+		self.assertEqual((order.total, order.item_count), (Decimal('1200.00'), 1))
+		out = StringIO()
+		call_command('reconcile_order_totals', stdout=out)
+		self.assertIn('fixed 0', out.getvalue())
+
+	def test_views(self):
+		self.client.force_login(self.user)
+		referer = {'HTTP_REFERER': '/'}
+		self.assertRedirects(self.client.get(f'/add-to-cart/{self.product.pk}/', **referer), '/')
+		self.client.get(f'/add-to-cart/{self.product.pk}/', **referer)
+		self.assertEqual(OrderProduct.objects.get().quantity, 2)
+		self.assertEqual(self.client.get(f'/add-to-cart/{self.product.pk + 1}/', **referer).status_code, 404)
+		response = self.client.get('/cart/order-sum/')
+		self.assertContains(response, '2400.00 RUB')
+		self.assertContains(response, 'вы экономите 400.00 RUB')
+		self.assertContains(self.client.get('/cart/checkout/'), 'экономия 400.00 RUB')
+		self.assertContains(self.client.get('/cart/payment-procedure/UMoney/'), '2400.00 RUB')
+		self.assertContains(self.client.get('/cart/checkout/'), '2400.00 RUB')
+		self.client.get(f'/remove-single/{self.product.pk}/')
+		self.assertEqual(OrderProduct.objects.get().quantity, 1)
+		self.client.get(f'/remove-from-cart/{self.product.pk}/', **referer)
+		self.assertFalse(OrderProduct.objects.exists())
+
+
+@override_settings(CART_BACKEND='main.cart.CacheCartBackend')
+class CacheCartBackendTests(TestCase):
+
+	@classmethod
+	def setUpTestData(cls):
+		cls.user = User.objects.create_user('buyer', password='password')
+		cls.product = create_product()
+		cls.other = create_product(title='Куртка', slug='kurtka', price=500, category=cls.product.category)
+
+	def setUp(self):
+		cache.clear()
+		self.backend = cart.get_cart_backend()
+
+	def test_clicks_do_not_write(self):
+		self.backend.add(self.user, self.product.pk)
+		# Only the price lookup hits the database
+		with self.assertNumQueries(1):
+			state = self.backend.add(self.user, self.product.pk)
+		self.assertEqual((state.quantity, state.item_count, state.total), (2, 2, Decimal('2400.00')))
+		self.assertFalse(Order.objects.exists())
+		with self.assertRaises(Product.DoesNotExist):
+			self.backend.add(self.user, self.other.pk + 1)
+
+	def test_decrement_and_remove(self):
+		self.backend.add(self.user, self.product.pk)
+		self.backend.add(self.user, self.other.pk)
+		self.assertEqual(self.backend.decrement(self.user, self.product.pk).quantity, 0)
+		self.assertFalse(self.backend.contains(self.user, self.product.pk))
+		self.assertIsNone(self.backend.decrement(self.user, self.product.pk))
+		self.assertEqual(self.backend.remove(self.user, self.other.pk).item_count, 0)
+		self.assertIsNone(self.backend.summary(self.user))
+
+	def test_materialize(self):
+		# A stale database line that is no longer in the cached cart
+		cart.add_product(self.user, self.other.pk)
+		self.backend.add(self.user, self.product.pk)
+		self.backend.add(self.user, self.product.pk)
+		order = self.backend.materialize(self.user)
+		self.assertEqual(list(order.products.values_list('product_id', 'quantity')), [(self.product.pk, 2)])
+		self.assertEqual((order.total, order.item_count), (Decimal('2400.00'), 2))
+		self.assertEqual(self.backend.materialize(self.user).pk, order.pk)
+		self.assertEqual(OrderProduct.objects.count(), 1)
+
+	def test_busy_cart_is_not_changed(self):
+		lock_key = f'cart:{self.user.pk}:lock'
+		cache.set(lock_key, 'other request')
+		with mock.patch.object(cart.CacheCartBackend, 'lock_timeout', 0.01):
+			with self.assertRaises(cart.CartBusy):
+				self.backend.add(self.user, self.product.pk)
+		self.assertEqual(self.backend.item_count(self.user), 0)
+		self.assertEqual(cache.get(lock_key), 'other request')
+		self.client.force_login(self.user)
+		with mock.patch.object(cart.CacheCartBackend, 'lock_timeout', 0.01):
+			response = self.client.get(f'/add-to-cart/{self.product.pk}/', HTTP_REFERER='/', follow=True)
+		self.assertContains(response, 'Корзина обновляется')
+		# The stock reserved for the click was given back
+		self.assertEqual(Product.objects.get(pk=self.product.pk).reserved_qt, 0)
+
+	def test_lock_taken_over_is_left_to_its_new_holder(self):
+		lock_key = f'cart:{self.user.pk}:lock'
+		with self.backend._locked(self.user):
+			# Our lock expired and another request took it
+			cache.set(lock_key, 'other request')
+		self.assertEqual(cache.get(lock_key), 'other request')
+		cache.delete(lock_key)
+		with self.backend._locked(self.user):
+			pass
+		self.assertIsNone(cache.get(lock_key))
+
+	def test_summary_page(self):
+		self.client.force_login(self.user)
+		self.client.get(f'/add-to-cart/{self.product.pk}/', HTTP_REFERER='/')
+		response = self.client.get('/cart/order-sum/')
+		self.assertContains(response, '1200.00 RUB')
+		self.assertContains(response, 'вы экономите 200.00 RUB')
+		self.assertContains(self.client.get(f'/product-detail-{self.product.pk}/'), 'Убрать из корзины')
+
+
+class NavbarTests(TestCase):
+
+	@classmethod
+	def setUpTestData(cls):
+		cls.user = User.objects.create_user('buyer', password='password')
+		cls.product = create_product()
+
+	def setUp(self):
+		cache.clear()
+		self.backend = cart.get_cart_backend()
+
+	def add(self):
+		with self.captureOnCommitCallbacks(execute=True):
+			self.backend.add(self.user, self.product.pk)
+
+	def test_state_is_cached(self):
+		with self.assertNumQueries(2):
+			self.assertEqual(cart.navbar_state(self.user), {'has_orders': False, 'item_count': 0})
+		with self.assertNumQueries(0):
+			cart.navbar_state(self.user)
+
+	def test_cart_writes_invalidate(self):
+		cart.navbar_state(self.user)
+		self.add()
+		self.add()
+		self.assertEqual(cart.navbar_state(self.user), {'has_orders': True, 'item_count': 2})
+		with self.captureOnCommitCallbacks(execute=True):
+			self.backend.decrement(self.user, self.product.pk)
+		self.assertEqual(cart.navbar_state(self.user)['item_count'], 1)
+		with self.captureOnCommitCallbacks(execute=True):
+			cart.complete_order(Order.objects.get(user=self.user))
+		self.assertEqual(cart.navbar_state(self.user), {'has_orders': True, 'item_count': 0})
+
+	def test_page_adds_no_navbar_queries(self):
+		self.client.force_login(self.user)
+		self.add()
+		url = f'/product-detail-{self.product.pk}/'
+		self.assertContains(self.client.get(url), '<span class="badge bg-success">1</span>')
+		with self.assertNumQueries(3):
+			# session, user, cart line; the product body is cached
+			response = self.client.get(url)
+		self.assertContains(response, 'Итог заказа')
+
+	def test_deploy_check_requires_a_shared_cache(self):
+		self.assertEqual([error.id for error in check_shared_cache(None)], ['main.E001'])
+		redis = {'default': {'BACKEND': 'django.core.cache.backends.redis.RedisCache', 'LOCATION': 'redis://cache'}}
+		with override_settings(CACHES=redis):
+			self.assertEqual(check_shared_cache(None), [])
+
+
+class CartConcurrencyTests(TransactionTestCase):
+	threads = 8
+	clicks = 25
+
+	def test_concurrent_adds_lose_no_updates(self):
+		# No open order yet, the first clicks race to open it
+		user = User.objects.create_user('buyer', password='password')
+		product = create_product()
+		barrier = threading.Barrier(self.threads)
+		errors = []
+
+		def click():
+			try:
+				barrier.wait()
+				for _ in range(self.clicks):
+					cart.add_product(user, product.pk)
+			except Exception as exc:
+				errors.append(exc)
+			finally:
+				connection.close()
+
+		workers = [threading.Thread(target=click) for _ in range(self.threads)]
+		for worker in workers:
+			worker.start()
+		for worker in workers:
+			worker.join()
+
+		self.assertEqual(errors, [])
+		line = OrderProduct.objects.get(user=user, product=product)
+		self.assertEqual(line.quantity, self.threads * self.clicks)
+		order = Order.objects.get(user=user, ordered=False)
+		self.assertEqual(order.item_count, line.quantity)
+		self.assertEqual(order.total, line.quantity * product.price)
+		self.assertEqual(Order.objects.filter(user=user, ordered=False).count(), 1)
+
+	def test_concurrent_first_adds_open_one_order(self):
+		user = User.objects.create_user('buyer', password='password')
+		products = [create_product(slug=f'product-{i}') for i in range(self.threads)]
+		barrier = threading.Barrier(self.threads)
+		errors = []
+
+		def first_click(product):
+			try:
+				barrier.wait()
+				cart.add_product(user, product.pk)
+			except Exception as exc:
+				errors.append(exc)
+			finally:
+				connection.close()
+
+		workers = [threading.Thread(target=first_click, args=[product]) for product in products]
+		for worker in workers:
+			worker.start()
+		for worker in workers:
+			worker.join()
+
+		self.assertEqual(errors, [])
+		order = Order.objects.get(user=user, ordered=False)
+		self.assertEqual(order.products.count(), self.threads)
+		self.assertEqual(order.item_count, self.threads)
@@ -0,0 +1,166 @@
+import csv
+import json
+import os
+import shutil
+import tempfile
+from decimal import Decimal
+from io import StringIO
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+
+from main import cart, inventory
+from main.models import ForProductCategory, Order, Product, ProductCategory, ProductFacetCount
+from main.search import search_product_ids
+
+
+SAMPLE_IMAGE = os.path.join(settings.BASE_DIR, 'media', 'product_images', 'man-clothes.jpg')
+
+
+class CatalogImportTests(TestCase):
+
+	def setUp(self):
+		self.directory = tempfile.mkdtemp()
+		self.addCleanup(shutil.rmtree, self.directory)
+		overrides = override_settings(MEDIA_ROOT=os.path.join(self.directory, 'media'), IMAGE_DERIVATIVE_WIDTHS=(320,))
+		overrides.enable()
+		self.addCleanup(overrides.disable)
+		self.admin = User.objects.create_superuser('admin')
+		path = self.write_csv('subcategories.csv', [
+			{'slug': 'jackets', 'name': 'Куртки', 'category': 'clothes', 'category_name': 'Одежда'},
+			{'slug': 'shoes', 'name': 'Ботинки', 'category': 'clothes', 'category_name': ''},
+			{'slug': '', 'name': 'Без адреса', 'category': 'clothes', 'category_name': ''},
+		])
+		call_command('import_catalog', 'subcategories', path, stdout=StringIO(), stderr=StringIO())
+
+	def write_csv(self, name, rows):
+		path = os.path.join(self.directory, name)
+		with open(path, 'w', newline='', encoding='utf-8') as file:
+			writer = csv.DictWriter(file, fieldnames=list(rows[0]))
+			writer.writeheader()
+			writer.writerows(rows)
+		return path
+
+	def write_jsonl(self, name, records):
+		path = os.path.join(self.directory, name)
+		with open(path, 'w', encoding='utf-8') as file:
+			for record in records:
+				file.write(json.dumps(record, ensure_ascii=False) + '\n')
+		return path
+
+	def products(self, count, price=1000):
+		return [
+			{'slug': f'jacket-{i}', 'title': f'Зимняя куртка {i}', 'price': str(price + i), 'subcategory': 'jackets', 'product_qt': 5, 'description': 'Тёплая'}
+			for i in range(count)
+		]
+
+	def run_import(self, *args):
+		out, err = StringIO(), StringIO()
+		call_command('import_catalog', 'products', *args, '--batch-size', '4', stdout=out, stderr=err)
+		return out.getvalue(), err.getvalue()
+
+	def test_subcategories(self):
+		category = ProductCategory.objects.get(slug='clothes')
+		self.assertEqual(category.name, 'Одежда')
+		self.assertEqual(
+			sorted(ForProductCategory.objects.filter(category=category).values_list('slug', flat=True)),
+			['jackets', 'shoes'],
+		)
+
+	def test_upsert(self):
+		path = self.write_jsonl('products.jsonl', self.products(10) + [{'slug': 'bad', 'title': 'Нет цены', 'subcategory': 'jackets'}])
+		out, err = self.run_import(path)
+		self.assertIn('11 records, 10 upserted, 1 skipped', out)
+		self.assertIn('record 10: missing price', err)
+		self.assertEqual(Product.objects.count(), 10)
+		self.assertEqual(ProductFacetCount.objects.get().count, 10)
+		self.assertEqual(len(search_product_ids('зимняя', limit=20)), 10)
+
+		path = self.write_csv('products.csv', self.products(3, price=50))
+		self.run_import(path)
+		self.assertEqual(Product.objects.count(), 10)
+		self.assertEqual(Product.objects.get(slug='jacket-2').price, Decimal('52.00'))
+
+	def test_malformed_lines_are_skipped(self):
+		path = os.path.join(self.directory, 'products.jsonl')
+		records = self.products(4)
+		with open(path, 'w', encoding='utf-8') as file:
+			file.write(json.dumps(records[0]) + '\n')
+			file.write('{"slug": "broken", \n')
+			file.write('[1, 2]\n')
+			file.write(json.dumps(records[1]) + '\n')
+		out, err = self.run_import(path)
+		self.assertIn('4 records, 2 upserted, 2 skipped', out)
+		self.assertIn('record 1: bad JSON', err)
+		self.assertIn('record 2: bad JSON: expected an object', err)
+		self.assertEqual(sorted(Product.objects.values_list('slug', flat=True)), ['jacket-0', 'jacket-1'])
+
+	def test_non_finite_prices_are_skipped(self):
+		records = self.products(4)
+		records[0]['price'] = 'NaN'
+		records[1]['price'] = 'Infinity'
+		records[2]['discount_price'] = '-inf'
+		out, err = self.run_import(self.write_jsonl('products.jsonl', records))
+		self.assertIn('4 records, 1 upserted, 3 skipped', out)
+		self.assertIn("record 0: bad price 'NaN'", err)
+		self.assertIn("record 2: bad discount_price '-inf'", err)
+		self.assertEqual(list(Product.objects.values_list('slug', flat=True)), ['jacket-3'])
+
+	def test_out_of_range_stock_is_skipped(self):
+		records = self.products(4)
+		records[1]['product_qt'] = -1
+		records[2]['product_qt'] = 40000
+		out, err = self.run_import(self.write_jsonl('products.jsonl', records))
+		self.assertIn('4 records, 2 upserted, 2 skipped', out)
+		self.assertIn('record 1: bad product_qt -1', err)
+		self.assertIn('record 2: bad product_qt 40000', err)
+		self.assertEqual(sorted(Product.objects.values_list('slug', flat=True)), ['jacket-0', 'jacket-3'])
+
+	def test_stock_stays_above_reservations(self):
+		self.run_import(self.write_jsonl('products.jsonl', self.products(2)))
+		product = Product.objects.get(slug='jacket-0')
+		for _ in range(3):
+			inventory.reserve(self.admin, product.pk)
+		records = self.products(2)
+		records[0]['product_qt'] = 1
+		records[1]['product_qt'] = 9
+		self.run_import(self.write_jsonl('products.jsonl', records))
+		self.assertEqual(Product.objects.get(slug='jacket-0').product_qt, 3)
+		self.assertEqual(Product.objects.get(slug='jacket-1').product_qt, 9)
+
+	def test_reprices_open_carts(self):
+		self.run_import(self.write_jsonl('products.jsonl', self.products(1)))
+		cart.add_product(self.admin, Product.objects.get().pk)
+		self.run_import(self.write_jsonl('products.jsonl', self.products(1, price=10)))
+		self.assertEqual(Order.objects.get().total, Decimal('10.00'))
+
+	def test_images(self):
+		records = self.products(2)
+		records[0]['poster'] = SAMPLE_IMAGE
+		records[0]['images'] = [SAMPLE_IMAGE, os.path.join(self.directory, 'missing.jpg')]
+		path = self.write_jsonl('products.jsonl', records)
+		out, err = self.run_import(path, '--workers', '2')
+		self.assertIn('2 images (1 failed)', out)
+		product = Product.objects.get(slug='jacket-0')
+		self.assertTrue(product.poster.name.startswith('product_posters/'))
+		self.assertTrue(default_storage.exists(product.poster.name))
+		self.assertEqual(product.image_content.count(), 1)
+		# Importing again reuses the stored files and gallery entries
+		self.run_import(path)
+		self.assertEqual(product.image_content.count(), 1)
+
+	def test_checkpoint_resume(self):
+		path = self.write_jsonl('products.jsonl', self.products(10))
+		checkpoint = os.path.join(self.directory, 'checkpoint.json')
+		with open(checkpoint, 'w') as file:
+			json.dump({os.path.abspath(path): 8}, file)
+		out, _ = self.run_import(path, '--checkpoint', checkpoint)
+		self.assertIn('2 records', out)
+		self.assertEqual(sorted(Product.objects.values_list('slug', flat=True)), ['jacket-8', 'jacket-9'])
+		with open(checkpoint) as file:
+			self.assertEqual(json.load(file), {os.path.abspath(path): 10})
+		out, _ = self.run_import(path, '--checkpoint', checkpoint)
+		self.assertIn('0 records', out)
@@ -0,0 +1,86 @@
+from django.contrib.auth.models import User
+from django.test import TestCase
+
+from main import cart
+from main.models import Address, Order
+from main.tests.test_cart import create_product
+
+
+SHIPPING = {
+	'shipping_address': 'Ленина 1',
+	'shipping_address2': '5',
+	'shipping_country': 'RU',
+	'shipping_zip': '101000',
+}
+
+
+class CheckoutTests(TestCase):
+
+	@classmethod
+	def setUpTestData(cls):
+		cls.user = User.objects.create_user('buyer', password='password')
+		cls.product = create_product()
+
+	def setUp(self):
+		self.client.force_login(self.user)
+		cart.add_product(self.user, self.product.pk)
+
+	def post(self, **data):
+		return self.client.post('/cart/checkout/', {'payment_option': 'U', **data})
+
+	def order(self):
+		return Order.objects.select_related('shipping_address', 'billing_address').get(user=self.user, ordered=False)
+
+	def test_new_addresses(self):
+		response = self.post(**SHIPPING, same_billing_address='on', set_default_shipping='on')
+		self.assertRedirects(response, '/cart/payment-procedure/UMoney/', fetch_redirect_response=False)
+		order = self.order()
+		self.assertEqual(order.shipping_address.address_type, 'S')
+		self.assertEqual(order.shipping_address.county.code, 'RU')
+		self.assertTrue(order.shipping_address.default)
+		self.assertEqual(order.billing_address.address_type, 'B')
+		self.assertEqual(order.billing_address.street_address, 'Ленина 1')
+		self.assertFalse(order.billing_address.default)
+
+	def test_resubmission_writes_nothing(self):
+		form = {**SHIPPING, 'same_billing_address': 'on'}
+		self.post(**form)
+		addresses = list(Address.objects.values_list('pk', flat=True))
+		# session, user, open order, addresses: no writes
+		with self.assertNumQueries(4):
+			self.post(**form)
+		self.assertEqual(list(Address.objects.values_list('pk', flat=True)), addresses)
+
+	def test_default_addresses(self):
+		shipping = Address.objects.create(user=self.user, street_address='Ленина 1', apartment_address='', county='RU', zip='1', address_type='S', default=True)
+		billing = Address.objects.create(user=self.user, street_address='Мира 2', apartment_address='', county='RU', zip='2', address_type='B', default=True)
+		response = self.client.get('/cart/checkout/')
+		self.assertEqual(response.context['default_shipping_address'], shipping)
+		self.assertEqual(response.context['default_billing_address'], billing)
+		self.post(use_default_shipping='on', use_default_billing='on')
+		order = self.order()
+		self.assertEqual((order.shipping_address, order.billing_address), (shipping, billing))
+
+	def test_set_default_replaces_previous(self):
+		old = Address.objects.create(user=self.user, street_address='Мира 2', apartment_address='', county='RU', zip='2', address_type='S', default=True)
+		self.post(**SHIPPING, same_billing_address='on', set_default_shipping='on')
+		old.refresh_from_db()
+		self.assertFalse(old.default)
+		self.assertEqual(Address.objects.filter(user=self.user, address_type='S', default=True).count(), 1)
+
+	def test_failure_writes_nothing(self):
+		response = self.post(**SHIPPING, use_default_billing='on')
+		self.assertRedirects(response, '/cart/checkout/', fetch_redirect_response=False)
+		self.assertFalse(Address.objects.exists())
+		self.assertIsNone(self.order().shipping_address)
+
+	def test_missing_fields_and_bad_payment_option(self):
+		self.assertRedirects(self.post(shipping_address='Ленина 1'), '/cart/checkout/', fetch_redirect_response=False)
+		response = self.client.post('/cart/checkout/', {**SHIPPING, 'same_billing_address': 'on', 'payment_option': 'X'})
+		self.assertRedirects(response, '/cart/checkout/', fetch_redirect_response=False)
+		self.assertFalse(Address.objects.exists())
+
+	def test_without_cart(self):
+		Order.objects.filter(user=self.user).delete()
+		response = self.post(**SHIPPING, same_billing_address='on')
+		self.assertRedirects(response, '/cart/order-sum/', fetch_redirect_response=False)
@@ -0,0 +1,219 @@
+import threading
+from datetime import timedelta
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import IntegrityError, connection
+from django.template.loader import render_to_string
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+
+from main import cart, coupons
+from main.models import Coupon, CouponCounter, CouponUse, Order
+from main.tests.test_cart import create_product
+
+
+def create_coupon(code='SALE', amount='100.00', **fields):
+	return Coupon.objects.create(code=code, amount=Decimal(amount), **fields)
+
+
+class CouponTests(TestCase):
+
+	@classmethod
+	def setUpTestData(cls):
+		cls.user = User.objects.create_user('buyer', password='password')
+		cls.product = create_product()
+
+	def setUp(self):
+		cache.clear()
+		coupons.clear_cache()
+
+	def open_order(self, user=None):
+		user = user or self.user
+		cart.add_product(user, self.product.pk)
+		return Order.objects.get(user=user, ordered=False)
+
+	def user_and_order(self, username):
+		user = User.objects.create_user(username)
+		return user, self.open_order(user).pk
+
+	def assertRefused(self, order, code, message):
+		with self.assertRaisesMessage(coupons.CouponError, message):
+			coupons.apply(order.user, order.pk, code)
+
+	def test_apply(self):
+		create_coupon(amount='200.50')
+		order = self.open_order()
+		offer = coupons.apply(self.user, order.pk, ' SALE ')
+		self.assertEqual(offer.amount, Decimal('200.50'))
+		order.refresh_from_db()
+		self.assertEqual(order.get_total(), Decimal('999.50'))
+		self.assertEqual(coupons.redeemed(offer.pk), 1)
+
+	def test_total_is_never_negative(self):
+		create_coupon(amount='5000')
+		order = self.open_order()
+		coupons.apply(self.user, order.pk, 'SALE')
+		order.refresh_from_db()
+		self.assertEqual(order.get_total(), Decimal(0))
+
+	def test_codes_are_unique(self):
+		create_coupon()
+		with self.assertRaises(IntegrityError):
+			create_coupon()
+
+	def test_unknown_and_expired_codes(self):
+		now = timezone.now()
+		create_coupon('OLD', valid_until=now - timedelta(days=1))
+		create_coupon('SOON', valid_from=now + timedelta(days=1))
+		order = self.open_order()
+		self.assertRefused(order, 'NOPE', 'Такого промо-кода нет')
+		self.assertRefused(order, 'OLD', 'Срок действия промо-кода истек')
+		self.assertRefused(order, 'SOON', 'Промо-код еще не действует')
+		self.assertFalse(CouponUse.objects.exists())
+
+	def test_one_coupon_per_order(self):
+		create_coupon()
+		create_coupon('MORE')
+		order = self.open_order()
+		coupons.apply(self.user, order.pk, 'SALE')
+		self.assertRefused(order, 'MORE', 'К заказу уже применен промо-код')
+		self.assertEqual(Order.objects.get().coupon.code, 'SALE')
+		self.assertEqual(coupons.redeemed(Coupon.objects.get(code='MORE').pk), 0)
+
+	def test_per_user_limit(self):
+		coupon = create_coupon(max_uses_per_user=2)
+		for _ in range(2):
+			order = self.open_order()
+			coupons.apply(self.user, order.pk, 'SALE')
+			cart.complete_order(order)
+		order = self.open_order()
+		self.assertRefused(order, 'SALE', 'Вы уже использовали этот промо-код')
+		# The refusal rolled back the order and the counters
+		order.refresh_from_db()
+		self.assertIsNone(order.coupon)
+		self.assertEqual(CouponUse.objects.get(coupon=coupon, user=self.user).count, 2)
+		self.assertEqual(coupons.redeemed(coupon.pk), 2)
+
+	def test_total_limit(self):
+		coupon = create_coupon(max_uses=2)
+		for i in range(2):
+			coupons.apply(*self.user_and_order(f'shopper{i}'), 'SALE')
+		user, order_id = self.user_and_order('late')
+		with self.assertRaisesMessage(coupons.CouponError, 'Промо-код больше не действует'):
+			coupons.apply(user, order_id, 'SALE')
+		self.assertIsNone(Order.objects.get(pk=order_id).coupon)
+		self.assertFalse(CouponUse.objects.filter(user=user).exists())
+		self.assertEqual(coupons.redeemed(coupon.pk), 2)
+
+	def test_limit_is_split_across_shards(self):
+		coupon = create_coupon(max_uses=10)
+		capacities = list(CouponCounter.objects.filter(coupon=coupon).order_by('shard').values_list('capacity', flat=True))
+		self.assertEqual(len(capacities), coupons.COUPON_SHARDS)
+		self.assertEqual(sum(capacities), 10)
+		unlimited = create_coupon('FREE')
+		self.assertEqual(set(unlimited.counters.values_list('capacity', flat=True)), {None})
+
+	def test_lowering_the_limit_never_goes_over(self):
+		coupon = create_coupon(max_uses=100)
+		CouponCounter.objects.filter(coupon=coupon, shard=0).update(used=3)
+		CouponCounter.objects.filter(coupon=coupon, shard=1).update(used=2)
+		coupon.max_uses = 4
+		coupon.save()
+		capacities = dict(coupon.counters.values_list('shard', 'capacity'))
+		self.assertEqual((capacities[0], capacities[1], sum(capacities.values())), (3, 2, 5))
+		self.assertRefused(self.open_order(), 'SALE', 'Промо-код больше не действует')
+		coupon.max_uses = 7
+		coupon.save()
+		self.assertEqual(sum(coupon.counters.values_list('capacity', flat=True)), 7)
+
+	def test_lookup_is_cached_in_process(self):
+		coupon = create_coupon()
+		coupons.lookup('SALE')
+		with self.assertNumQueries(0):
+			self.assertEqual(coupons.lookup('SALE').amount, Decimal('100.00'))
+		coupon.code = 'SUMMER'
+		coupon.amount = Decimal('50')
+		coupon.save()
+		self.assertIsNone(coupons.lookup('SALE'))
+		self.assertEqual(coupons.lookup('SUMMER').amount, Decimal('50.00'))
+		coupon.delete()
+		self.assertIsNone(coupons.lookup('SUMMER'))
+
+	def test_view(self):
+		create_coupon()
+		self.open_order()
+		self.client.force_login(self.user)
+		self.assertContains(self.client.get('/cart/checkout/'), 'action="/cart/coupon/"')
+		self.assertEqual(self.client.get('/cart/coupon/').status_code, 405)
+		response = self.client.post('/cart/coupon/', {'code': 'SALE'})
+		self.assertRedirects(response, '/cart/checkout/', fetch_redirect_response=False)
+		response = self.client.get('/cart/checkout/')
+		self.assertContains(response, 'Промо-код SALE: -100.00 RUB')
+		self.assertContains(response, 'Всего: 1100.00 RUB')
+		self.assertNotContains(response, 'action="/cart/coupon/"')
+		response = self.client.post('/cart/coupon/', {'code': 'SALE'}, follow=True)
+		self.assertContains(response, 'К заказу уже применен промо-код')
+
+	def test_payment_form_url(self):
+		html = render_to_string('payment.html', {'order': self.open_order(), 'DISPLAY_COUPON_FORM': True})
+		self.assertIn('action="/cart/coupon/"', html)
+
+	@override_settings(CART_BACKEND='main.cart.CacheCartBackend')
+	def test_cached_cart(self):
+		create_coupon()
+		backend = cart.get_cart_backend()
+		backend.add(self.user, self.product.pk)
+		self.client.force_login(self.user)
+		self.client.post('/cart/coupon/', {'code': 'SALE'})
+		order, _ = backend.summary(self.user)
+		self.assertEqual((order.coupon.code, order.get_total()), ('SALE', Decimal('1100.00')))
+
+
+class CouponConcurrencyTests(TransactionTestCase):
+	threads = 8
+	shoppers = 40
+	max_uses = 15
+
+	def test_concurrent_redemptions_stay_within_the_limit(self):
+		coupons.clear_cache()
+		coupon = create_coupon(max_uses=self.max_uses)
+		product = create_product()
+		orders = []
+		for i in range(self.shoppers):
+			user = User.objects.create_user(f'shopper{i}')
+			cart.add_product(user, product.pk)
+			orders.append((user, Order.objects.get(user=user).pk))
+		barrier = threading.Barrier(self.threads)
+		applied, refused, errors = [], [], []
+
+		def redeem(index):
+			try:
+				barrier.wait()
+				for user, order_id in orders[index::self.threads]:
+					# Twice per order, the second one always loses
+					for _ in range(2):
+						try:
+							coupons.apply(user, order_id, 'SALE')
+							applied.append(order_id)
+						except coupons.CouponError:
+							refused.append(order_id)
+			except Exception as exc:
+				errors.append(exc)
+			finally:
+				connection.close()
+
+		workers = [threading.Thread(target=redeem, args=[i]) for i in range(self.threads)]
+		for worker in workers:
+			worker.start()
+		for worker in workers:
+			worker.join()
+
+		self.assertEqual(errors, [])
+		self.assertEqual(len(applied), self.max_uses)
+		self.assertEqual(len(applied) + len(refused), 2 * self.shoppers)
+		self.assertEqual(coupons.redeemed(coupon.pk), self.max_uses)
+		self.assertEqual(Order.objects.filter(coupon=coupon).count(), self.max_uses)
+		self.assertEqual(set(Order.objects.filter(coupon=coupon).values_list('pk', flat=True)), set(applied))
+		self.assertEqual(CouponUse.objects.filter(coupon=coupon).count(), self.max_uses)
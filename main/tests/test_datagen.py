@@ -0,0 +1,48 @@
+from io import StringIO
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.test import TestCase, TransactionTestCase
+
+from main import loadtest
+from main.datagen import DataGenerator
+from main.models import Favorite, Order, OrderProduct, Product, ProductCategory, ProductFacetCount
+
+
+class DataGeneratorTests(TestCase):
+
+	def test_generate(self):
+		counts = DataGenerator(batch_size=100, seed=1).generate(
+			users=30, categories=3, subcategories=2, products=250, carts=10, cart_lines=4, orders=50, order_lines=3, favorites=5,
+		)
+		self.assertEqual(Product.objects.count(), 250)
+		self.assertEqual(Order.objects.filter(ordered=False).count(), 10)
+		self.assertEqual(Order.objects.filter(ordered=True, payment__isnull=False, shipping_address__isnull=False).count(), 50)
+		self.assertEqual(OrderProduct.objects.filter(order_status=True).count(), 150)
+		self.assertEqual(Favorite.objects.count(), 30)
+		self.assertEqual(counts['Продукты'], 250)
+		self.assertTrue(ProductFacetCount.objects.exists())
+		out = StringIO()
+		call_command('reconcile_order_totals', '--dry-run', stdout=out)
+		self.assertIn('found 0 with drifted totals', out.getvalue())
+
+	def test_runs_again_after_deletes(self):
+		DataGenerator(batch_size=10, seed=1).generate(users=5, categories=2, subcategories=1, products=20, carts=2, orders=5)
+		# Fewer rows than the highest numbers handed out so far
+		Product.objects.order_by('pk').first().delete()
+		User.objects.order_by('pk').first().delete()
+		DataGenerator(batch_size=10, seed=1).generate(users=5, categories=2, subcategories=1, products=20, carts=2, orders=5)
+		self.assertEqual(Product.objects.count(), 39)
+		self.assertEqual(User.objects.count(), 9)
+		self.assertEqual(ProductCategory.objects.count(), 4)
+
+
+class LoadTestTests(TransactionTestCase):
+
+	def test_run(self):
+		DataGenerator(seed=1).generate(users=4, categories=2, products=100, carts=0, orders=10)
+		results = loadtest.run(2, 5, loadtest.shoppers('shopper', 2), host='testserver', seed=1)
+		overall = results[-1]
+		self.assertEqual(overall.label, 'all requests')
+		self.assertEqual(overall.operations, sum(result.operations for result in results[:-1]))
+		self.assertGreaterEqual(overall.operations, 10)
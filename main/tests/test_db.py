@@ -0,0 +1,38 @@
+from unittest import mock
+
+from django.db import connection
+from django.test import TestCase, override_settings
+
+from main.db import CatalogReadRouter
+from main.models import Order, Product, ProductCategory
+
+
+class SqliteConnectionTests(TestCase):
+
+	def test_pragmas_applied(self):
+		with connection.cursor() as cursor:
+			cursor.execute('PRAGMA journal_mode')
+			self.assertEqual(cursor.fetchone()[0], 'wal')
+			cursor.execute('PRAGMA synchronous')
+			self.assertEqual(cursor.fetchone()[0], 1)
+			cursor.execute('PRAGMA busy_timeout')
+			self.assertEqual(cursor.fetchone()[0], 5000)
+
+
+class CatalogReadRouterTests(TestCase):
+	router = CatalogReadRouter()
+
+	def test_without_read_database(self):
+		self.assertIsNone(self.router.db_for_read(Product))
+
+	@override_settings(CATALOG_READ_DATABASE='catalog')
+	def test_catalog_reads_are_routed(self):
+		# TestCase wraps every test in a transaction, where reads stay on default
+		with mock.patch.object(connection, 'in_atomic_block', False):
+			self.assertEqual(self.router.db_for_read(Product), 'catalog')
+			self.assertEqual(self.router.db_for_read(ProductCategory), 'catalog')
+			self.assertIsNone(self.router.db_for_read(Order))
+		self.assertIsNone(self.router.db_for_read(Product))
+		self.assertEqual(self.router.db_for_write(Product), 'default')
+		self.assertFalse(self.router.allow_migrate('catalog', 'main'))
+		self.assertIsNone(self.router.allow_migrate('default', 'main'))
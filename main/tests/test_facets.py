@@ -0,0 +1,111 @@
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.test import TestCase
+
+from main import facets
+from main.models import ForProductCategory, Product, ProductCategory, ProductFacetCount
+from main.tests.test_cart import create_product
+
+
+class PriceBucketTests(TestCase):
+
+	def test_buckets(self):
+		self.assertEqual(facets.price_bucket(999), 0)
+		self.assertEqual(facets.price_bucket(1000), 1)
+		self.assertEqual(facets.price_bucket(Decimal('250000')), len(facets.PRICE_BUCKET_BOUNDS))
+
+	def test_ranges(self):
+		self.assertEqual(facets.price_bucket_range(0), (None, Decimal(1000)))
+		self.assertEqual(facets.price_bucket_range(1), (Decimal(1000), Decimal(5000)))
+		self.assertEqual(facets.price_bucket_range(len(facets.PRICE_BUCKET_BOUNDS)), (Decimal(100000), None))
+		for bucket in (-1, len(facets.PRICE_BUCKET_BOUNDS) + 1, 99):
+			with self.subTest(bucket=bucket), self.assertRaises(ValueError):
+				facets.price_bucket_range(bucket)
+
+
+class FacetRollupTests(TestCase):
+
+	@classmethod
+	def setUpTestData(cls):
+		cls.product = create_product()
+		cls.subcategory = cls.product.category
+		cls.other = ForProductCategory.objects.create(slug='woman-clothes', name='Женская одежда', category=cls.subcategory.category)
+
+	def cells(self):
+		return {
+			(cell.category_id, cell.product_type_label, cell.price_bucket): cell.count
+			for cell in ProductFacetCount.objects.exclude(count=0)
+		}
+
+	def counts(self):
+		return (
+			ForProductCategory.objects.get(pk=self.subcategory.pk).product_count,
+			ForProductCategory.objects.get(pk=self.other.pk).product_count,
+			ProductCategory.objects.get(pk=self.subcategory.category_id).product_count,
+		)
+
+	def test_writes_move_products_between_cells(self):
+		create_product(slug='cheap', price=500, product_type_label='S')
+		self.assertEqual(self.cells(), {(self.subcategory.pk, 'P', 1): 1, (self.subcategory.pk, 'S', 0): 1})
+		self.assertEqual(self.counts(), (2, 0, 2))
+		self.product.price = 6000
+		self.product.save()
+		self.assertEqual(self.cells(), {(self.subcategory.pk, 'P', 2): 1, (self.subcategory.pk, 'S', 0): 1})
+		self.product.category = self.other
+		self.product.save()
+		self.assertEqual(self.counts(), (1, 1, 2))
+		self.product.delete()
+		self.assertEqual(self.cells(), {(self.subcategory.pk, 'S', 0): 1})
+		self.assertEqual(self.counts(), (1, 0, 1))
+
+	def test_rebuild_matches_incremental_counts(self):
+		create_product(slug='cheap', price=500)
+		Product.objects.filter(slug='cheap').update(price=150000)
+		incremental = self.cells()
+		self.assertEqual(facets.rebuild_facets(), 2)
+		self.assertNotEqual(self.cells(), incremental)
+		self.assertEqual(self.cells(), {(self.subcategory.pk, 'P', 1): 1, (self.subcategory.pk, 'P', 4): 1})
+		self.assertEqual(self.counts(), (2, 0, 2))
+
+	def test_each_facet_is_counted_under_the_other_filter(self):
+		create_product(slug='cheap', price=500, product_type_label='S')
+		create_product(slug='cheap-p', price=600)
+		cells = self.subcategory.facet_counts.all()
+		result = facets.Facets(cells, bucket=0)
+		self.assertEqual([(label['value'], label['count']) for label in result.labels], [('P', 1), ('S', 1)])
+		# Bucket counts ignore the bucket filter itself
+		self.assertEqual([(bucket['value'], bucket['count']) for bucket in result.price_buckets], [(0, 2), (1, 1)])
+		result = facets.Facets(cells, label='S')
+		self.assertEqual([(bucket['value'], bucket['count']) for bucket in result.price_buckets], [(0, 1)])
+		self.assertEqual([label['active'] for label in result.labels], [False, True])
+
+
+class SubCategoryViewTests(TestCase):
+
+	@classmethod
+	def setUpTestData(cls):
+		cls.user = User.objects.create_user('buyer', password='password')
+		cls.product = create_product()
+		create_product(slug='cheap', price=500)
+
+	def setUp(self):
+		self.client.force_login(self.user)
+		self.url = f'/subcategory-{self.product.category_id}/'
+
+	def test_price_filter(self):
+		response = self.client.get(self.url, {'price': 1})
+		self.assertEqual([product.pk for product in response.context['products']], [self.product.pk])
+		self.assertEqual(response.context['page_query'], '&price=1')
+
+	def test_invalid_price_is_ignored(self):
+		for price in ('99', '-1', 'x'):
+			with self.subTest(price=price):
+				response = self.client.get(self.url, {'price': price})
+				self.assertEqual(response.status_code, 200)
+				self.assertEqual(len(response.context['products']), 2)
+				self.assertEqual(response.context['page_query'], '')
+
+	def test_filters_are_encoded_in_page_links(self):
+		response = self.client.get(self.url, {'label': 'P&x=<1>', 'price': 0})
+		self.assertEqual(response.context['page_query'], '&label=P%26x%3D%3C1%3E&price=0')
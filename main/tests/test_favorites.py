@@ -0,0 +1,118 @@
+import threading
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import IntegrityError, connection
+from django.test import TestCase, TransactionTestCase
+
+from main import favorites
+from main.models import Favorite
+from main.tests.test_cart import create_product
+
+
+class FavoritesTests(TestCase):
+
+	@classmethod
+	def setUpTestData(cls):
+		cls.user = User.objects.create_user('buyer', password='password')
+		cls.products = [create_product(slug=f'product-{i}') for i in range(3)]
+
+	def setUp(self):
+		cache.clear()
+		self.client.force_login(self.user)
+
+	def test_toggle(self):
+		product = self.products[0]
+		self.assertTrue(favorites.toggle(self.user, product.pk))
+		self.assertEqual(favorites.favorite_ids(self.user), {product.pk})
+		self.assertFalse(favorites.toggle(self.user, product.pk))
+		self.assertEqual(favorites.favorite_ids(self.user), set())
+		self.assertEqual(Favorite.objects.filter(user=self.user).count(), 1)
+
+	def test_ids_are_cached(self):
+		favorites.toggle(self.user, self.products[0].pk)
+		favorites.favorite_ids(self.user)
+		with self.assertNumQueries(0):
+			self.assertEqual(favorites.favorite_ids(self.user), {self.products[0].pk})
+
+	def test_toggle_ignores_a_stale_cache(self):
+		product = self.products[0]
+		# Added by a process whose cache this one does not see
+		favorite = Favorite.objects.create(user=self.user)
+		Favorite.fav_products.through.objects.create(favorite=favorite, product=product)
+		cache.set(favorites._key(self.user.pk), frozenset())
+		self.assertFalse(favorites.toggle(self.user, product.pk))
+		cache.set(favorites._key(self.user.pk), frozenset([product.pk]))
+		self.assertTrue(favorites.toggle(self.user, product.pk))
+		self.assertEqual(favorites.favorite_ids(self.user), {product.pk})
+
+	def test_changes_elsewhere_drop_the_cache(self):
+		favorite = Favorite.objects.create(user=self.user)
+		self.assertEqual(favorites.favorite_ids(self.user), set())
+		favorite.fav_products.add(self.products[0], self.products[1])
+		self.assertEqual(favorites.favorite_ids(self.user), {self.products[0].pk, self.products[1].pk})
+		# From the product side
+		self.products[0].favorite_set.clear()
+		self.assertEqual(favorites.favorite_ids(self.user), {self.products[1].pk})
+		self.products[2].favorite_set.add(favorite)
+		self.assertEqual(favorites.favorite_ids(self.user), {self.products[1].pk, self.products[2].pk})
+		favorite.delete()
+		self.assertEqual(favorites.favorite_ids(self.user), set())
+
+	def test_one_favorite_per_user(self):
+		Favorite.objects.create(user=self.user)
+		with self.assertRaises(IntegrityError):
+			Favorite.objects.create(user=self.user)
+
+	def test_listing_is_annotated(self):
+		favorites.toggle(self.user, self.products[1].pk)
+		response = self.client.get('/')
+		flags = {product.pk: product.is_favorite for product in response.context['products']}
+		self.assertEqual(flags, {product.pk: product == self.products[1] for product in self.products})
+
+	def test_favorites_page_queries_do_not_grow(self):
+		self.client.get('/favorites/')
+		for product in self.products:
+			favorites.toggle(self.user, product.pk)
+		# session, user, products; the navbar is cached
+		with self.assertNumQueries(3):
+			response = self.client.get('/favorites/')
+		self.assertEqual(len(response.context['products']), 3)
+		self.assertTrue(all(product.is_favorite for product in response.context['products']))
+
+	def test_view(self):
+		product = self.products[0]
+		response = self.client.get(f'/favorites/add/{product.pk}/', HTTP_REFERER='/')
+		self.assertRedirects(response, '/', fetch_redirect_response=False)
+		self.assertEqual(favorites.favorite_ids(self.user), {product.pk})
+		self.assertEqual(self.client.get('/favorites/add/999999/', HTTP_REFERER='/').status_code, 404)
+
+
+class FavoritesConcurrencyTests(TransactionTestCase):
+	threads = 8
+
+	def test_concurrent_first_toggles_create_one_favorite(self):
+		cache.clear()
+		user = User.objects.create_user('buyer')
+		products = [create_product(slug=f'product-{i}') for i in range(self.threads)]
+		barrier = threading.Barrier(self.threads)
+		errors = []
+
+		def first_toggle(product):
+			try:
+				barrier.wait()
+				favorites.toggle(user, product.pk)
+			except Exception as exc:
+				errors.append(exc)
+			finally:
+				connection.close()
+
+		workers = [threading.Thread(target=first_toggle, args=[product]) for product in products]
+		for worker in workers:
+			worker.start()
+		for worker in workers:
+			worker.join()
+
+		self.assertEqual(errors, [])
+		favorite = Favorite.objects.get(user=user)
+		self.assertEqual(favorite.fav_products.count(), self.threads)
@@ -0,0 +1,96 @@
+import gzip
+import json
+import os
+import tempfile
+from datetime import timedelta
+from unittest import mock
+from xml.etree import ElementTree
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from main import cart, feeds, inventory
+from main.models import Product
+from main.tests.test_cart import create_product
+
+
+@override_settings(FEED_TOKENS=['secret'])
+class ProductFeedTests(TestCase):
+
+	@classmethod
+	def setUpTestData(cls):
+		cls.product = create_product()
+		cls.other = create_product(title='Куртка, "зимняя" & тёплая', slug='kurtka', price=500)
+		cls.user = User.objects.create_user('buyer')
+
+	def get(self, format, **params):
+		return self.client.get(f'/feed/products.{format}', params, HTTP_AUTHORIZATION='Bearer secret')
+
+	def body(self, response):
+		return b''.join(response.streaming_content).decode()
+
+	def test_requires_token_or_staff(self):
+		self.assertEqual(self.client.get('/feed/products.csv').status_code, 401)
+		self.assertEqual(self.client.get('/feed/products.csv', {'token': 'wrong'}).status_code, 401)
+		self.assertEqual(self.client.get('/feed/products.csv', {'token': 'secret'}).status_code, 200)
+		self.client.force_login(User.objects.create_user('staff', is_staff=True))
+		self.assertEqual(self.client.get('/feed/products.csv').status_code, 200)
+
+	def test_jsonl(self):
+		rows = [json.loads(line) for line in self.body(self.get('jsonl')).splitlines()]
+		self.assertEqual([row['slug'] for row in rows], ['myjskie-shtany', 'kurtka'])
+		self.assertEqual(rows[0]['price'], '1200.00')
+		self.assertEqual(rows[0]['stock'], 100)
+		self.assertEqual(rows[0]['category'], 'Одежда > Мужская одежда')
+		self.assertEqual(rows[0]['url'], f'http://testserver/product-detail-{self.product.pk}/')
+
+	def test_stock_leaves_out_held_units(self):
+		since = timezone.now()
+		Product.objects.filter(pk=self.product.pk).update(modified=since - timedelta(days=1))
+		inventory.reserve(self.user, self.product.pk, 3)
+		rows = [json.loads(line) for line in self.body(self.get('jsonl', since=since.isoformat())).splitlines()]
+		self.assertEqual([(row['slug'], row['stock']) for row in rows], [('myjskie-shtany', 97)])
+
+	def test_csv_and_xml(self):
+		lines = self.body(self.get('csv')).splitlines()
+		self.assertTrue(lines[0].startswith('id,slug,title,price'))
+		self.assertIn('"Куртка, ""зимняя"" & тёплая"', lines[2])
+		root = ElementTree.fromstring(self.body(self.get('xml')))
+		self.assertEqual([node.findtext('title') for node in root], ['Мужские штаны', 'Куртка, "зимняя" & тёплая'])
+
+	def test_gzip(self):
+		response = self.client.get('/feed/products.jsonl', {'token': 'secret'}, HTTP_ACCEPT_ENCODING='gzip, br')
+		self.assertEqual(response['Content-Encoding'], 'gzip')
+		self.assertEqual(len(gzip.decompress(b''.join(response.streaming_content)).splitlines()), 2)
+
+	def test_since(self):
+		response = self.get('jsonl', since=(timezone.now() + timedelta(minutes=1)).isoformat())
+		self.assertEqual(self.body(response), '')
+		self.assertEqual(self.get('jsonl', since='yesterday').status_code, 400)
+
+		since = timezone.now()
+		Product.objects.filter(pk=self.other.pk).update(modified=since - timedelta(days=1))
+		Product.objects.filter(pk=self.product.pk).update(modified=since - timedelta(days=1))
+		with self.captureOnCommitCallbacks(execute=True):
+			cart.add_product(self.user, self.product.pk)
+			inventory.reserve(self.user, self.product.pk)
+			cart.complete_order(self.user.orders.get())
+		rows = [json.loads(line) for line in self.body(self.get('jsonl', since=since.isoformat())).splitlines()]
+		self.assertEqual([(row['slug'], row['stock']) for row in rows], [('myjskie-shtany', 99)])
+
+	def test_query_count_is_per_chunk(self):
+		# Category paths, products, and one gallery query per chunk of products
+		with self.assertNumQueries(3):
+			self.body(self.get('jsonl'))
+		with mock.patch.object(feeds, 'CHUNK_SIZE', 1), self.assertNumQueries(4):
+			self.body(self.get('jsonl'))
+
+	def test_export_command(self):
+		with tempfile.TemporaryDirectory() as directory:
+			path = os.path.join(directory, 'products.xml.gz')
+			call_command('export_feed', 'xml', '--gzip', '--output', path, '--base-url', 'https://shop.example/', stderr=open(os.devnull, 'w'))
+			with gzip.open(path) as file:
+				root = ElementTree.parse(file).getroot()
+		self.assertEqual(root.find('product').findtext('url'), f'https://shop.example/product-detail-{self.product.pk}/')
@@ -0,0 +1,67 @@
+import shutil
+import tempfile
+from io import StringIO
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.template import Context, Template
+from django.test import TestCase, override_settings
+
+from main.images import derivative_name
+from main.models import ImageProductContent
+
+
+class ImageDerivativeTests(TestCase):
+
+	def setUp(self):
+		media_root = tempfile.mkdtemp()
+		self.addCleanup(shutil.rmtree, media_root)
+		overrides = override_settings(MEDIA_ROOT=media_root, IMAGE_DERIVATIVES_SYNC=True, IMAGE_DERIVATIVE_WIDTHS=(320, 640, 1280))
+		overrides.enable()
+		self.addCleanup(overrides.disable)
+		cache.clear()
+		self.user = User.objects.create_user('uploader')
+
+	def upload(self, filename='dragon-pc.jpg'):
+		with open(settings.BASE_DIR / 'media' / 'product_images' / filename, 'rb') as source:
+			with self.captureOnCommitCallbacks(execute=True):
+				return ImageProductContent.objects.create(user=self.user, image=File(source, name=filename))
+
+	def test_upload_generates_derivatives(self):
+		content = self.upload()
+		name = content.image.name
+		# The 960px source is only scaled down
+		for width in (320, 640):
+			for extension in ('webp', 'jpg'):
+				self.assertTrue(default_storage.exists(derivative_name(name, width, extension)))
+		self.assertFalse(default_storage.exists(derivative_name(name, 1280, 'webp')))
+		self.assertLess(default_storage.size(derivative_name(name, 640, 'webp')), default_storage.size(name))
+
+	def test_picture_tag(self):
+		content = self.upload()
+		html = Template('{% load product_images %}{% picture image sizes="250px" %}').render(Context({'image': content.image}))
+		self.assertIn('type="image/webp"', html)
+		self.assertRegex(html, r'-320w\.webp\?v=\w+ 320w')
+		self.assertRegex(html, r'-640w\.jpg\?v=\w+ 640w')
+		self.assertIn(f'src="{content.image.url}"', html)
+
+	def test_picture_tag_without_derivatives(self):
+		with override_settings(IMAGE_DERIVATIVES_SYNC=False):
+			with open(settings.BASE_DIR / 'media' / 'product_images' / 'man-clothes.jpg', 'rb') as source:
+				content = ImageProductContent.objects.create(user=self.user, image=File(source, name='man-clothes.jpg'))
+		html = Template('{% load product_images %}{% picture image %}').render(Context({'image': content.image}))
+		self.assertNotIn('<source', html)
+		self.assertIn(f'src="{content.image.url}"', html)
+
+	def test_backfill_command(self):
+		with override_settings(IMAGE_DERIVATIVES_SYNC=False):
+			with open(settings.BASE_DIR / 'media' / 'product_images' / 'man-clothes.jpg', 'rb') as source:
+				content = ImageProductContent.objects.create(user=self.user, image=File(source, name='man-clothes.jpg'))
+		out = StringIO()
+		call_command('build_image_derivatives', '--workers', '2', stdout=out)
+		self.assertIn('Processed 1 images, 0 failed', out.getvalue())
+		self.assertTrue(default_storage.exists(derivative_name(content.image.name, 640, 'webp')))
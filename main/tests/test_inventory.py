@@ -0,0 +1,126 @@
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.test import TestCase, TransactionTestCase
+from django.utils import timezone
+
+from main import cart, inventory, payments
+from main.benchmarks import flash_sale
+from main.models import Order, Product, StockReservation
+
+from .test_cart import create_product
+
+
+class InventoryTests(TestCase):
+
+	@classmethod
+	def setUpTestData(cls):
+		cls.user = User.objects.create_user('buyer', password='password')
+		cls.other = User.objects.create_user('other', password='password')
+		cls.product = create_product(product_qt=3)
+
+	def stock(self):
+		product = Product.objects.get(pk=self.product.pk)
+		return product.product_qt, product.reserved_qt
+
+	def test_reserve_until_sold_out(self):
+		inventory.reserve(self.user, self.product.pk)
+		inventory.reserve(self.user, self.product.pk)
+		inventory.reserve(self.other, self.product.pk)
+		with self.assertRaises(inventory.OutOfStock):
+			inventory.reserve(self.other, self.product.pk)
+		self.assertEqual(self.stock(), (3, 3))
+		self.assertEqual(StockReservation.objects.get(user=self.user).quantity, 2)
+		with self.assertRaises(Product.DoesNotExist):
+			inventory.reserve(self.user, self.product.pk + 1)
+
+	def test_release(self):
+		inventory.reserve(self.user, self.product.pk)
+		inventory.reserve(self.user, self.product.pk)
+		inventory.release(self.user, self.product.pk, 1)
+		self.assertEqual(self.stock(), (3, 1))
+		inventory.release(self.user, self.product.pk, 1)
+		self.assertEqual(self.stock(), (3, 0))
+		self.assertFalse(StockReservation.objects.exists())
+		inventory.release(self.user, self.product.pk)
+		self.assertEqual(self.stock(), (3, 0))
+
+	def test_full_save_keeps_stock(self):
+		product = Product.objects.get(pk=self.product.pk)
+		inventory.reserve(self.user, self.product.pk)
+		cart.add_product(self.other, self.product.pk)
+		cart.complete_order(Order.objects.get(user=self.other))
+		# Loaded before the sale, e.g. an admin form
+		product.title = 'Новое название'
+		product.save()
+		self.assertEqual(self.stock(), (2, 1))
+		self.assertEqual(Product.objects.get(pk=self.product.pk).title, 'Новое название')
+
+	def test_restock(self):
+		inventory.reserve(self.user, self.product.pk)
+		inventory.restock(self.product.pk, 2)
+		self.assertEqual(self.stock(), (5, 1))
+		inventory.restock(self.product.pk, -4)
+		self.assertEqual(self.stock(), (1, 1))
+		with self.assertRaises(inventory.OutOfStock):
+			inventory.restock(self.product.pk, -1)
+		self.assertEqual(self.stock(), (1, 1))
+		with self.assertRaises(Product.DoesNotExist):
+			inventory.restock(self.product.pk + 1, 1)
+
+	def test_release_expired(self):
+		inventory.reserve(self.user, self.product.pk)
+		inventory.reserve(self.other, self.product.pk)
+		StockReservation.objects.filter(user=self.user).update(expires_at=timezone.now() - timedelta(seconds=1))
+		call_command('release_expired_reservations', '--batch-size', '1', stdout=open('/dev/null', 'w'))
+		self.assertEqual(self.stock(), (3, 1))
+		self.assertEqual(list(StockReservation.objects.values_list('user', flat=True)), [self.other.pk])
+
+	def test_complete_order_commits_reservations(self):
+		inventory.reserve(self.user, self.product.pk)
+		inventory.reserve(self.user, self.product.pk)
+		cart.add_product(self.user, self.product.pk)
+		cart.add_product(self.user, self.product.pk)
+		order = Order.objects.get(user=self.user)
+		self.assertTrue(cart.complete_order(order))
+		self.assertFalse(cart.complete_order(order))
+		self.assertEqual(self.stock(), (1, 0))
+		self.assertTrue(Order.objects.get().ordered)
+		self.assertTrue(order.products.get().order_status)
+
+	def test_complete_order_after_expiry(self):
+		# The hold was swept and someone else holds the last unit
+		cart.add_product(self.user, self.product.pk)
+		cart.add_product(self.user, self.product.pk)
+		inventory.reserve(self.other, self.product.pk)
+		inventory.reserve(self.other, self.product.pk)
+		order = Order.objects.get(user=self.user)
+		with self.assertRaises(inventory.OutOfStock):
+			cart.complete_order(order)
+		self.assertEqual(self.stock(), (3, 2))
+		self.assertFalse(Order.objects.get(pk=order.pk).ordered)
+
+	def test_add_to_cart_view_out_of_stock(self):
+		self.client.force_login(self.user)
+		for _ in range(4):
+			self.client.get(f'/add-to-cart/{self.product.pk}/', HTTP_REFERER='/')
+		self.assertEqual(self.stock(), (3, 3))
+		self.assertEqual(Order.objects.get().item_count, 3)
+		self.client.post('/cart/payment-procedure/UMoney/')
+		self.assertEqual(self.stock(), (3, 3))
+		with self.settings(PAYMENT_FAKE_LATENCY=0):
+			payments.run_due()
+		self.assertEqual(self.stock(), (0, 0))
+
+
+class FlashSaleStressTests(TransactionTestCase):
+
+	def test_no_oversell(self):
+		stock, buyers, units = 50, 16, 6
+		result, product_id, sold = flash_sale(stock, buyers, units)
+		product = Product.objects.get(pk=product_id)
+		self.assertEqual(result.errors, 0)
+		self.assertEqual(sold, stock)
+		self.assertEqual((product.product_qt, product.reserved_qt), (0, 0))
+		self.assertFalse(StockReservation.objects.exists())
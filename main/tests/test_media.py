@@ -0,0 +1,98 @@
+import os
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.test import SimpleTestCase, override_settings
+from django.utils.http import http_date
+
+from main.media import IMMUTABLE_CACHE_CONTROL, file_digest
+
+
+POSTER = 'product_images/dragon-pc.jpg'
+
+
+class MediaServingTests(SimpleTestCase):
+
+	def setUp(self):
+		self.path = os.path.join(settings.MEDIA_ROOT, POSTER)
+		with open(self.path, 'rb') as file:
+			self.content = file.read()
+		self.etag = f'"{file_digest(self.path)}"'
+
+	def get(self, url=None, **headers):
+		return self.client.get(url or f'/media/{POSTER}', **headers)
+
+	def body(self, response):
+		return b''.join(response.streaming_content)
+
+	def test_versioned_url_is_immutable(self):
+		url = default_storage.url(POSTER)
+		self.assertIn('?v=', url)
+		response = self.get(url)
+		self.assertEqual(response.status_code, 200)
+		self.assertEqual(response['Cache-Control'], IMMUTABLE_CACHE_CONTROL)
+		self.assertEqual(response['ETag'], self.etag)
+		self.assertEqual(response['Content-Type'], 'image/jpeg')
+		self.assertEqual(response['Accept-Ranges'], 'bytes')
+		self.assertEqual(self.body(response), self.content)
+
+	def test_unversioned_url_revalidates(self):
+		response = self.get(f'/media/{POSTER}?v=stale')
+		self.assertIn('must-revalidate', response['Cache-Control'])
+
+	def test_if_none_match(self):
+		response = self.get(HTTP_IF_NONE_MATCH=self.etag)
+		self.assertEqual(response.status_code, 304)
+		self.assertEqual(response['ETag'], self.etag)
+		self.assertEqual(response.content, b'')
+
+	def test_if_modified_since(self):
+		response = self.get(HTTP_IF_MODIFIED_SINCE=http_date(os.path.getmtime(self.path)))
+		self.assertEqual(response.status_code, 304)
+
+	def test_range(self):
+		response = self.get(HTTP_RANGE='bytes=10-19')
+		self.assertEqual(response.status_code, 206)
+		self.assertEqual(response['Content-Range'], f'bytes 10-19/{len(self.content)}')
+		self.assertEqual(response['Content-Length'], '10')
+		self.assertEqual(self.body(response), self.content[10:20])
+
+	def test_suffix_and_open_ranges(self):
+		response = self.get(HTTP_RANGE='bytes=-100')
+		self.assertEqual(self.body(response), self.content[-100:])
+		response = self.get(HTTP_RANGE=f'bytes={len(self.content) - 5}-')
+		self.assertEqual(self.body(response), self.content[-5:])
+
+	def test_unsatisfiable_range(self):
+		response = self.get(HTTP_RANGE=f'bytes={len(self.content)}-')
+		self.assertEqual(response.status_code, 416)
+		self.assertEqual(response['Content-Range'], f'bytes */{len(self.content)}')
+
+	def test_if_range(self):
+		response = self.get(HTTP_RANGE='bytes=0-9', HTTP_IF_RANGE=self.etag)
+		self.assertEqual(response.status_code, 206)
+		response = self.get(HTTP_RANGE='bytes=0-9', HTTP_IF_RANGE='"outdated"')
+		self.assertEqual(response.status_code, 200)
+		self.assertEqual(self.body(response), self.content)
+
+	def test_multiple_ranges_get_whole_file(self):
+		response = self.get(HTTP_RANGE='bytes=0-1,5-6')
+		self.assertEqual(response.status_code, 200)
+
+	def test_missing_and_outside_files(self):
+		self.assertEqual(self.get('/media/product_images/missing.jpg').status_code, 404)
+		self.assertEqual(self.get('/media/../manage.py').status_code, 404)
+		self.assertEqual(self.get('/media/product_images').status_code, 404)
+
+	@override_settings(MEDIA_SENDFILE_HEADER='X-Accel-Redirect')
+	def test_accel_redirect(self):
+		response = self.get()
+		self.assertEqual(response['X-Accel-Redirect'], f'/protected-media/{POSTER}')
+		self.assertEqual(response['Content-Type'], 'image/jpeg')
+		self.assertEqual(response['ETag'], self.etag)
+		self.assertEqual(response.content, b'')
+
+	@override_settings(MEDIA_SENDFILE_HEADER='X-Sendfile')
+	def test_sendfile(self):
+		response = self.get()
+		self.assertEqual(response['X-Sendfile'], self.path)
@@ -0,0 +1,67 @@
+from asgiref.sync import async_to_sync
+
+from django.test import TestCase
+
+from main.models import Product
+from main.pagination import KeysetPaginator, decode_cursor, encode_cursor
+from main.tests.test_cart import create_product
+
+
+class KeysetPaginatorTests(TestCase):
+
+	@classmethod
+	def setUpTestData(cls):
+		cls.ids = [create_product(slug=f'product-{i}').pk for i in range(7)]
+		cls.paginator = KeysetPaginator(Product.objects.all(), 3)
+
+	def ids_of(self, page):
+		return [product.pk for product in page]
+
+	def test_pages_forward(self):
+		newest = self.ids[::-1]
+		first = self.paginator.page()
+		self.assertEqual(self.ids_of(first), newest[:3])
+		self.assertFalse(first.has_previous)
+		second = self.paginator.page(after=first.next_cursor)
+		self.assertEqual(self.ids_of(second), newest[3:6])
+		last = self.paginator.page(after=second.next_cursor)
+		self.assertEqual(self.ids_of(last), newest[6:])
+		self.assertFalse(last.has_next)
+		self.assertTrue(last.has_previous)
+
+	def test_pages_back(self):
+		newest = self.ids[::-1]
+		last = self.paginator.page(after=encode_cursor(newest[5]))
+		second = self.paginator.page(before=last.prev_cursor)
+		self.assertEqual(self.ids_of(second), newest[3:6])
+		self.assertTrue(second.has_next)
+		self.assertTrue(second.has_previous)
+		first = self.paginator.page(before=second.prev_cursor)
+		self.assertEqual(self.ids_of(first), newest[:3])
+		self.assertTrue(first.has_next)
+		self.assertFalse(first.has_previous)
+		# Back from the first page there is nothing
+		empty = self.paginator.page(before=encode_cursor(newest[0]))
+		self.assertEqual((len(empty), empty.has_next, empty.has_previous), (0, False, False))
+
+	def test_ascending(self):
+		paginator = KeysetPaginator(Product.objects.all(), 3, descending=False)
+		second = paginator.page(after=paginator.page().next_cursor)
+		self.assertEqual(self.ids_of(second), self.ids[3:6])
+		self.assertEqual(self.ids_of(paginator.page(before=second.prev_cursor)), self.ids[:3])
+
+	def test_malformed_cursors_start_over(self):
+		for cursor in ('', 'garbage!', encode_cursor('abc'), '%%%', encode_cursor(b'\xff\xfe')):
+			with self.subTest(cursor=cursor):
+				self.assertIsNone(decode_cursor(cursor))
+				self.assertEqual(self.ids_of(self.paginator.page(after=cursor)), self.ids[::-1][:3])
+				self.assertEqual(self.ids_of(self.paginator.page(before=cursor)), self.ids[::-1][:3])
+
+	def test_apage_matches_page(self):
+		first = self.paginator.page()
+		for after, before in ((None, None), (first.next_cursor, None), (None, encode_cursor(self.ids[2]))):
+			with self.subTest(after=after, before=before):
+				page = self.paginator.page(after=after, before=before)
+				apage = async_to_sync(self.paginator.apage)(after=after, before=before)
+				self.assertEqual(self.ids_of(apage), self.ids_of(page))
+				self.assertEqual((apage.next_cursor, apage.prev_cursor), (page.next_cursor, page.prev_cursor))
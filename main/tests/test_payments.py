@@ -0,0 +1,171 @@
+import threading
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.db import IntegrityError
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+
+from main import cart, payments
+from main.models import Order, Payment, PaymentJob, Product
+from main.tests.test_cart import create_product
+
+
+@override_settings(PAYMENT_FAKE_LATENCY=0, PAYMENT_FAKE_FAILURE_RATE=0.0)
+class PaymentJobTests(TestCase):
+
+	@classmethod
+	def setUpTestData(cls):
+		cls.user = User.objects.create_user('buyer', password='password')
+		cls.product = create_product(product_qt=5)
+
+	def setUp(self):
+		cart.add_product(self.user, self.product.pk)
+		self.order = Order.objects.get(user=self.user, ordered=False)
+
+	def job(self):
+		return PaymentJob.objects.get(order=self.order)
+
+	def test_enqueue_is_idempotent(self):
+		job = payments.enqueue(self.order, 'UMoney')
+		self.assertEqual(payments.enqueue(self.order, 'UMoney'), job)
+		self.order.refresh_from_db()
+		self.assertEqual(job.idempotency_key, self.order.ref_code)
+		self.assertEqual(job.amount, self.order.get_total())
+		self.assertEqual(PaymentJob.objects.count(), 1)
+
+	def test_one_job_per_order(self):
+		job = payments.enqueue(self.order, 'UMoney')
+		with self.assertRaises(IntegrityError):
+			PaymentJob.objects.create(order=self.order, user=self.user, provider='UMoney', idempotency_key='other', amount=job.amount)
+
+	def test_unknown_provider(self):
+		with self.assertRaises(ValueError):
+			payments.enqueue(self.order, 'Nope')
+		self.assertFalse(PaymentJob.objects.exists())
+
+	def test_success_places_order(self):
+		payments.enqueue(self.order, 'UMoney')
+		self.assertEqual(payments.run_due(), 1)
+		job = self.job()
+		self.order.refresh_from_db()
+		self.assertEqual((job.status, job.attempts), ('succeeded', 1))
+		self.assertTrue(self.order.ordered)
+		self.assertEqual(self.order.payment, job.payment)
+		self.assertEqual(Product.objects.get(pk=self.product.pk).product_qt, 4)
+		self.assertEqual(payments.run_due(), 0)
+
+	@override_settings(PAYMENT_FAKE_FAILURE_RATE=1.0, PAYMENT_RETRY_DELAY=5)
+	def test_provider_failure_backs_off(self):
+		payments.enqueue(self.order, 'UMoney')
+		before = timezone.now()
+		self.assertEqual(payments.run_due(), 1)
+		job = self.job()
+		self.assertEqual((job.status, job.attempts), ('pending', 1))
+		self.assertIn('unavailable', job.last_error)
+		self.assertGreaterEqual(job.run_at, before + timedelta(seconds=5))
+		# Not due yet
+		self.assertEqual(payments.run_due(), 0)
+		PaymentJob.objects.update(run_at=timezone.now())
+		payments.run_due()
+		job = self.job()
+		self.assertEqual(job.attempts, 2)
+		self.assertGreaterEqual(job.run_at, before + timedelta(seconds=10))
+		self.assertFalse(Order.objects.get(pk=self.order.pk).ordered)
+
+	@override_settings(PAYMENT_FAKE_FAILURE_RATE=1.0, PAYMENT_MAX_ATTEMPTS=2)
+	def test_fails_after_max_attempts(self):
+		payments.enqueue(self.order, 'UMoney')
+		payments.run_due()
+		PaymentJob.objects.update(run_at=timezone.now())
+		payments.run_due()
+		self.assertEqual(self.job().status, 'failed')
+		self.assertEqual(payments.run_due(), 0)
+
+	def test_retry_delay(self):
+		with self.settings(PAYMENT_RETRY_DELAY=5, PAYMENT_RETRY_MAX_DELAY=30):
+			self.assertEqual([payments.retry_delay(n) for n in range(1, 6)], [5, 10, 20, 30, 30])
+
+	def test_out_of_stock_fails_and_refunds(self):
+		payments.enqueue(self.order, 'UMoney')
+		# Stock ran out behind the reservation's back
+		Product.objects.filter(pk=self.product.pk).update(product_qt=0, reserved_qt=0)
+		payments.run_due()
+		job = self.job()
+		self.assertEqual(job.status, 'failed')
+		self.assertFalse(Order.objects.get(pk=self.order.pk).ordered)
+		self.assertFalse(Payment.objects.exists())
+
+	def test_changed_order_is_not_placed(self):
+		payments.enqueue(self.order, 'UMoney')
+		cart.add_product(self.user, self.product.pk)
+		payments.run_due()
+		self.assertEqual(self.job().status, 'failed')
+		self.assertFalse(Order.objects.get(pk=self.order.pk).ordered)
+
+	def test_failed_job_is_paid_again(self):
+		failed = payments.enqueue(self.order, 'UMoney')
+		cart.add_product(self.user, self.product.pk)
+		payments.run_due()
+		self.client.force_login(self.user)
+		response = self.client.post('/cart/payment-procedure/ZberBank/', follow=True)
+		self.assertContains(response, 'Платеж обрабатывается')
+		job = self.job()
+		self.order.refresh_from_db()
+		self.assertEqual((job.pk, job.status, job.attempts, job.provider), (failed.pk, 'pending', 0, 'ZberBank'))
+		self.assertEqual(job.amount, self.order.get_total())
+		self.assertNotEqual(job.idempotency_key, failed.idempotency_key)
+		self.assertEqual(payments.run_due(), 1)
+		self.assertEqual(self.job().status, 'succeeded')
+		self.assertTrue(Order.objects.get(pk=self.order.pk).ordered)
+		# Still reported under the order's ref code
+		self.assertEqual(self.client.get(f'/cart/payment-status/{self.order.ref_code}/').json()['status'], 'succeeded')
+
+	def test_expired_lease_is_claimed_again(self):
+		payments.enqueue(self.order, 'UMoney')
+		self.assertEqual(len(payments.claim(10)), 1)
+		self.assertEqual(payments.claim(10), [])
+		PaymentJob.objects.update(locked_until=timezone.now() - timedelta(seconds=1))
+		self.assertEqual(len(payments.claim(10)), 1)
+		self.assertEqual(self.job().attempts, 2)
+
+	def test_status_endpoint(self):
+		self.client.force_login(self.user)
+		response = self.client.post('/cart/payment-procedure/UMoney/')
+		self.assertRedirects(response, '/', fetch_redirect_response=False)
+		ref_code = self.job().idempotency_key
+		url = f'/cart/payment-status/{ref_code}/'
+		self.assertEqual(self.client.get(url).json()['status'], 'pending')
+		payments.run_due()
+		data = self.client.get(url).json()
+		self.assertEqual((data['status'], data['ordered']), ('succeeded', True))
+		self.client.force_login(User.objects.create_user('other'))
+		self.assertEqual(self.client.get(url).status_code, 404)
+
+	def test_unknown_payment_page(self):
+		self.client.force_login(self.user)
+		response = self.client.post('/cart/payment-procedure/Nope/')
+		self.assertRedirects(response, '/cart/checkout/', fetch_redirect_response=False)
+		self.assertFalse(PaymentJob.objects.exists())
+
+
+@override_settings(PAYMENT_FAKE_LATENCY=0.05, PAYMENT_FAKE_FAILURE_RATE=0.0)
+class WorkerTests(TransactionTestCase):
+
+	def test_burst_runs_every_job(self):
+		product = create_product()
+		for n in range(6):
+			user = User.objects.create_user(f'buyer{n}')
+			cart.add_product(user, product.pk)
+			payments.enqueue(Order.objects.get(user=user, ordered=False), 'ZberBank')
+		self.assertEqual(payments.Worker(concurrency=3, poll_interval=0.01).run(burst=True), 6)
+		self.assertEqual(PaymentJob.objects.filter(status='succeeded').count(), 6)
+		self.assertEqual(Product.objects.get(pk=product.pk).product_qt, 94)
+
+	def test_stop(self):
+		worker = payments.Worker(poll_interval=0.01)
+		thread = threading.Thread(target=worker.run)
+		thread.start()
+		worker.stop()
+		thread.join(timeout=5)
+		self.assertFalse(thread.is_alive())
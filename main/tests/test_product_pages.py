@@ -0,0 +1,91 @@
+from io import StringIO
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.test import TestCase
+
+from main import cart, product_pages
+from main.models import ImageProductContent, Product
+from main.tests.test_cart import create_product
+
+
+class ProductPageCacheTests(TestCase):
+
+	@classmethod
+	def setUpTestData(cls):
+		cls.user = User.objects.create_user('buyer', password='password')
+		cls.product = create_product()
+
+	def setUp(self):
+		cache.clear()
+		self.client.force_login(self.user)
+		self.url = f'/product-detail-{self.product.pk}/'
+
+	def test_hit_reads_no_product(self):
+		product_pages.get_page(self.product.pk)
+		with self.assertNumQueries(0):
+			page = product_pages.get_page(self.product.pk)
+		self.assertEqual(page['title'], 'Мужские штаны')
+		self.assertEqual(product_pages.stats(), {'hits': 1, 'misses': 1})
+
+	def test_missing_product(self):
+		with self.assertRaises(Product.DoesNotExist):
+			product_pages.get_page(self.product.pk + 1)
+		self.assertEqual(self.client.get(f'/product-detail-{self.product.pk + 1}/').status_code, 404)
+
+	def test_save_and_delete_bump(self):
+		self.assertContains(self.client.get(self.url), 'Мужские штаны')
+		self.product.title = 'Женские штаны'
+		self.product.save()
+		self.assertContains(self.client.get(self.url), 'Женские штаны')
+		self.product.delete()
+		self.assertEqual(self.client.get(self.url).status_code, 404)
+
+	def test_images_bump(self):
+		self.client.get(self.url)
+		content = ImageProductContent.objects.create(user=self.user, image='product_images/a.jpg')
+		self.product.image_content.add(content)
+		self.assertContains(self.client.get(self.url), 'product_images/a.jpg')
+		content.image = 'product_images/b.jpg'
+		content.save()
+		self.assertContains(self.client.get(self.url), 'product_images/b.jpg')
+		content.product_set.clear()
+		self.assertNotContains(self.client.get(self.url), 'product_images/b.jpg')
+		content.product_set.add(self.product)
+		self.assertContains(self.client.get(self.url), 'product_images/b.jpg')
+		content.delete()
+		self.assertNotContains(self.client.get(self.url), 'product_images/b.jpg')
+
+	def test_bump_all(self):
+		product_pages.get_page(self.product.pk)
+		Product.objects.filter(pk=self.product.pk).update(title='Новые штаны')
+		product_pages.bump_all()
+		self.assertEqual(product_pages.get_page(self.product.pk)['title'], 'Новые штаны')
+
+	def test_cart_button_is_per_user(self):
+		self.assertContains(self.client.get(self.url), 'Добавить в корзину')
+		cart.add_product(self.user, self.product.pk)
+		self.assertContains(self.client.get(self.url), 'Убрать из корзины')
+		self.client.force_login(User.objects.create_user('other'))
+		response = self.client.get(self.url)
+		self.assertContains(response, 'Добавить в корзину')
+		self.assertEqual(product_pages.stats(), {'hits': 2, 'misses': 1})
+
+	def test_hit_header(self):
+		self.assertEqual(self.client.get(self.url)['X-Product-Page-Cache'], 'miss')
+		self.assertEqual(self.client.get(self.url)['X-Product-Page-Cache'], 'hit')
+
+	def test_stats_command_needs_a_shared_cache(self):
+		with self.assertRaisesMessage(CommandError, 'not shared between processes'):
+			call_command('product_page_stats', stdout=StringIO())
+
+	@mock.patch('main.management.commands.product_page_stats.PROCESS_LOCAL_CACHES', ())
+	def test_stats_command(self):
+		product_pages.get_page(self.product.pk)
+		product_pages.get_page(self.product.pk)
+		out = StringIO()
+		call_command('product_page_stats', reset=True, stdout=out)
+		self.assertIn('hits 1, misses 1, hit ratio 50.0%', out.getvalue())
+		self.assertEqual(product_pages.stats(), {'hits': 0, 'misses': 0})
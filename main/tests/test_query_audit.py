@@ -0,0 +1,39 @@
+from io import StringIO
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import IntegrityError
+from django.test import TestCase
+from django.utils import timezone
+
+from main import query_audit
+from main.models import Order, Product
+
+
+class QueryAuditTests(TestCase):
+
+	def test_hot_queries_use_indexes(self):
+		out = StringIO()
+		call_command('audit_query_plans', stdout=out)
+		self.assertIn(f'All {len(query_audit.HOT_QUERIES)} hot queries use indexes', out.getvalue())
+
+	def test_full_scan_is_flagged(self):
+		unindexed = lambda: Product.objects.filter(description='Штаны')
+		_, scans = query_audit.full_scans(unindexed())
+		self.assertEqual(scans, ['main_product'])
+		out = StringIO()
+		hot_queries = query_audit.HOT_QUERIES | {'by description': unindexed}
+		with mock.patch('main.management.commands.audit_query_plans.HOT_QUERIES', hot_queries):
+			with self.assertRaises(CommandError):
+				call_command('audit_query_plans', stdout=out)
+		self.assertIn('by description: full scan of main_product', out.getvalue())
+
+	def test_one_open_order_per_user(self):
+		user = User.objects.create_user('buyer')
+		Order.objects.create(user=user, ordered_date=timezone.now(), ordered=True)
+		Order.objects.create(user=user, ordered_date=timezone.now(), ordered=True)
+		Order.objects.create(user=user, ordered_date=timezone.now())
+		with self.assertRaises(IntegrityError):
+			Order.objects.create(user=user, ordered_date=timezone.now())
@@ -0,0 +1,193 @@
+import math
+import time
+from contextlib import contextmanager
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from main import cart, feeds, payments
+from main.datagen import DataGenerator
+from main.models import Address, Favorite, ForProductCategory, Order, OrderProduct, Product
+from main.tests.test_checkout import SHIPPING
+from main.tests.test_coupons import create_coupon
+
+
+# Upper bound for a single request, generous enough for a slow CI machine
+MAX_SECONDS = 2.0
+
+CART_LINES = 40
+FAVORITES = 400
+
+
+class QueryBudgetTests(TestCase):
+	"""
+	Every route of main.urls against a seeded shop. Budgets are constants: a
+	view whose query count grows with the number of rows it shows fails here.
+	The product feeds are the one exception, they read the catalog in chunks.
+	"""
+
+	@classmethod
+	def setUpTestData(cls):
+		# Large enough that a per-item query in any view blows its budget
+		DataGenerator(seed=0).generate(users=200, categories=12, products=3000, carts=0, orders=600, favorites=20)
+		Product.objects.update(product_qt=1000)
+		cls.product_ids = list(Product.objects.values_list('pk', flat=True))
+		cls.subcategory = ForProductCategory.objects.first()
+		cls.user = User.objects.create_user('shopper', password='password')
+		cart_lines = OrderProduct.objects.bulk_create([
+			OrderProduct(user=cls.user, product_id=product_id, quantity=1) for product_id in cls.product_ids[:CART_LINES]
+		])
+		cls.order = Order.objects.create(user=cls.user, ordered_date=timezone.now())
+		cls.order.products.add(*cart_lines)
+		Order.objects.filter(pk=cls.order.pk).update(
+			item_count=CART_LINES,
+			total=sum(Product.objects.filter(pk__in=cls.product_ids[:CART_LINES]).values_list('price', flat=True)),
+		)
+		Address.objects.create(user=cls.user, street_address='Ленина 1', apartment_address='5', county='RU', zip='101000', address_type='S', default=True)
+		favorite = Favorite.objects.create(user=cls.user)
+		favorite.fav_products.add(*cls.product_ids[-FAVORITES:])
+		cls.placed = Order.objects.create(user=cls.user, ordered=True, ordered_date=timezone.now(), ref_code=cart.create_ref_code())
+
+	def setUp(self):
+		cache.clear()
+		self.client.force_login(self.user)
+
+	@contextmanager
+	def assertQueryBudget(self, budget, max_seconds=MAX_SECONDS):
+		with CaptureQueriesContext(connection) as context:
+			started = time.perf_counter()
+			yield
+			elapsed = time.perf_counter() - started
+		if len(context) > budget:
+			queries = '\n'.join(f'{i}. {query["sql"]}' for i, query in enumerate(context.captured_queries, start=1))
+			self.fail(f'{len(context)} queries, budget is {budget}:\n{queries}')
+		self.assertLess(elapsed, max_seconds, f'Took {elapsed:.2f}s, limit is {max_seconds}s')
+
+	def get(self, url, budget, status=200, **extra):
+		# Warm the per-user caches first, budgets are for steady-state page views
+		self.client.get(url, **extra)
+		with self.assertQueryBudget(budget):
+			response = self.client.get(url, **extra)
+		self.assertEqual(response.status_code, status)
+		return response
+
+	def test_index(self):
+		response = self.get('/', 3)
+		self.get(f'/?after={response.context["page"].next_cursor}', 3)
+
+	def test_category_list(self):
+		response = self.get('/category-list/', 4)
+		self.assertContains(response, f'/subcategory-{self.subcategory.pk}/')
+
+	def test_subcategory(self):
+		self.get(f'/subcategory-{self.subcategory.pk}/', 5)
+		self.get(f'/subcategory-{self.subcategory.pk}/?label=P&price=2', 5)
+
+	def test_product_detail(self):
+		self.get(f'/product-detail-{self.product_ids[0]}/', 3)
+
+	def test_search(self):
+		response = self.get('/search/?q=куртка', 4)
+		self.assertTrue(response.context['has_next'])
+		self.get('/search/?q=куртка&page=3', 4)
+
+	def test_anonymous_pages(self):
+		self.client.logout()
+		self.get('/login/', 0)
+		self.get('/register/', 0)
+		self.get('/', 0, status=302)
+
+	def test_logout(self):
+		with self.assertQueryBudget(4):
+			response = self.client.get('/logout/')
+		self.assertRedirects(response, '/login/')
+
+	def test_cart_writes(self):
+		referer = {'HTTP_REFERER': '/'}
+		product_id = self.product_ids[-1]
+		with self.assertQueryBudget(15):
+			self.client.get(f'/add-to-cart/{product_id}/', **referer)
+		with self.assertQueryBudget(15):
+			self.client.get(f'/add-to-cart/{product_id}/', **referer)
+		with self.assertQueryBudget(12):
+			self.client.get(f'/remove-single/{product_id}/')
+		with self.assertQueryBudget(12):
+			self.client.get(f'/remove-from-cart/{product_id}/', **referer)
+		self.assertEqual(Order.objects.get(pk=self.order.pk).item_count, CART_LINES)
+
+	def test_order_summary(self):
+		response = self.get('/cart/order-sum/', 5)
+		self.assertEqual(len(response.context['order_products']), CART_LINES)
+
+	def test_checkout(self):
+		self.get('/cart/checkout/', 7)
+
+	def test_payment(self):
+		response = self.get('/cart/payment-procedure/UMoney/', 5)
+		self.assertEqual(len(response.context['order_products']), CART_LINES)
+
+	def test_place_order(self):
+		with self.assertQueryBudget(13):
+			response = self.client.post('/cart/payment-procedure/UMoney/')
+		self.assertRedirects(response, '/', fetch_redirect_response=False)
+		self.assertFalse(Order.objects.get(pk=self.order.pk).ordered)
+		with self.settings(PAYMENT_FAKE_LATENCY=0):
+			payments.run_due()
+		self.assertTrue(Order.objects.get(pk=self.order.pk).ordered)
+
+	def test_favorites(self):
+		response = self.get('/favorites/', 4)
+		self.assertEqual(len(response.context['products']), FAVORITES)
+
+	def test_add_to_fav(self):
+		with self.assertQueryBudget(6):
+			self.client.get(f'/favorites/add/{self.product_ids[0]}/', HTTP_REFERER='/')
+		with self.assertQueryBudget(4):
+			self.client.get(f'/favorites/add/{self.product_ids[0]}/', HTTP_REFERER='/')
+
+	def test_checkout_post(self):
+		with self.assertQueryBudget(8):
+			response = self.client.post('/cart/checkout/', {**SHIPPING, 'same_billing_address': 'on', 'payment_option': 'U'})
+		self.assertRedirects(response, '/cart/payment-procedure/UMoney/', fetch_redirect_response=False)
+
+	def test_coupon(self):
+		create_coupon()
+		with self.assertQueryBudget(9):
+			response = self.client.post('/cart/coupon/', {'code': 'SALE'})
+		self.assertRedirects(response, '/cart/checkout/', fetch_redirect_response=False)
+		self.assertIsNotNone(Order.objects.get(pk=self.order.pk).coupon_id)
+
+	def test_payment_status(self):
+		self.client.post('/cart/payment-procedure/UMoney/')
+		self.order.refresh_from_db()
+		response = self.get(f'/cart/payment-status/{self.order.ref_code}/', 3)
+		self.assertEqual(response.json()['status'], 'pending')
+
+	def test_request_refund(self):
+		self.get('/request-refund/', 2)
+		with self.assertQueryBudget(7):
+			response = self.client.post('/request-refund/', {'ref_code': self.placed.ref_code, 'message': 'Не подошел размер', 'email': 'shopper@example.com'})
+		self.assertRedirects(response, '/', fetch_redirect_response=False)
+
+	def test_api(self):
+		self.client.logout()
+		response = self.get('/api/products/', 2)
+		self.get(response.json()['next'], 2)
+		self.get(f'/api/products/?subcategory={self.subcategory.pk}', 2)
+		self.get(f'/api/products/{self.product_ids[0]}/', 3)
+		self.get('/api/categories/', 3)
+		self.get(f'/api/subcategories/{self.subcategory.pk}/', 2)
+
+	@override_settings(FEED_TOKENS=['secret'])
+	def test_feeds(self):
+		self.client.logout()
+		# Subcategories, products, then one gallery query per feeds.CHUNK_SIZE products
+		budget = 2 + math.ceil(len(self.product_ids) / feeds.CHUNK_SIZE)
+		for format in ('csv', 'jsonl', 'xml'):
+			with self.subTest(format=format), self.assertQueryBudget(budget):
+				response = self.client.get(f'/feed/products.{format}', HTTP_AUTHORIZATION='Bearer secret')
+				b''.join(response.streaming_content)
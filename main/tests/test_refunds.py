@@ -0,0 +1,143 @@
+from importlib import import_module
+from io import StringIO
+from unittest import mock
+
+from django.apps import apps
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.test import TestCase
+from django.utils import timezone
+
+from main import cart, refunds
+from main.models import Order, Refund
+from main.tests.test_cart import create_product
+
+
+def placed_orders(user, count):
+	Order.objects.bulk_create([
+		Order(user=user, ordered=True, ordered_date=timezone.now(), ref_code=f'code{i:016}')
+		for i in range(count)
+	])
+	return list(Order.objects.filter(user=user, ordered=True).order_by('pk'))
+
+
+class RefCodeTests(TestCase):
+
+	def setUp(self):
+		self.user = User.objects.create_user('buyer')
+		self.product = create_product()
+		cart.add_product(self.user, self.product.pk)
+
+	def test_complete_order_assigns_ref_code(self):
+		order = Order.objects.get(user=self.user)
+		cart.complete_order(order)
+		order.refresh_from_db()
+		self.assertEqual(len(order.ref_code), 20)
+
+	def test_complete_order_keeps_ref_code(self):
+		Order.objects.update(ref_code='paid')
+		cart.complete_order(Order.objects.get(user=self.user))
+		self.assertEqual(Order.objects.get(user=self.user).ref_code, 'paid')
+
+	def test_taken_code_is_retried(self):
+		other = User.objects.create_user('other')
+		Order.objects.create(user=other, ordered=True, ordered_date=timezone.now(), ref_code='taken')
+		order = Order.objects.get(user=self.user)
+		with mock.patch('main.cart.create_ref_code', side_effect=['taken', 'free']):
+			cart.complete_order(order)
+		order.refresh_from_db()
+		self.assertEqual((order.ordered, order.ref_code), (True, 'free'))
+
+
+class RefCodeMigrationTests(TestCase):
+
+	def test_placed_orders_get_unique_codes(self):
+		user = User.objects.create_user('buyer')
+		Order.objects.bulk_create([
+			Order(user=user, ordered=True, ordered_date=timezone.now(), ref_code=None),
+			Order(user=user, ordered=True, ordered_date=timezone.now(), ref_code=None),
+			Order(user=user, ordered=False, ordered_date=timezone.now(), ref_code=''),
+		])
+		import_module('main.migrations.0015_refunds').dedupe_ref_codes(apps, None)
+		placed = Order.objects.filter(ordered=True).values_list('ref_code', flat=True)
+		self.assertEqual(len(set(placed)), 2)
+		self.assertTrue(all(len(code) == 20 for code in placed))
+		self.assertIsNone(Order.objects.get(ordered=False).ref_code)
+
+
+class RequestRefundTests(TestCase):
+
+	@classmethod
+	def setUpTestData(cls):
+		cls.user = User.objects.create_user('buyer', password='password')
+		cls.order = placed_orders(cls.user, 1)[0]
+
+	def setUp(self):
+		self.client.force_login(self.user)
+
+	def post(self, ref_code):
+		return self.client.post('/request-refund/', {'ref_code': ref_code, 'message': 'Не подошел размер', 'email': 'buyer@example.com'})
+
+	def test_request(self):
+		self.assertEqual(self.client.get('/request-refund/').status_code, 200)
+		response = self.post(self.order.ref_code)
+		self.assertRedirects(response, '/', fetch_redirect_response=False)
+		refund = Refund.objects.get()
+		self.assertEqual((refund.order_id, refund.email, refund.accepted), (self.order.pk, 'buyer@example.com', False))
+		self.assertTrue(Order.objects.get(pk=self.order.pk).refund_requested)
+
+	def test_request_queries(self):
+		# session, user, order lookup, savepoint, guarded update, insert, release
+		with self.assertNumQueries(7):
+			self.post(self.order.ref_code)
+
+	def test_second_request_is_refused(self):
+		self.post(self.order.ref_code)
+		response = self.post(self.order.ref_code)
+		self.assertRedirects(response, '/request-refund/', fetch_redirect_response=False)
+		self.assertEqual(Refund.objects.count(), 1)
+
+	def test_unknown_or_foreign_code(self):
+		self.post('nope')
+		other = User.objects.create_user('other')
+		Order.objects.create(user=other, ordered=True, ordered_date=timezone.now(), ref_code='theirs')
+		self.post('theirs')
+		self.assertFalse(Refund.objects.exists())
+
+	def test_invalid_form(self):
+		response = self.client.post('/request-refund/', {'ref_code': self.order.ref_code})
+		self.assertEqual(response.status_code, 200)
+		self.assertTrue(response.context['form'].errors)
+		self.assertFalse(Refund.objects.exists())
+
+
+class ProcessRefundsTests(TestCase):
+
+	@classmethod
+	def setUpTestData(cls):
+		cls.user = User.objects.create_user('buyer')
+		cls.orders = placed_orders(cls.user, 1200)
+		for order in cls.orders[:10]:
+			refunds.request_refund(cls.user, order.ref_code, 'Брак', 'buyer@example.com')
+
+	def test_grant_by_codes_in_batches(self):
+		codes = [order.ref_code for order in self.orders]
+		# Savepoint and release around two UPDATEs per batch of 500 codes
+		with self.assertNumQueries(2 + 2 * 3):
+			self.assertEqual(refunds.process_refunds(codes + ['unknown']), 1200)
+		self.assertEqual(Order.objects.filter(refund_requested=True, refund_granted=True).count(), 1200)
+		self.assertEqual(Refund.objects.filter(accepted=True).count(), 10)
+		self.assertEqual(refunds.process_refunds(codes), 0)
+
+	def test_deny_pending(self):
+		self.assertEqual(refunds.pending_orders().count(), 10)
+		self.assertEqual(refunds.process_refunds(grant=False), 10)
+		self.assertFalse(refunds.pending_orders().exists())
+		self.assertFalse(Refund.objects.filter(accepted=True).exists())
+		self.assertFalse(Order.objects.filter(refund_requested=True).exists())
+
+	def test_command(self):
+		out = StringIO()
+		call_command('process_refunds', pending=True, stdout=out)
+		self.assertIn('Granted refunds of 10 orders', out.getvalue())
+		self.assertEqual(Refund.objects.filter(accepted=True).count(), 10)
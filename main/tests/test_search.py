@@ -0,0 +1,87 @@
+from django.contrib.auth.models import User
+from django.test import TestCase
+
+from main import search
+from main.models import ForProductCategory, Product, ProductCategory
+from main.search import build_match_expression, search_product_ids
+from main.tests.test_cart import create_product
+
+
+class MatchExpressionTests(TestCase):
+
+	def test_words_become_quoted_prefix_terms(self):
+		self.assertEqual(build_match_expression('зимняя куртка'), '"зимняя"* "куртка"*')
+
+	def test_syntax_is_not_passed_through(self):
+		self.assertEqual(build_match_expression('a AND b OR NOT c'), '"a"* "AND"* "b"* "OR"* "NOT"* "c"*')
+		self.assertEqual(build_match_expression('title:"штаны" NEAR(x y) -z ^w *'), '"title"* "штаны"* "NEAR"* "x"* "y"* "z"* "w"*')
+		self.assertEqual(build_match_expression('"\')(*:^-+'), '')
+		self.assertEqual(build_match_expression(None), '')
+
+	def test_terms_are_capped(self):
+		self.assertEqual(build_match_expression(' '.join('abcdefghijk')).count('*'), search.MAX_QUERY_TERMS)
+
+
+class SearchTests(TestCase):
+
+	@classmethod
+	def setUpTestData(cls):
+		cls.pants = create_product()
+		cls.jacket = create_product(slug='kurtka', title='Куртка зимняя', description='Теплая куртка, куртка на меху')
+		cls.scarf = create_product(slug='sharf', title='Шарф', description='Длинный шарф, хорошо подходит под любую куртку или пальто')
+
+	def test_prefix_and_case(self):
+		self.assertEqual(search_product_ids('ШТА', limit=10), [self.pants.pk])
+		self.assertEqual(search_product_ids('штаны мужские', limit=10), [self.pants.pk])
+
+	def test_special_characters_do_not_raise(self):
+		for query in ('"', 'штаны"', 'NEAR(', 'title:штаны', '*', '-штаны', 'AND', 'штаны OR куртка', "'; DROP TABLE main_product; --"):
+			with self.subTest(query=query):
+				search_product_ids(query, limit=10)
+		self.assertEqual(search_product_ids('title:штаны', limit=10), [])
+		self.assertEqual(search_product_ids('-штаны', limit=10), [self.pants.pk])
+		self.assertEqual(search_product_ids('', limit=10), [])
+
+	def test_best_match_first(self):
+		self.assertEqual(search_product_ids('куртк', limit=10), [self.jacket.pk, self.scarf.pk])
+
+	def test_limit_and_offset(self):
+		self.assertEqual(search_product_ids('куртк', limit=1, offset=1), [self.scarf.pk])
+
+	def test_matches_category_path(self):
+		self.assertEqual(len(search_product_ids('одежда', limit=10)), 3)
+
+	def test_index_follows_writes(self):
+		self.jacket.title = 'Пуховик'
+		self.jacket.description = 'Пуховик'
+		self.jacket.save()
+		self.assertEqual(search_product_ids('пуховик', limit=10), [self.jacket.pk])
+		self.assertEqual(search_product_ids('куртк', limit=10), [self.scarf.pk])
+		self.scarf.delete()
+		self.assertEqual(search_product_ids('шарф', limit=10), [])
+
+	def test_category_rename_reindexes(self):
+		self.assertEqual(search_product_ids('гардероб', limit=10), [])
+		category = ProductCategory.objects.get(slug='clothes')
+		category.name = 'Гардероб'
+		category.save()
+		self.assertEqual(len(search_product_ids('гардероб', limit=10)), 3)
+		subcategory = ForProductCategory.objects.get(slug='man-clothes')
+		subcategory.name = 'Для него'
+		subcategory.save()
+		self.assertEqual(len(search_product_ids('него', limit=10)), 3)
+		self.assertEqual(search_product_ids('мужская', limit=10), [])
+
+	def test_rebuild(self):
+		Product.objects.filter(pk=self.pants.pk).update(title='Брюки')
+		self.assertEqual(search_product_ids('брюки', limit=10), [])
+		self.assertEqual(search.rebuild_index(batch_size=2), 3)
+		self.assertEqual(search_product_ids('брюки', limit=10), [self.pants.pk])
+
+	def test_view(self):
+		self.client.force_login(User.objects.create_user('buyer'))
+		response = self.client.get('/search/', {'q': 'куртк"а NEAR('})
+		self.assertEqual(response.status_code, 200)
+		self.assertEqual([product.pk for product in response.context['products']], [])
+		response = self.client.get('/search/', {'q': 'куртк', 'page': 'x'})
+		self.assertEqual([product.pk for product in response.context['products']], [self.jacket.pk, self.scarf.pk])
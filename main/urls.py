@@ -1,11 +1,14 @@
-from django.urls import path
+from django.urls import path, re_path
 
+from . import api
 from .views import *
 
 urlpatterns = [
 	path('', IndexView.as_view(), name='index'),
 	path('category-list/', CategoryListView.as_view(), name='category_list'),
+	path('subcategory-<int:category_id>/', SubCategoryView.as_view(), name='subcategory'),
 	path('product-detail-<int:product_id>/', product_detail, name='product'),
+	path('search/', SearchView.as_view(), name='search'),
 	path('login/', LoginPage.as_view(), name='login'),
 	path('register/', RegisterPage.as_view(), name='register'),
 	path('logout/', LogoutPage.as_view(), name='logout'),
@@ -14,7 +17,15 @@ urlpatterns = [
 	path('remove-single/<int:product_id>/', remove_product_for_order_sum, name='remove_single'),
 	path('cart/order-sum/', OrderSummaryPage.as_view(), name='order_sum'),
 	path('cart/checkout/', CheckOutPage.as_view(), name='checkout'),
+	path('cart/coupon/', AddCouponView.as_view(), name='add_coupon'),
 	path('cart/payment-procedure/<payment_option>/', PaymentPageForExample.as_view(), name='payment_page'),
+	path('cart/payment-status/<str:ref_code>/', payment_status, name='payment_status'),
+	path('request-refund/', RequestRefundPage.as_view(), name='request_refund'),
 	path('favorites/add/<int:product_id>/', add_to_fav, name='add_to_fav'),
 	path('favorites/', FavoritesPage.as_view(), name='fav'),
+	path('api/products/', api.products, name='api_products'),
+	path('api/products/<int:product_id>/', api.product, name='api_product'),
+	path('api/categories/', api.categories, name='api_categories'),
+	path('api/subcategories/<int:subcategory_id>/', api.subcategory, name='api_subcategory'),
+	re_path(r'^feed/products\.(?P<format>csv|jsonl|xml)$', product_feed, name='product_feed'),
 ]
\ No newline at end of file
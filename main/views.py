@@ -1,5 +1,8 @@
-import random
-import string
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+
+from django.conf import settings
 
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.forms import UserCreationForm
@@ -7,67 +10,173 @@ from django.views.generic import View
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.contrib.auth import login, logout, authenticate
 from django.contrib.auth.decorators import login_required
+from django.contrib.auth.views import redirect_to_login
 from django.contrib import messages
 from django.utils import timezone
-from django.core.exceptions import ObjectDoesNotExist
+from django.http import Http404, HttpResponse, HttpResponseBadRequest, JsonResponse, StreamingHttpResponse
+from django.utils.cache import patch_vary_headers
+from django.utils.crypto import constant_time_compare
+from django.utils.dateparse import parse_datetime
+from django.utils.http import urlencode
 
 from .forms import LoginForm, CheckOutForm, CouponForm, RefundForm
 from .models import *
+from . import checkout, coupons, favorites, feeds, inventory, payments, product_pages, refunds
+from .cart import CartBusy, get_cart_backend, navbar_state
+from .facets import Facets, price_bucket_range
+from .pagination import KeysetPaginator
+from .search import search_product_ids
+
+
+async def _is_authenticated(request):
+	# Resolving request.user reads the session and the user from the
+	# database, which must happen in the ORM thread, not on the event loop
+	return await sync_to_async(lambda: request.user.is_authenticated)()
+
+
+def alogin_required(view):
+	"""
+	login_required for async views.
+	"""
+	@wraps(view)
+	async def wrapper(request, *args, **kwargs):
+		if not await _is_authenticated(request):
+			return redirect_to_login(request.get_full_path())
+		return await view(request, *args, **kwargs)
+	return wrapper
+
+
+class AsyncLoginRequiredMixin:
+	"""
+	LoginRequiredMixin for views whose handlers are all async.
+	"""
+
+	async def dispatch(self, request, *args, **kwargs):
+		if not await _is_authenticated(request):
+			return redirect_to_login(request.get_full_path())
+		return await super().dispatch(request, *args, **kwargs)
+
+
+async def _navbar(request):
+	# Fetched by the view so that rendering base.html on the event loop reads
+	# nothing from the database. Like every sync_to_async call here it runs on
+	# the one thread-sensitive ORM thread, so the lookups of a view are awaited
+	# one after another: there is nothing to gain from gathering them.
+	return await sync_to_async(navbar_state)(request.user)
+
+
+class IndexView(AsyncLoginRequiredMixin, View):
+	paginate_by = 24
+
+	async def get(self, request, *args, **kwargs):
+		products = Product.objects.only(*PRODUCT_CARD_FIELDS)
+		page = await KeysetPaginator(products, self.paginate_by).apage(
+			after=request.GET.get('after'),
+			before=request.GET.get('before'),
+		)
+		navbar = await _navbar(request)
+		favorite_ids = await sync_to_async(favorites.favorite_ids)(request.user)
+		context = {
+			'products': favorites.mark(page.object_list, favorite_ids),
+			'page': page,
+			'navbar': navbar,
+		}
+		return render(request, 'index.html', context)
 
 
-def create_ref_code():
-	return ''.join(random.choices(string.ascii_lowercase + string.digits, k=20))
-
-
-def is_valid_form(values):
-	valid = True
-	for field in values:
-		if field == '':
-			valid = False
-	return valid
+@alogin_required
+async def product_detail(request, product_id):
+	try:
+		page, hit = await sync_to_async(product_pages.lookup)(product_id)
+	except Product.DoesNotExist:
+		raise Http404
+	at_cart = await sync_to_async(get_cart_backend().contains)(request.user, product_id)
+	navbar = await _navbar(request)
+	context = {
+		'page': page,
+		'product_id': product_id,
+		# Give add_product or remove_product btn
+		'at_cart': at_cart,
+		'navbar': navbar,
+	}
+	response = render(request, 'product_detail.html', context)
+	# Read per response, so the cache can be watched whichever process served it
+	response['X-Product-Page-Cache'] = 'hit' if hit else 'miss'
+	return response
 
 
-class IndexView(LoginRequiredMixin, View):
+class CategoryListView(AsyncLoginRequiredMixin, View):
 
-	def get(self, request, *args, **kwargs):
-		products = Product.objects.all()
+	async def get(self, request, *args, **kwargs):
+		categories = [category async for category in ProductCategory.objects.prefetch_related('pod')]
+		navbar = await _navbar(request)
 		context = {
-			'products': products,
+			'categories': categories,
+			'navbar': navbar,
 		}
-		return render(request, 'index.html', context)
+		return render(request, 'categories.html', context)
 
 
-@login_required
-def product_detail(request, product_id):
-	product = get_object_or_404(Product, pk=product_id)
-	context = {
-		'product': product
-	}
-	# Give add_product or remove_product btn
-	if request.user.is_authenticated:
-		user = request.user
-		order_qs = Order.objects.filter(user=user, ordered=False)
-		if order_qs.exists():
-			order = order_qs[0]
-			if order.products.filter(product__pk=product.pk).exists():
-				at_cart = True
-			else:
-				at_cart = False
-		else:
-			at_cart = False
-		context['at_cart'] = at_cart
+class SubCategoryView(LoginRequiredMixin, View):
+	paginate_by = 24
 
-	return render(request, 'product_detail.html', context)
+	def get(self, request, category_id, *args, **kwargs):
+		subcategory = get_object_or_404(ForProductCategory.objects.select_related('category'), pk=category_id)
+		label = request.GET.get('label') or None
+		try:
+			bucket = int(request.GET['price'])
+			low, high = price_bucket_range(bucket)
+		except (KeyError, ValueError):
+			# No price filter, or one that is not a bucket
+			bucket = None
+
+		products = Product.objects.filter(category=subcategory).only(*PRODUCT_CARD_FIELDS)
+		filters = {}
+		if label is not None:
+			products = products.filter(product_type_label=label)
+			filters['label'] = label
+		if bucket is not None:
+			if low is not None:
+				products = products.filter(price__gte=low)
+			if high is not None:
+				products = products.filter(price__lt=high)
+			filters['price'] = bucket
+
+		page = KeysetPaginator(products, self.paginate_by).page(
+			after=request.GET.get('after'),
+			before=request.GET.get('before'),
+		)
+		context = {
+			'subcategory': subcategory,
+			'facets': Facets(subcategory.facet_counts.all(), label=label, bucket=bucket),
+			'products': favorites.annotate(page.object_list, request.user),
+			'page': page,
+			'page_query': f'&{urlencode(filters)}' if filters else '',
+		}
+		return render(request, 'subcategory.html', context)
 
 
-class CategoryListView(LoginRequiredMixin, View):
+class SearchView(LoginRequiredMixin, View):
+	paginate_by = 24
+	max_pages = 50
 
 	def get(self, request, *args, **kwargs):
-		categories = ProductCategory.objects.all()
+		query = request.GET.get('q', '').strip()
+		try:
+			page_number = min(max(int(request.GET.get('page', 1)), 1), self.max_pages)
+		except ValueError:
+			page_number = 1
+		ids = search_product_ids(query, limit=self.paginate_by + 1, offset=(page_number - 1) * self.paginate_by)
+		has_next = len(ids) > self.paginate_by and page_number < self.max_pages
+		ids = ids[:self.paginate_by]
+		found = Product.objects.only(*PRODUCT_CARD_FIELDS).in_bulk(ids)
 		context = {
-			'categories': categories,
+			'query': query,
+			'products': favorites.annotate([found[pk] for pk in ids if pk in found], request.user),
+			'page_number': page_number,
+			'has_next': has_next,
 		}
-		return render(request, 'categories.html', context)
+		return render(request, 'search.html', context)
 
 
 class LoginPage(View):
@@ -116,223 +225,129 @@ class RegisterPage(View):
 		return render(request, 'register.html', context)
 
 
-@login_required
-def add_to_cart(request, product_id):
-	product = get_object_or_404(Product, pk=product_id)
-	order_product,created = OrderProduct.objects.get_or_create(user=request.user, product=product, order_status=False)
-	order_qs = Order.objects.filter(user=request.user, ordered=False)
-	if order_qs.exists():
-		order = order_qs[0]
-		if order.products.filter(product__pk=product.pk).exists():
-			order_product.quantity += 1
-			order_product.save()
-			messages.info(request, "Кол-во товара успешно обновлено!")
-			return redirect(request.META.get('HTTP_REFERER'))
-		else:
-			order.products.add(order_product)
-			messages.info(request, "Этот товар был добавлен вам в корзину!")
-			return redirect(request.META.get('HTTP_REFERER'))
+CART_BUSY_MESSAGE = 'Корзина обновляется, попробуйте еще раз'
+
+
+def _reserve_and_add(user, product_id):
+	inventory.reserve(user, product_id)
+	try:
+		return get_cart_backend().add(user, product_id)
+	except CartBusy:
+		inventory.release(user, product_id, 1)
+		raise
+
+
+@alogin_required
+async def add_to_cart(request, product_id):
+	try:
+		# One hop to the ORM thread for both writes
+		state = await sync_to_async(_reserve_and_add)(request.user, product_id)
+	except Product.DoesNotExist:
+		raise Http404
+	except inventory.OutOfStock:
+		messages.warning(request, "К сожалению, этого товара больше нет в наличии")
+		return redirect(request.META.get('HTTP_REFERER'))
+	except CartBusy:
+		messages.warning(request, CART_BUSY_MESSAGE)
+		return redirect(request.META.get('HTTP_REFERER'))
+	if state.quantity > 1:
+		messages.info(request, "Кол-во товара успешно обновлено!")
 	else:
-		ordered_date = timezone.now()
-		order = Order.objects.create(user=request.user, ordered_date=ordered_date)
-		order.products.add(order_product)
 		messages.info(request, "Этот товар был добавлен вам в корзину!")
-		return redirect(request.META.get('HTTP_REFERER'))
+	return redirect(request.META.get('HTTP_REFERER'))
 
 
 @login_required
 def remove_from_cart(request, product_id):
-	product = get_object_or_404(Product, pk=product_id)
-	order_qs = Order.objects.filter(user=request.user, ordered=False)
-	if order_qs.exists():
-		order = order_qs[0]
-		if order.products.filter(product__pk=product.pk).exists():
-			order_product = OrderProduct.objects.filter(product=product, user=request.user, order_status=False)[0]
-			order.products.remove(order_product)
-			order_product.delete()
-			messages.info(request, 'Этот продукт был успешно удален из вашей корзины')
-			return redirect(request.META.get('HTTP_REFERER'))
-		else:
-			messages.info(request, "Этого продукта нет у вас в корзине")
-			return redirect(request.META.get('HTTP_REFERER'))
+	try:
+		state = get_cart_backend().remove(request.user, product_id)
+	except CartBusy:
+		messages.warning(request, CART_BUSY_MESSAGE)
+		return redirect(request.META.get('HTTP_REFERER'))
+	if state:
+		inventory.release(request.user, product_id)
+		messages.info(request, 'Этот продукт был успешно удален из вашей корзины')
 	else:
 		messages.info(request, "Этого продукта нет у вас в корзине")
-		return redirect(request.META.get('HTTP_REFERER'))
+	return redirect(request.META.get('HTTP_REFERER'))
 
 
 @login_required
 def remove_product_for_order_sum(request, product_id):
-	product = get_object_or_404(Product, pk=product_id)
-	order_qs = Order.objects.filter(user=request.user, ordered=False)
-	if order_qs.exists():
-		order = order_qs[0]
-		if order.products.filter(product__pk=product.pk).exists():
-			order_product = OrderProduct.objects.filter(user=request.user, product=product, order_status=False)[0]
-			if order_product.quantity > 1:
-				order_product.quantity -= 1
-				order_product.save()
-			else:
-				order.products.remove(order_product)
-			messages.info(request, 'Кол-во этого товара было обновлено')
-			return redirect('order_sum')
-		else:
-			messages.info(request, 'Этого товара нет у вас в корзине')
-			return redirect('order_sum')
+	try:
+		state = get_cart_backend().decrement(request.user, product_id)
+	except CartBusy:
+		messages.warning(request, CART_BUSY_MESSAGE)
+		return redirect('order_sum')
+	if state:
+		inventory.release(request.user, product_id, 1)
+		messages.info(request, 'Кол-во этого товара было обновлено')
 	else:
-		messages.info(request, 'У вас нет активного заказа(корзины)')
-		return redirect('product', pk=product.pk)
+		messages.info(request, 'Этого товара нет у вас в корзине')
+	return redirect('order_sum')
 
 
 class CheckOutPage(LoginRequiredMixin, View):
 
 	def get(self, request, *args, **kwargs):
-		try:
-			order = Order.objects.get(user=request.user, ordered=False)
-			form = CheckOutForm()
-			context = {
-				'form': form,
-				'order': order, 
-				'couponform': CouponForm(),
-				'DISPLAY_COUPON_FORM': True,
-			}
-
-			shipping_address_qs = Address.objects.filter(
-				user=request.user,
-				address_type='S',
-				default=True,
-			)
-			if shipping_address_qs.exists():
-				context.update({'default_shipping_address': shipping_address_qs[0]})
-
-			billing_address_qs = Address.objects.filter(
-				user=request.user,
-				address_type='B',
-				default=True,
-			)
-			if billing_address_qs.exists():
-				context.upload({'default_billing_address': billing_address_qs[0]})
-			return render(request, 'chekout.html', context)
-		except ObjectDoesNotExist:
+		summary = get_cart_backend().summary(request.user)
+		if summary is None:
 			messages.info(self.request, "У вас нет активного заказа!")
-			return redirect('checkout')
+			return redirect('index')
+		defaults = checkout.default_addresses(request.user)
+		context = {
+			'form': CheckOutForm(),
+			'order': summary[0],
+			'couponform': CouponForm(),
+			'DISPLAY_COUPON_FORM': True,
+			'default_shipping_address': defaults.get('S'),
+			'default_billing_address': defaults.get('B'),
+		}
+		return render(request, 'chekout.html', context)
 
 	def post(self, request, *args, **kwargs):
 		form = CheckOutForm(request.POST or None)
+		if not form.is_valid():
+			messages.info(request, 'Выбрана недействительная платежная система')
+			return redirect('checkout')
 		try:
-			order = Order.objects.get(user=request.user, ordered=False)
-			if form.is_valid():
-				use_default_shipping = form.cleaned_data.get('use_default_shipping')
-				if use_default_shipping:
-					address_qs = Address.objects.filter(user=request.user, address_type='S', default=True)
-					if address_qs.exists():
-						shipping_address = address_qs[0]
-						order.shipping_address = shipping_address
-						order.save()
-					else:
-						messages.info(request, 'По умолчанию этот адрес не доступен')
-						return redirect('checkout')
-				else:
-					shipping_address1 = form.cleaned_data.get('shipping_address')
-					shipping_address2 = form.cleaned_data.get('shipping_address2')
-					shipping_country = form.cleaned_data.get('shipping_country')
-					shipping_zip = form.cleaned_data.get('shipping_zip')
-
-					if is_valid_form([shipping_address1, shipping_country, shipping_zip]):
-						shipping_address = Address(
-							user=request.user,
-							street_address=shipping_address1,
-							apartment_address=shipping_address2,
-							country=shipping_country,
-							zip=shipping_zip,
-							address_type='S'
-						)
-						shipping_address.save()
-
-						order.sipping_address = shipping_address
-						order.save()
-
-						set_default_shipping = form.cleaned_data.get('set_default_shipping')
-						if set_default_shipping:
-							shipping_address.default = True
-							shipping_address.save()
-					else:
-						messages.info(request, 'Пожалуйста, заполните обязательные поля адреса доставки ')
-
-				use_default_billing = form.cleaned_data.get('use_default_billing')
-				same_billing_address = form.cleaned_data.get('same_billing_address')
-
-				if same_billing_address:
-					billing_address = shipping_address
-					billing_address.pk = None
-					billing_address.save()
-					billing_address.address_type = 'B'
-					billing_address.save()
-					order.billing_address = billing_address
-					order.save()
-
-				elif use_default_billing:
-					address_qs = Address.objects.filter(
-						user=request.user,
-						address_type='B',
-						default=True
-					)
-					if address_qs.exists():
-						billing_address = address_qs[0]
-						order.billing_address = billing_address
-						order.save()
-					else:
-						messages.info(request, 'Нет доступных адресов такого типа по умолчанию')
-						return redirect('checkout')
-				else:
-					billing_address1 = form.cleaned_data.get('billing_address')
-					billing_address2 = form.cleaned_data.get('billing_address2')
-					billing_country = form.cleaned_data.get('billing_country')
-					billing_zip = form.cleaned_data.get('billing_zip')
-
-					if is_valid_form([billing_address1, billing_country, billing_zip]):
-						billing_address = Address(
-							user=request.user,
-							street_address=billing_address1,
-							apartment_address=billing_address2,
-							country=billing_country,
-							zip=billing_zip,
-							address_type='B'
-						)
-						billing_address.save()
-
-						order.billing_address = billing_address
-						order.save()
-
-						set_default_billing = form.cleaned_data.get('set_default_billing')
-						if set_default_billing:
-							billing_address.default = True
-							billing_address.save()
-					else:
-						messages.info(request, 'Пожалуйста, заполните обязательные поля платежного адреса ')
-
-				payment_option = form.cleaned_data.get('payment_option')
-
-				if payment_option == 'T':
-					return redirect('payment_page', payment_option='Tinkoff_bank')
-				elif payment_option == 'Z':
-					return redirect('payment_page', payment_option='ZberBank')
-				elif payment_option == 'U':
-					return redirect('payment_page', payment_option='UMoney')
-				else:
-					messages.info(request, 'Выбрана недействительная платежная система')
-					return redirect('checkout')
-
-		except ObjectDoesNotExist:
+			checkout.checkout(request.user, form.cleaned_data)
+		except Order.DoesNotExist:
 			messages.info(request, 'У вас нет активного заказа')
 			return redirect('order_sum')
+		except checkout.CheckoutError as e:
+			messages.info(request, str(e))
+			return redirect('checkout')
+		return redirect('payment_page', payment_option=checkout.PAYMENT_PAGES[form.cleaned_data['payment_option']])
+
+
+class AddCouponView(LoginRequiredMixin, View):
+
+	def post(self, request, *args, **kwargs):
+		form = CouponForm(request.POST)
+		if not form.is_valid():
+			messages.info(request, 'Введите промо-код')
+			return redirect('checkout')
+		order = get_cart_backend().materialize(request.user)
+		if order is None:
+			messages.info(request, 'У вас нет активного заказа')
+			return redirect('index')
+		try:
+			offer = coupons.apply(request.user, order.pk, form.cleaned_data['code'])
+		except coupons.CouponError as e:
+			messages.info(request, str(e))
+			return redirect('checkout')
+		messages.success(request, f'Промо-код применен: -{offer.amount} RUB')
+		return redirect('checkout')
 
 
 class PaymentPageForExample(LoginRequiredMixin, View):
 
 	def get(self, request, *args, **kwargs):
-		order = Order.objects.get(user=request.user, ordered=False)
+		order = Order.objects.select_related('coupon').get(user=request.user, ordered=False)
 		context = {
 			'order': order,
+			'order_products': order.products.select_related('product'),
 			'DISPLAY_COUPON_FORM': False,
 		}
 		user_profile = request.user.profile
@@ -340,46 +355,134 @@ class PaymentPageForExample(LoginRequiredMixin, View):
 			pass
 		return render(request, 'payment.html', context)
 
+	def post(self, request, payment_option, *args, **kwargs):
+		order = Order.objects.filter(user=request.user, ordered=False).first()
+		if order is None:
+			messages.info(request, 'У вас нет активного заказа')
+			return redirect('index')
+		if payment_option not in settings.PAYMENT_PROVIDERS:
+			messages.info(request, 'Выбрана недействительная платежная система')
+			return redirect('checkout')
+		# The charge runs in the payment worker, payment_status reports on it
+		job = payments.enqueue(order, payment_option)
+		if job.status not in ('pending', 'running'):
+			messages.info(request, 'Заказ уже оплачен')
+			return redirect('order_sum')
+		messages.info(request, 'Платеж обрабатывается, заказ будет оформлен после оплаты')
+		return redirect('index')
+
 
-class OrderSummaryPage(LoginRequiredMixin, View):
+@login_required
+def payment_status(request, ref_code):
+	"""
+	State of a queued payment, as JSON for pages polling it.
+	"""
+	job = PaymentJob.objects.filter(user=request.user, order__ref_code=ref_code).values(
+		'status', 'attempts', 'last_error', 'run_at', 'order__ordered',
+	).first()
+	if job is None:
+		raise Http404
+	return JsonResponse({
+		'ref_code': ref_code,
+		'status': job['status'],
+		'attempts': job['attempts'],
+		'error': job['last_error'] if job['status'] == 'failed' else '',
+		'next_attempt': job['run_at'] if job['status'] == 'pending' else None,
+		'ordered': job['order__ordered'],
+	})
+
+
+class RequestRefundPage(LoginRequiredMixin, View):
 
 	def get(self, request, *args, **kwargs):
+		return render(request, 'request_refund.html', {'form': RefundForm()})
+
+	def post(self, request, *args, **kwargs):
+		form = RefundForm(request.POST)
+		if not form.is_valid():
+			return render(request, 'request_refund.html', {'form': form})
+		data = form.cleaned_data
 		try:
-			order = Order.objects.get(user=self.request.user, ordered=False)
-			context = {
-				'order': order,
-			}
-			return render(request, 'order_summary.html', context)
-		except ObjectDoesNotExist:
+			refunds.request_refund(request.user, data['ref_code'], data['message'], data['email'])
+		except refunds.RefundError as e:
+			messages.info(request, str(e))
+			return redirect('request_refund')
+		messages.info(request, 'Запрос на возврат принят')
+		return redirect('index')
+
+
+class OrderSummaryPage(LoginRequiredMixin, View):
+
+	def get(self, request, *args, **kwargs):
+		summary = get_cart_backend().summary(request.user)
+		if summary is None:
 			messages.warning(request, "У вас нет возможных заказов")
 			return redirect('index')
+		order, order_products = summary
+		context = {
+			'order': order,
+			'order_products': order_products,
+		}
+		return render(request, 'order_summary.html', context)
 
 
-class FavoritesPage(LoginRequiredMixin, View):
+class FavoritesPage(AsyncLoginRequiredMixin, View):
 
-	def get(self, request, *args, **kwargs):
-		user_fav = Favorite.objects.filter(user=request.user).first()
+	async def get(self, request, *args, **kwargs):
+		# One query however many products are saved
+		products = Product.objects.filter(favorite__user=request.user).only(*PRODUCT_CARD_FIELDS)
+		products = await sync_to_async(list)(products)
+		navbar = await _navbar(request)
 		context = {
-			'user_fav': user_fav
+			'products': favorites.mark(products, {product.pk for product in products}),
+			'navbar': navbar,
 		}
 		return render(request, 'favorites.html', context)
 
 
-@login_required()
-def add_to_fav(request, product_id):
-	user = request.user
-	product = get_object_or_404(Product, pk=product_id)
-	favourites_qs = Favorite.objects.filter(user=user)
-	if favourites_qs.exists():
-		favorites = favourites_qs[0]
-		if favorites.fav_products.filter(pk=product_id).exists():
-			favorites.fav_products.remove(product)
-			messages.info(request, 'Продукт успешно удален из избранных')
-		else:
-			favorites.fav_products.add(product)
-			messages.info(request, 'Продукт успешно добавлен в избранные')
+@alogin_required
+async def add_to_fav(request, product_id):
+	try:
+		added = await sync_to_async(favorites.toggle)(request.user, product_id)
+	except Product.DoesNotExist:
+		raise Http404
+	if added:
+		messages.info(request, 'Продукт успешно добавлен в избранные')
 	else:
-		fav = Favorite.objects.create(user=request.user)
-		fav.fav_products.add(product)
-
-	return redirect(request.META.get('HTTP_REFERER'))
\ No newline at end of file
+		messages.info(request, 'Продукт успешно удален из избранных')
+	return redirect(request.META.get('HTTP_REFERER'))
+
+
+def _feed_token(request):
+	header = request.headers.get('Authorization', '')
+	if header.startswith('Bearer '):
+		return header[len('Bearer '):]
+	return request.GET.get('token', '')
+
+
+def product_feed(request, format):
+	"""
+	Streams the whole catalog, or only products changed after ``?since=``, as
+	CSV, JSON lines or XML. Open to staff and to FEED_TOKENS holders.
+	"""
+	token = _feed_token(request)
+	if not request.user.is_staff and not any(constant_time_compare(token, allowed) for allowed in settings.FEED_TOKENS):
+		return HttpResponse('Feed token required', status=401)
+	since = None
+	if request.GET.get('since'):
+		since = parse_datetime(request.GET['since'])
+		if since is None:
+			return HttpResponseBadRequest('since must be an ISO 8601 timestamp')
+		if timezone.is_naive(since):
+			since = timezone.make_aware(since)
+	# Read before the query, so the next incremental feed can start here
+	generated = timezone.now()
+	compress = 'gzip' in request.headers.get('Accept-Encoding', '')
+	rows = feeds.feed_rows(since, base_url=request.build_absolute_uri('/')[:-1])
+	response = StreamingHttpResponse(feeds.encode(feeds.render(rows, format), compress), content_type=feeds.FORMATS[format])
+	if compress:
+		response['Content-Encoding'] = 'gzip'
+	patch_vary_headers(response, ['Accept-Encoding', 'Authorization'])
+	response['Content-Disposition'] = f'attachment; filename="products.{format}"'
+	response['X-Feed-Generated-At'] = generated.isoformat()
+	return response